@@ -0,0 +1,273 @@
+"""Headless frame benchmark for the overworld game loop. The loop runs on SDL's dummy video driver with no window and
+no frame cap, driven by a scripted walk instead of the keyboard. Every phase of every frame is timed, and the results
+are written as JSON so that a change to the hot paths can be compared against a saved baseline:
+        python benchmark.py --output before.json
+        python benchmark.py --output after.json --baseline before.json
+
+Phases timed once per frame:
+        events      pygame.event.get() and Overworld.handleevent()
+        update      Overworld.update(): map loader polling, ENTITIES.update(), camera
+        draw        Overworld.draw(): map tile repaints, dirty rectangles, layer compositing
+        present     Overworld.present(): pygame.display.update()
+        frame       all of the above
+Phases timed once per load (repeated --loads times):
+        map_load            building a Map from its file, including tile lookups
+        collision_build     compilecollision()
+        full_redraw         a full-screen redraw, including compositing the visible chunks
+
+The overworld's snowfall is included, with --snow N flakes at most; --snow 0 turns it off.
+
+With --entities N, N wandering Entities are added to the map's EntityStore, each picking a new direction every second,
+to measure how the update and draw phases scale with the number of Entities.
+
+With --startup, the cold start is timed instead, each step in a fresh interpreter so that nothing is already imported:
+        python              starting the interpreter alone, the baseline the others include
+        spells              importing spells
+        playercharacters    importing playercharacters
+        mirrorgame          importing mirrorgame
+        first_frame         importing mirrorgame, then startup() and drawing and presenting the first frame
+Each is checked against its budget in STARTUP_BUDGETS."""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# The dummy drivers must be selected before pygame is imported.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+import mirrorgame
+
+from pygame.locals import *
+from typing import *
+
+FRAME_PHASES = ('events', 'update', 'draw', 'present', 'frame')
+WANDER_VELOCITIES = np.array([(0, 0), (0, 2), (0, -2), (-2, 0), (2, 0)], np.int32)  # Directions Entities wander in.
+LOAD_PHASES = ('map_load', 'collision_build', 'full_redraw')
+
+# The code timed for each startup step, and the most each may take in seconds, on top of starting the interpreter.
+STARTUP_STEPS = {
+    'python': 'pass',
+    'spells': 'import spells',
+    'playercharacters': 'import playercharacters',
+    'mirrorgame': 'import mirrorgame',
+    'first_frame': 'import mirrorgame; overworld, _ = mirrorgame.startup([\'--no-autosave\']); '
+                   'overworld.present(overworld.draw())',
+}
+STARTUP_BUDGETS = {'spells': 0.05, 'playercharacters': 0.05, 'mirrorgame': 0.5, 'first_frame': mirrorgame.STARTUP_BUDGET}
+
+# The default input script: a walk around North Square, with some running. Each entry is (frame, event type, key).
+WALK_SCRIPT = [
+    (10, KEYDOWN, K_d), (70, KEYUP, K_d),
+    (80, KEYDOWN, K_w), (81, KEYDOWN, K_SPACE), (140, KEYUP, K_w),
+    (150, KEYDOWN, K_a), (230, KEYUP, K_a), (231, KEYUP, K_SPACE),
+    (240, KEYDOWN, K_s), (330, KEYUP, K_s),
+    (340, KEYDOWN, K_d), (341, KEYDOWN, K_SPACE), (400, KEYUP, K_d), (401, KEYUP, K_SPACE),
+]
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """Get a nearest-rank percentile of some samples."""
+    ordered = sorted(samples)
+    rank = max(1, int(round(fraction * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summarize timings, given in seconds, as milliseconds."""
+    if not samples:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+    return {
+        'count': len(samples),
+        'mean': 1000 * sum(samples) / len(samples),
+        'p50': 1000 * percentile(samples, 0.50),
+        'p99': 1000 * percentile(samples, 0.99),
+        'max': 1000 * max(samples),
+    }
+
+
+def scriptevents(script: List[Tuple[int, int, int]]) -> Dict[int, List[pygame.event.Event]]:
+    """Group a script's events by the frame they are fed on."""
+    events = dict()
+    for frame, type, key in script:
+        events.setdefault(frame, list()).append(pygame.event.Event(type, key=key))
+    return events
+
+
+def spawnwanderers(count: int, area: pygame.Rect, rng: np.random.RandomState) -> np.ndarray:
+    """Add Entities at random positions in an area of the world. Returns their slots."""
+    xs = rng.randint(area.left, area.right - mirrorgame.TILESIZE + 1, count)
+    ys = rng.randint(area.top, area.bottom - mirrorgame.TILESIZE + 1, count)
+    return np.array([mirrorgame.ENTITY_STORE.spawn((int(x), int(y))) for x, y in zip(xs, ys)], np.int64)
+
+
+def wander(slots: np.ndarray, rng: np.random.RandomState):
+    """Send some Entities off in random directions, or stop them."""
+    velocities = WANDER_VELOCITIES[rng.randint(0, len(WANDER_VELOCITIES), len(slots))]
+    mirrorgame.ENTITY_STORE.setvelocity(slots, velocities[:, 0], velocities[:, 1])
+
+
+def run(filename: str, frames: int, loads: int, script: List[Tuple[int, int, int]],
+        entities: int = 0, snow: int = mirrorgame.SNOW_BUDGET) -> Dict[str, Any]:
+    """Run the benchmark and return its results."""
+    display = mirrorgame.opendisplay()
+    mirrorgame.SNOW_BUDGET = snow
+    timings = {phase: list() for phase in LOAD_PHASES + FRAME_PHASES}
+    clock = time.perf_counter
+
+    overworld = mirrorgame.Overworld(display, filename)
+    overworld.draw()  # Warm up: composite the first frame before anything is timed.
+
+    # Load phases
+    for _ in range(loads):
+        start = clock()
+        map = mirrorgame.Map(filename)
+        timings['map_load'].append(clock() - start)
+
+        start = clock()
+        mirrorgame.compilecollision(map)
+        timings['collision_build'].append(clock() - start)
+
+        overworld.renderer.setmap(map)
+        start = clock()
+        overworld.draw()
+        timings['full_redraw'].append(clock() - start)
+
+    # Put the overworld's own map back before walking around it.
+    mirrorgame.compilecollision(overworld.map)
+    overworld.renderer.setmap(overworld.map)
+    overworld.present(overworld.draw())
+
+    # Frame phases
+    rng = np.random.RandomState(0)
+    wanderers = spawnwanderers(entities, overworld.map.pixelrect(), rng)
+    scripted = scriptevents(script)
+    for frame in range(frames):
+        if frame % mirrorgame.TICKRATE == 0:
+            wander(wanderers, rng)
+        framestart = start = clock()
+        for event in pygame.event.get() + scripted.get(frame, list()):
+            overworld.handleevent(event)
+        timings['events'].append(clock() - start)
+
+        start = clock()
+        overworld.update()
+        timings['update'].append(clock() - start)
+
+        start = clock()
+        rects = overworld.draw()
+        timings['draw'].append(clock() - start)
+
+        start = clock()
+        overworld.present(rects)
+        end = clock()
+        timings['present'].append(end - start)
+        timings['frame'].append(end - framestart)
+
+    overworld.loader.stop()
+    mirrorgame.ENTITY_STORE.clear()
+    return {
+        'benchmark': 'overworld',
+        'map': filename,
+        'frames': frames,
+        'loads': loads,
+        'entities': entities,
+        'snow': snow,
+        'particles': mirrorgame.EFFECT_PARTICLES.count() + mirrorgame.FOREGROUND_PARTICLES.count(),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'video_driver': pygame.display.get_driver(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'player_rect': list(overworld.player.rect),
+        'tilesets': mirrorgame.TILESETS.stats(),
+        'phases': {phase: summarize(samples) for phase, samples in timings.items()},
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print each phase's p50 and p99 next to a baseline's."""
+    print('%-16s %10s %10s %8s %10s %10s %8s' % ('phase', 'base p50', 'p50', 'change', 'base p99', 'p99', 'change'))
+    for phase, stats in results['phases'].items():
+        base = baseline['phases'].get(phase)
+        if base is None:
+            continue
+        changes = ['%+7.1f%%' % (100 * (stats[key] - base[key]) / base[key]) if base[key] else '     n/a'
+                   for key in ('p50', 'p99')]
+        print('%-16s %10.3f %10.3f %s %10.3f %10.3f %s' % (phase, base['p50'], stats['p50'], changes[0],
+                                                           base['p99'], stats['p99'], changes[1]))
+
+
+def startup(runs: int) -> Dict[str, Any]:
+    """Time each startup step in STARTUP_STEPS, runs times, each in a new interpreter. Returns the results."""
+    timings = {step: list() for step in STARTUP_STEPS}
+    for _ in range(runs):
+        for step, code in STARTUP_STEPS.items():
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL)
+            timings[step].append(time.perf_counter() - start)
+
+    return {
+        'runs': runs,
+        'python': platform.python_version(),
+        'steps': {step: summarize(samples) for step, samples in timings.items()},
+    }
+
+
+def checkstartup(results: Dict[str, Any]) -> bool:
+    """Print each startup step's median time, less the interpreter's own, against its budget. Returns whether every
+    step was within budget."""
+    baseline = results['steps']['python']['p50']
+    within = True
+    print('%-18s %10s %10s' % ('step', 'p50 ms', 'budget ms'))
+    for step, stats in results['steps'].items():
+        cost = stats['p50'] - baseline if step != 'python' else stats['p50']
+        budget = STARTUP_BUDGETS.get(step)
+        over = budget is not None and cost > 1000 * budget
+        within = within and not over
+        print('%-18s %10.1f %10s%s' % (step, cost, '%.0f' % (1000 * budget) if budget is not None else '-',
+                                       '   over budget' if over else ''))
+    return within
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description='Run the overworld loop headless and time each phase.')
+    parser.add_argument('--map', default='northsalkstonmap.ini', help='the map file in data/maps to walk around')
+    parser.add_argument('--frames', type=int, default=600, help='the number of frames to run')
+    parser.add_argument('--loads', type=int, default=20, help='the number of times to time map loading')
+    parser.add_argument('--entities', type=int, default=0, help='the number of wandering Entities to add')
+    parser.add_argument('--snow', type=int, default=mirrorgame.SNOW_BUDGET, help='the most snowflakes to have falling')
+    parser.add_argument('--output', default='benchmark.json', help='where to write the results')
+    parser.add_argument('--baseline', help='earlier results to compare against')
+    parser.add_argument('--startup', type=int, metavar='RUNS', help='time the cold start instead, this many times')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        results = startup(args.startup)
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2)
+        within = checkstartup(results)
+        print('Results written to %s' % args.output)
+        return 0 if within else 1
+
+    results = run(args.map, args.frames, args.loads, WALK_SCRIPT, args.entities, args.snow)
+    with open(args.output, 'w') as out:
+        json.dump(results, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
+    else:
+        for phase, stats in results['phases'].items():
+            print('%-16s p50 %8.3f ms   p99 %8.3f ms' % (phase, stats['p50'], stats['p99']))
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
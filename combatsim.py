@@ -0,0 +1,250 @@
+"""Headless combat simulator for balance sweeps. A party built from jobs_dict fights a single enemy, many times over
+with different seeds, at each level being tuned. The battles are split into batches that run in a pool of worker
+processes, and each batch returns only running totals, so millions of battles cost little more to collect than a
+thousand:
+        python combatsim.py --party Mage,Mage,Mage,Mage --levels 1-40 --battles 100000 --output sweep.json
+
+There is no combat loop in the game yet, so the rules here are a stand-in to tune against, kept simple and in one place:
+    - Party members act in order, then the enemy acts. A battle that reaches MAX_TURNS turns is a loss.
+    - A party member heals the most injured ally with their strongest affordable healing spell when any ally is below
+      HEAL_THRESHOLD of their maximum HP; otherwise they cast their strongest affordable damage spell, or failing that,
+      make a basic attack for their STR, give or take 10%.
+    - Spells deal spelldamage() of their potency, using the caster's stat for the spell's school of magic in
+      SCHOOL_STATS, and cost their 'cost' from spells_dict, or MP_PER_RANK MP per rank if they have none.
+    - The enemy hits a random living party member for its attack, give or take 15%, less a quarter of their CON.
+
+Statistics are reported per level band:
+        win_rate            the fraction of battles won
+        turns_to_kill       the mean number of turns taken to win
+        mana_efficiency     HP dealt or healed by spells per MP spent
+        survivors           the mean number of party members left standing after a win"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+
+from random import Random
+from typing import *
+
+import playercharacters
+import spells
+
+MAX_TURNS = 100  # The number of turns after which a battle counts as lost.
+HEAL_THRESHOLD = 0.5  # The fraction of maximum HP below which a party member is healed.
+MP_PER_RANK = 4  # The MP cost per rank of a spell that has no 'cost' in spells_dict.
+SCHOOL_STATS = {'Nature': 'will', 'Elemental': 'int', 'Crystal': 'int'}  # The stat that powers each school of magic.
+BATCH_SIZE = 2000  # The number of battles each worker task runs.
+
+
+class Enemy(NamedTuple):
+    """The opponent in a simulated battle."""
+    name: str
+    hp: int
+    attack: int
+
+
+def scaledenemy(level: int) -> Enemy:
+    """Get a standard enemy for a level, to measure parties against while there are no enemy tables."""
+    return Enemy('Training Dummy L%d' % level, 120 + 40 * level * level, 12 + 6 * level)
+
+
+class Member:
+    """A party member's fixed numbers for a battle, worked out once per level so that battles only look them up."""
+    job: str  # The job the member was built from.
+    hp: int  # Maximum HP.
+    mp: int  # Maximum MP.
+    strength: int  # STR, used for basic attacks.
+    con: int  # CON, which softens enemy attacks.
+    heals: List[Tuple[int, int]]  # (amount, cost) for each healing spell, strongest first.
+    attacks: List[Tuple[int, int]]  # (damage, cost) for each damage spell, strongest first.
+
+    def __init__(self, job: str, level: int, spellids: Sequence[str]):
+        table = playercharacters.JOB_TABLES[job]
+        stats = table.statsat(level)
+        self.job = job
+        self.hp = stats['hp']
+        self.mp = stats['mp']
+        self.strength = stats['str']
+        self.con = stats['con']
+        self.heals = list()
+        self.attacks = list()
+        for id in spellids:
+            spell = spells.SPELLS[id]
+            output = spells.spelldamage(stats[SCHOOL_STATS.get(spell.category, 'int')], level, spell.potency)
+            cost = spells.spells_dict[id].get('cost', MP_PER_RANK * spell.rank)
+            (self.heals if 'heal' in spell.flags else self.attacks).append((output, cost))
+        self.heals.sort(reverse=True)
+        self.attacks.sort(reverse=True)
+
+
+def partyspells(job: str, level: int) -> List[str]:
+    """Get the spells a member of a job starts with and could slot by a level: their starting spells that exist in
+    spells_dict, plus every catalogued spell the job can slot. For now, a rank can be slotted every five levels."""
+    start = playercharacters.jobs_dict[job]['start_spells']
+    ids = [id for learned, names in start.items() if learned <= level for id in names if id in spells.spells_dict]
+    ids += [spell.id for spell in spells.SPELLS.query(job=job, maxrank=1 + level // 5) if spell.id not in ids]
+    return ids
+
+
+def battle(party: List[Member], enemy: Enemy, rng: Random) -> Tuple[bool, int, int, int, int]:
+    """Fight one battle. Returns whether the party won, the turns taken, the MP spent, the HP dealt or healed by
+    spells, and the number of party members left standing."""
+    hp = [member.hp for member in party]
+    mp = [member.mp for member in party]
+    thresholds = [HEAL_THRESHOLD * member.hp for member in party]
+    enemyhp = enemy.hp
+    spent = 0
+    output = 0
+    for turn in range(1, MAX_TURNS + 1):
+        for index, member in enumerate(party):
+            if hp[index] <= 0:
+                continue
+
+            # Heal the most injured ally if anyone is badly hurt.
+            hurt = [ally for ally in range(len(party)) if 0 < hp[ally] < thresholds[ally]]
+            if hurt and member.heals:
+                injured = min(hurt, key=lambda ally: hp[ally] / party[ally].hp)
+                heal = next((spell for spell in member.heals if spell[1] <= mp[index]), None)
+                if heal is not None:
+                    healed = min(heal[0], party[injured].hp - hp[injured])
+                    hp[injured] += healed
+                    mp[index] -= heal[1]
+                    spent += heal[1]
+                    output += healed
+                    continue
+
+            attack = next((spell for spell in member.attacks if spell[1] <= mp[index]), None)
+            if attack is not None:
+                enemyhp -= attack[0]
+                mp[index] -= attack[1]
+                spent += attack[1]
+                output += attack[0]
+            else:
+                enemyhp -= int(member.strength * rng.uniform(0.9, 1.1))
+            if enemyhp <= 0:
+                return True, turn, spent, output, sum(1 for value in hp if value > 0)
+
+        # The enemy strikes back.
+        living = [index for index in range(len(party)) if hp[index] > 0]
+        if not living:
+            return False, turn, spent, output, 0
+        target = rng.choice(living)
+        hp[target] -= max(1, int(enemy.attack * rng.uniform(0.85, 1.15)) - party[target].con // 4)
+        if all(value <= 0 for value in hp):
+            return False, turn, spent, output, 0
+
+    return False, MAX_TURNS, spent, output, sum(1 for value in hp if value > 0)
+
+
+def newtotals() -> Dict[str, int]:
+    return {'battles': 0, 'wins': 0, 'win_turns': 0, 'mp_spent': 0, 'spell_output': 0, 'survivors': 0}
+
+
+def runbatch(task: Tuple[Tuple[str, ...], int, int, int]) -> Tuple[int, Dict[str, int]]:
+    """Run a batch of battles for one party at one level. task is (jobs, level, seed, battles). The batch draws from
+    one generator seeded with seed, so a sweep gives the same results however its batches are spread across
+    processes. Returns the level and the batch's running totals."""
+    jobs, level, seed, count = task
+    party = [Member(job, level, partyspells(job, level)) for job in jobs]
+    enemy = scaledenemy(level)
+    totals = newtotals()
+    rng = Random(seed)
+    for _ in range(count):
+        won, turns, spent, output, survivors = battle(party, enemy, rng)
+        totals['battles'] += 1
+        totals['mp_spent'] += spent
+        totals['spell_output'] += output
+        if won:
+            totals['wins'] += 1
+            totals['win_turns'] += turns
+            totals['survivors'] += survivors
+    return level, totals
+
+
+def summarize(totals: Dict[str, int]) -> Dict[str, float]:
+    """Turn a level band's running totals into its statistics."""
+    wins = totals['wins']
+    return {
+        'battles': totals['battles'],
+        'win_rate': wins / totals['battles'] if totals['battles'] else 0.0,
+        'turns_to_kill': totals['win_turns'] / wins if wins else None,
+        'mana_efficiency': totals['spell_output'] / totals['mp_spent'] if totals['mp_spent'] else None,
+        'survivors': totals['survivors'] / wins if wins else None,
+    }
+
+
+def sweep(jobs: Sequence[str], levels: Sequence[int], battles: int, seed: int = 0, bandsize: int = 5,
+          processes: int = None) -> Dict[str, Dict[str, float]]:
+    """Simulate battles for a party at each of some levels, across a pool of worker processes. Returns the statistics
+    for each band of bandsize levels, keyed by its range, e.g. '1-5'."""
+    tasks = list()
+    for level in levels:
+        for start in range(0, battles, BATCH_SIZE):
+            # Give each batch its own seed, derived from the sweep's seed, the level, and the batch's position.
+            tasks.append((tuple(jobs), level, (seed * 1009 + level) * 100003 + start // BATCH_SIZE,
+                          min(BATCH_SIZE, battles - start)))
+
+    bands = dict()
+    with multiprocessing.Pool(processes) as pool:
+        for level, totals in pool.imap_unordered(runbatch, tasks):
+            low = (level - 1) // bandsize * bandsize + 1
+            band = bands.setdefault(low, newtotals())
+            for key, value in totals.items():
+                band[key] += value
+
+    return {'%d-%d' % (low, low + bandsize - 1): summarize(bands[low]) for low in sorted(bands)}
+
+
+def parselevels(text: str) -> List[int]:
+    """Parse a level list like '1-40' or '1,5,10-12'."""
+    levels = list()
+    for part in text.split(','):
+        low, _, high = part.partition('-')
+        levels.extend(range(int(low), int(high or low) + 1))
+    return levels
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description='Simulate battles to measure party balance by level.')
+    parser.add_argument('--party', default='Mage,Mage,Mage,Mage', help='comma-separated jobs from jobs_dict')
+    parser.add_argument('--levels', default='1-40', help="levels to simulate, e.g. '1-40' or '1,5,10-12'")
+    parser.add_argument('--battles', type=int, default=10000, help='battles to simulate at each level')
+    parser.add_argument('--band', type=int, default=5, help='the number of levels in each reported band')
+    parser.add_argument('--seed', type=int, default=0, help='the seed for the whole sweep')
+    parser.add_argument('--processes', type=int, help='worker processes to use (default: one per CPU)')
+    parser.add_argument('--output', help='where to write the results as JSON')
+    args = parser.parse_args(argv)
+
+    jobs = args.party.split(',')
+    for job in jobs:
+        if job not in playercharacters.JOB_TABLES:
+            parser.error('unknown job %r' % job)
+    levels = parselevels(args.levels)
+    if not levels or min(levels) < 1 or max(levels) > playercharacters.MAX_LEVEL:
+        parser.error('levels must be from 1 to %d' % playercharacters.MAX_LEVEL)
+
+    start = time.perf_counter()
+    results = sweep(jobs, levels, args.battles, args.seed, args.band, args.processes)
+    elapsed = time.perf_counter() - start
+
+    print('%-8s %10s %9s %14s %16s %10s' % ('levels', 'battles', 'win rate', 'turns to kill', 'mana efficiency',
+                                            'survivors'))
+    for band, stats in results.items():
+        print('%-8s %10d %8.1f%% %14s %16s %10s' % (
+            band, stats['battles'], 100 * stats['win_rate'],
+            '%.2f' % stats['turns_to_kill'] if stats['turns_to_kill'] is not None else '-',
+            '%.2f' % stats['mana_efficiency'] if stats['mana_efficiency'] is not None else '-',
+            '%.2f' % stats['survivors'] if stats['survivors'] is not None else '-'))
+    total = len(levels) * args.battles
+    print('%d battles in %.1f s (%.0f battles/s)' % (total, elapsed, total / elapsed if elapsed else 0.0))
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump({'party': jobs, 'levels': levels, 'battles': args.battles, 'seed': args.seed,
+                       'bands': results}, out, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
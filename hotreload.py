@@ -0,0 +1,63 @@
+"""Support for watch mode, which applies edits to maps, tilesets and game data while the game runs. A FileWatcher notices
+which files have changed since it last looked; the game then reads each one again and rebuilds only what differs from
+what it has loaded.
+
+Game data such as jobs_dict and spells_dict lives in Python modules. Rather than re-importing a module, which would
+replace every object other modules hold and run its top-level code again, readliteral() reads just the one dictionary
+from the edited source, and the module that owns it merges the changes in."""
+
+import ast
+import glob
+import os
+
+from typing import *
+
+
+class FileWatcher:
+    """Notices when files matching a set of glob patterns are created or changed, by comparing their modification times
+    and sizes with those seen by the last poll(). Checking a handful of files costs a few stat() calls, so polling can
+    be done from the game loop, without a background thread."""
+    patterns: List[str]  # Glob patterns naming the files to watch, e.g. 'data/maps/*.ini'.
+    stamps: Dict[str, Tuple[int, int]]  # The modification time in nanoseconds and size of each file, keyed by path.
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(patterns)
+        self.stamps = self.scan()
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        """Get the modification time and size of every file matching the patterns."""
+        stamps = dict()
+        for pattern in self.patterns:
+            for path in glob.glob(pattern):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # The file was removed after glob() found it.
+                stamps[os.path.normpath(path)] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def poll(self) -> List[str]:
+        """Get the paths of the files created or changed since the last poll, in sorted order. Removed files are
+        forgotten, and reported again if they come back."""
+        stamps = self.scan()
+        changed = sorted(path for path, stamp in stamps.items() if self.stamps.get(path) != stamp)
+        self.stamps = stamps
+        return changed
+
+
+def readliteral(path: str, name: str) -> Any:
+    """Read the value assigned to a top-level name in a Python source file, without importing or running it. The value
+    must be a literal: dicts, lists, tuples, sets, strings, numbers, booleans and None. Raises SyntaxError if the file
+    doesn't parse, e.g. because it is half saved, and ValueError if the name isn't assigned a literal."""
+    with open(path, encoding='utf-8') as file:
+        tree = ast.parse(file.read(), path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == name
+                                                for target in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError('%s does not assign %s.' % (path, name))
+
+
+def changedkeys(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """Get the keys that were added, changed or removed between two versions of a dictionary, in sorted order."""
+    return sorted(key for key in old.keys() | new.keys() if key not in old or key not in new or old[key] != new[key])
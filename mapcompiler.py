@@ -0,0 +1,312 @@
+"""Compiles .ini map files into a compact binary format, and loads maps from it. The .ini files in data/maps remain the
+source format; compiled copies are kept in data/maps/compiled and are rebuilt automatically whenever their source file
+changes. Run this module directly to compile every map ahead of time:
+        python mapcompiler.py [filename ...]
+
+The compiled format is little-endian and laid out as follows:
+        Header:     magic (4s), format version (H), width (H), height (H), encounter rate (i), tile count (H),
+                    spawn count (H), source modification time in nanoseconds (q), source size in bytes (q)
+        Strings:    zone, map name, encounter set, weather
+        Tile IDs:   one string per tile table entry. Entry 0 is always the null tile, '00000000000'.
+        Layers:     width * height tile table indexes (H) for the background, then the same for the foreground.
+        Spawns:     spawn name, x (h), y (h), and linked map filename (empty if none), for each spawn point.
+Strings are stored as a length (H) followed by that many bytes of UTF-8.
+
+A spawn point is where the party appears when it arrives from a neighbouring map. A spawn line in an .ini file can name
+that map in an optional fourth field, e.g. 'WpnShop|03|04|wpnshopsalkstonmap.ini'. Without one, the neighbour is assumed
+to follow the naming of existing maps: the spawn name followed by the zone, e.g. 'wpnshopsalkstonmap.ini'.
+
+A map's header line can name its weather in an optional fifth field, e.g. 'Salkston|North Square|0|null|snow'. Maps
+without one, such as interiors, have no weather."""
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from array import array
+from typing import *
+
+MAPS_DIR = os.path.join('data', 'maps')  # The directory holding .ini map files.
+COMPILED_DIR = os.path.join(MAPS_DIR, 'compiled')  # The directory holding compiled map files.
+COMPILED_EXT = '.socmap'  # The file extension for compiled maps.
+MAGIC = b'SOCM'  # Identifies a compiled map file.
+VERSION = 3  # Bump this whenever the compiled format changes; older files are recompiled.
+NULL_TILE = '00000000000'  # The tile ID representing an empty cell.
+MAP_WIDTH = 16  # The default width of a map in tiles: the size of the game window.
+MAP_HEIGHT = 12  # The default height of a map in tiles: the size of the game window.
+NO_WEATHER = 'none'  # The weather on maps whose header doesn't name any, such as interiors and caves.
+
+HEADER = struct.Struct('<4sHHHiHHqq')
+LENGTH = struct.Struct('<H')
+SPAWN = struct.Struct('<hh')
+
+
+class MapData:
+    """The logical contents of a map file: tile IDs, layers, and spawn points, with no pygame objects. Each layer is a
+    row-major array of indexes into tileids, where index 0 is the null tile."""
+    zone: str  # The zone that this map belongs to.
+    name: Optional[str]  # The name of this map, if any.
+    encounter_rate: int  # The number of enemy encounters to spawn when entering this map.
+    encounter_set: str  # The encounter set named in the map header.
+    weather: str  # The weather named in the map header, e.g. 'snow', or NO_WEATHER.
+    width: int  # The width of the map in tiles.
+    height: int  # The height of the map in tiles.
+    tileids: List[str]  # The tile table. Entry 0 is always the null tile.
+    backtiles: array  # Row-major tile table indexes representing the background.
+    foretiles: array  # Row-major tile table indexes representing the foreground.
+    spawns: Dict[str, Tuple[int, int]]  # The available spawn points for the player.
+    links: Dict[str, str]  # The neighbouring map filenames named by spawn points, keyed by spawn name.
+
+    def __init__(self, width: int = MAP_WIDTH, height: int = MAP_HEIGHT):
+        self.zone = ''
+        self.name = None
+        self.encounter_rate = 0
+        self.encounter_set = 'null'
+        self.weather = NO_WEATHER
+        self.width = width
+        self.height = height
+        self.tileids = [NULL_TILE]
+        self.backtiles = array('H', bytes(2 * width * height))
+        self.foretiles = array('H', bytes(2 * width * height))
+        self.spawns = dict()
+        self.links = dict()
+
+
+def parseini(path: str) -> MapData:
+    """Read a map from its .ini source file. Maps can be any size; the width is taken from the rows and the height
+    from the number of rows before the next section title."""
+    with open(path) as mapdata:
+        lines = [line.rstrip('\n') for line in mapdata]
+
+    def readlayer(start: int) -> Tuple[List[List[str]], int]:
+        # Collect rows of tile IDs until the next section title. Returns the rows and the position of the title.
+        rows = list()
+        position = start
+        while position < len(lines) and '|' in lines[position]:
+            rows.append(lines[position].split('|'))  # Break up the row using pipes.
+            position += 1
+        return rows, position
+
+    # Header. Section titles are included in map files for readability, so lines[0] is skipped.
+    splitline = lines[1].split('|')  # Split the header line using pipes.
+
+    # Background and Foreground, each following its section title.
+    backrows, position = readlayer(3)
+    forerows, position = readlayer(position + 1)
+
+    data = MapData(len(backrows[0]), len(backrows))
+    data.zone = splitline[0]  # Get the zone name from the header line.
+
+    # If a map name is specified, set the name. Otherwise, leave it as None.
+    if splitline[1] != 'none':
+        data.name = splitline[1]
+
+    data.encounter_rate = int(splitline[2])  # Get the encounter rate from the header line.
+    if len(splitline) > 3:
+        data.encounter_set = splitline[3]
+    if len(splitline) > 4:
+        data.weather = splitline[4]
+
+    # Look up each entry in the tile table, adding IDs the first time they are seen. A value of '00000000000'
+    # indicates a null tile, which is always index 0.
+    indexes = {NULL_TILE: 0}
+    for rows, layer in ((backrows, data.backtiles), (forerows, data.foretiles)):
+        if len(rows) != data.height or any(len(row) != data.width for row in rows):
+            raise ValueError('%s: every layer must be %d tiles by %d tiles.' % (path, data.width, data.height))
+        for y, row in enumerate(rows):
+            for x, id in enumerate(row):
+                index = indexes.get(id)
+                if index is None:
+                    index = len(data.tileids)
+                    data.tileids.append(id)
+                    indexes[id] = index
+                layer[y * data.width + x] = index
+
+    # Player Spawn Locations, following their section title.
+    for line in lines[position + 1:]:
+        if line == 'END OF FILE':
+            break
+        splitline = line.split('|')
+        data.spawns[splitline[0]] = (int(splitline[1]), int(splitline[2]))
+        if len(splitline) > 3 and splitline[3]:
+            data.links[splitline[0]] = splitline[3]
+
+    return data
+
+
+def formatini(data: MapData) -> str:
+    """Write a MapData out in the .ini source format, as read by parseini()."""
+    lines = ['HEADER', '|'.join((data.zone, data.name if data.name is not None else 'none', str(data.encounter_rate),
+                                 data.encounter_set, data.weather))]
+    for title, layer in (('BACKGROUND', data.backtiles), ('FOREGROUND', data.foretiles)):
+        lines.append(title)
+        for y in range(data.height):
+            lines.append('|'.join(data.tileids[index] for index in layer[y * data.width:(y + 1) * data.width]))
+    lines.append('PLAYER SPAWNS')
+    for spawn, (x, y) in data.spawns.items():
+        fields = [spawn, '%02d' % x, '%02d' % y]
+        if spawn in data.links:
+            fields.append(data.links[spawn])
+        lines.append('|'.join(fields))
+    lines.append('END OF FILE')
+    return '\n'.join(lines) + '\n'
+
+
+def packstring(value: str) -> bytes:
+    encoded = value.encode('utf-8')
+    return LENGTH.pack(len(encoded)) + encoded
+
+
+def writecompiled(data: MapData, target: str, source_mtime: int = 0, source_size: int = 0):
+    """Write a MapData to a compiled map file. The file is written to a temporary name and then moved into place, so
+    a reader never sees a partially written map."""
+    layers = array('H', data.backtiles)
+    layers.extend(data.foretiles)
+    if sys.byteorder == 'big':
+        layers.byteswap()
+
+    chunks = [HEADER.pack(MAGIC, VERSION, data.width, data.height, data.encounter_rate, len(data.tileids),
+                          len(data.spawns), source_mtime, source_size),
+              packstring(data.zone),
+              packstring(data.name if data.name is not None else 'none'),
+              packstring(data.encounter_set),
+              packstring(data.weather)]
+    chunks.extend(packstring(id) for id in data.tileids)
+    chunks.append(layers.tobytes())
+    for spawn, (x, y) in data.spawns.items():
+        chunks.append(packstring(spawn))
+        chunks.append(SPAWN.pack(x, y))
+        chunks.append(packstring(data.links.get(spawn, '')))
+
+    # Each write gets its own temporary file, as the map loader thread and the main thread may compile the same map at
+    # once.
+    directory = os.path.dirname(target) or '.'
+    os.makedirs(directory, exist_ok=True)
+    out = tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(target) + '.', suffix='.tmp', delete=False)
+    try:
+        with out:
+            out.write(b''.join(chunks))
+        os.replace(out.name, target)
+    except BaseException:
+        os.remove(out.name)
+        raise
+
+
+def readcompiled(path: str) -> MapData:
+    """Load a MapData from a compiled map file. The file is memory-mapped and the layers are copied out as whole
+    arrays, with no per-cell parsing. Raises ValueError if the file isn't a compiled map of the current version."""
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        magic, version, width, height, rate, ntiles, nspawns, _, _ = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d compiled map.' % (path, VERSION))
+        offset = HEADER.size
+
+        def readstring() -> str:
+            nonlocal offset
+            length, = LENGTH.unpack_from(view, offset)
+            offset += LENGTH.size
+            value = view[offset:offset + length].decode('utf-8')
+            offset += length
+            return value
+
+        data = MapData(width, height)
+        data.zone = readstring()
+        data.name = readstring()
+        if data.name == 'none':
+            data.name = None
+        data.encounter_set = readstring()
+        data.weather = readstring()
+        data.encounter_rate = rate
+        data.tileids = [readstring() for _ in range(ntiles)]
+
+        cells = width * height
+        data.backtiles = array('H')
+        data.backtiles.frombytes(view[offset:offset + 2 * cells])
+        offset += 2 * cells
+        data.foretiles = array('H')
+        data.foretiles.frombytes(view[offset:offset + 2 * cells])
+        offset += 2 * cells
+        if sys.byteorder == 'big':
+            data.backtiles.byteswap()
+            data.foretiles.byteswap()
+
+        for _ in range(nspawns):
+            spawn = readstring()
+            data.spawns[spawn] = SPAWN.unpack_from(view, offset)
+            offset += SPAWN.size
+            link = readstring()
+            if link:
+                data.links[spawn] = link
+
+    return data
+
+
+def compiledpath(filename: str) -> str:
+    """Get the path of the compiled copy of a map file in data/maps."""
+    return os.path.join(COMPILED_DIR, os.path.splitext(filename)[0] + COMPILED_EXT)
+
+
+def isfresh(source: str, target: str) -> bool:
+    """Check whether a compiled map exists, is of the current version, and was built from the current source file."""
+    try:
+        stat = os.stat(source)
+        with open(target, 'rb') as file:
+            header = file.read(HEADER.size)
+    except OSError:
+        return False
+
+    if len(header) < HEADER.size:
+        return False
+    magic, version, _, _, _, _, _, mtime, size = HEADER.unpack(header)
+    return magic == MAGIC and version == VERSION and mtime == stat.st_mtime_ns and size == stat.st_size
+
+
+def compilemap(filename: str) -> MapData:
+    """Compile a map file in data/maps, whether or not its compiled copy is stale. Returns the parsed map."""
+    source = os.path.join(MAPS_DIR, filename)
+    stat = os.stat(source)
+    data = parseini(source)
+    writecompiled(data, compiledpath(filename), stat.st_mtime_ns, stat.st_size)
+    return data
+
+
+def loadmap(filename: str) -> MapData:
+    """Load a map file in data/maps from its compiled copy, recompiling it first if the source has changed. If the
+    compiled copy can't be written, the map is parsed from its source instead."""
+    source = os.path.join(MAPS_DIR, filename)
+    target = compiledpath(filename)
+    if isfresh(source, target):
+        try:
+            return readcompiled(target)
+        except (OSError, ValueError, struct.error):
+            pass  # Fall through and rebuild the compiled copy.
+
+    try:
+        return compilemap(filename)
+    except OSError:
+        return parseini(source)
+
+
+def neighbours(filename: str, data: MapData) -> List[str]:
+    """Get the filenames of the maps that neighbour a map through its spawn points, skipping the map itself and any
+    maps that don't exist."""
+    filenames = [filename]
+    for spawn in data.spawns:
+        neighbour = data.links.get(spawn, (spawn + data.zone + 'map.ini').lower().replace(' ', ''))
+        if neighbour not in filenames and os.path.isfile(os.path.join(MAPS_DIR, neighbour)):
+            filenames.append(neighbour)
+    return filenames[1:]
+
+
+def main(filenames: List[str]):
+    if not filenames:
+        filenames = sorted(name for name in os.listdir(MAPS_DIR) if name.endswith('.ini'))
+    for filename in filenames:
+        compilemap(filename)
+        print('Compiled %s -> %s' % (filename, compiledpath(filename)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,204 @@
+"""Procedural map generation. A seed and a size give a map, and the same seed and size always give the same map: all
+randomness comes from one NumPy generator seeded with the seed, and every step works on whole arrays at once, so a
+map hundreds of tiles across is ready in milliseconds.
+
+Two kinds of map are made:
+        overworld   open snowfields with frozen lakes, shaped by a few octaves of value noise
+        cave        winding passages, grown from random fill by a cellular automaton
+Either way, generation first decides which tiles are passable, then keeps only the largest connected region, so that
+nowhere passable is cut off. The player arrives at the passable tile nearest the center. The passable and impassable
+tiles are then drawn from a Palette of tile IDs.
+
+Generated maps come out as MapData, which Map.load() takes like any loaded map, or can be written out as an .ini map
+file in data/maps for editing by hand:
+        python mapgen.py --seed 7 --size 64x48 --kind cave --output cave7.ini"""
+
+import argparse
+import numpy as np
+import os
+import sys
+import time
+
+from array import array
+from mapcompiler import MAP_HEIGHT, MAP_WIDTH, MAPS_DIR, NO_WEATHER, MapData, formatini
+from typing import *
+
+KINDS = ('overworld', 'cave')  # The kinds of map that can be generated.
+LAKE_LEVEL = 0.35  # Overworld tiles whose noise falls below this are frozen lake.
+NOISE_SCALE = 16  # The spacing, in tiles, of the coarsest octave of overworld noise.
+NOISE_OCTAVES = 3  # The number of octaves of overworld noise; each has half the spacing and weight of the last.
+CAVE_FILL = 0.45  # The fraction of cave tiles that start as wall.
+CAVE_STEPS = 4  # The number of cellular automaton steps that smooth a cave.
+START = 'Start'  # The name of the spawn point where the player arrives on a generated map.
+WEATHER = {'overworld': 'snow', 'cave': NO_WEATHER}  # The weather on each kind of map.
+
+
+class Palette(NamedTuple):
+    """The tile IDs a generated map is drawn with."""
+    open: str  # The tile ID for passable ground.
+    blocked: str  # The tile ID for impassable tiles.
+
+
+SNOW_PALETTE = Palette('0000ts@snow', '0101fs@snow')  # Snow, and ice that can't be walked on.
+
+
+def valuenoise(rng: np.random.RandomState, width: int, height: int, scale: int = NOISE_SCALE,
+               octaves: int = NOISE_OCTAVES) -> np.ndarray:
+    """Make a height by width array of smooth noise from 0 to 1. Each octave is a grid of random values, scale tiles
+    apart, blended smoothly in between; finer octaves add detail at half the weight of the one before."""
+    total = np.zeros((height, width), np.float32)
+    weight = 1.0
+    weights = 0.0
+    for octave in range(octaves):
+        spacing = max(1, scale >> octave)
+        lattice = rng.random_sample((height // spacing + 2, width // spacing + 2)).astype(np.float32)
+        ys = np.arange(height, dtype=np.float32) / spacing
+        xs = np.arange(width, dtype=np.float32) / spacing
+        y0 = ys.astype(np.int64)
+        x0 = xs.astype(np.int64)
+        ty = ys - y0
+        tx = xs - x0
+        ty = (ty * ty * (3 - 2 * ty))[:, np.newaxis]  # Smoothstep, so the blend has no creases at lattice points.
+        tx = tx * tx * (3 - 2 * tx)
+        # Blend along the lattice rows first, while there are few of them, then between rows.
+        rows = lattice[:, x0] * (1 - tx) + lattice[:, x0 + 1] * tx
+        total += weight * (rows[y0] * (1 - ty) + rows[y0 + 1] * ty)
+        weights += weight
+        weight /= 2
+    return total / weights
+
+
+def neighbourcounts(cells: np.ndarray) -> np.ndarray:
+    """Count each cell's eight neighbours that are set. Cells beyond the edge count as set."""
+    padded = np.pad(cells, 1, 'constant', constant_values=True).astype(np.int8)
+    height, width = cells.shape
+    counts = np.zeros(cells.shape, np.int8)
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            if dy != 1 or dx != 1:
+                counts += padded[dy:dy + height, dx:dx + width]
+    return counts
+
+
+def cellular(rng: np.random.RandomState, width: int, height: int, fill: float = CAVE_FILL,
+             steps: int = CAVE_STEPS) -> np.ndarray:
+    """Grow cave walls: start from random fill, then repeatedly make a cell wall if five or more of its neighbours are
+    wall, or if it is wall and four are. Returns a height by width array that is True for wall."""
+    walls = rng.random_sample((height, width)) < fill
+    for _ in range(steps):
+        counts = neighbourcounts(walls)
+        walls = (counts >= 5) | (walls & (counts >= 4))
+    return walls
+
+
+def regions(passable: np.ndarray) -> np.ndarray:
+    """Label the connected regions of passable tiles, where tiles connect to their edge-adjacent neighbours. Returns a
+    label for every tile, the same for every tile in a region and -1 for impassable tiles.
+
+    Rather than flooding tile by tile, each row is first split into runs of passable tiles, which are connected by
+    definition. Runs that touch vertically are then joined: each pass points every run at the lowest label among the
+    runs it touches, then follows the pointers until each run points straight at its region's label. A handful of
+    passes settles even a winding cave."""
+    flat = passable.ravel()
+    width = passable.shape[1]
+    if not flat.any():
+        return np.full(passable.shape, -1)
+    # A run starts at a passable tile unless the tile before it, in the same row, is passable too.
+    starts = flat.copy()
+    starts[1:] &= ~(flat[:-1] & (np.arange(1, flat.size) % width != 0))
+    runs = np.cumsum(starts) - 1
+
+    # Pairs of runs that touch, found where a passable tile has a passable tile below it. Neighbouring tiles along a
+    # row usually give the same pair, so only the first of each is kept.
+    below = np.flatnonzero(flat[:-width] & flat[width:])
+    upper = runs[below]
+    lower = runs[below + width]
+    first = np.ones(len(below), bool)
+    first[1:] = (upper[1:] != upper[:-1]) | (lower[1:] != lower[:-1])
+    upper = upper[first]
+    lower = lower[first]
+
+    parent = np.arange(runs[-1] + 1)
+    while True:
+        top = parent[upper]
+        bottom = parent[lower]
+        joining = top != bottom
+        if not joining.any():
+            break
+        np.minimum.at(parent, np.maximum(top, bottom)[joining], np.minimum(top, bottom)[joining])
+        while True:
+            jumped = parent[parent]
+            if (jumped == parent).all():
+                break
+            parent = jumped
+    return np.where(passable, parent[runs].reshape(passable.shape), -1)
+
+
+def terrain(seed: int, width: int = MAP_WIDTH, height: int = MAP_HEIGHT, kind: str = 'overworld') -> np.ndarray:
+    """Decide which tiles of a generated map are passable. Returns a height by width array, True where passable."""
+    if kind not in KINDS:
+        raise ValueError('Unknown kind of map %r; expected one of %s.' % (kind, ', '.join(KINDS)))
+    rng = np.random.RandomState(seed % 2 ** 32)
+    if kind == 'overworld':
+        passable = valuenoise(rng, width, height) >= LAKE_LEVEL
+    else:
+        passable = ~cellular(rng, width, height)
+
+    # Keep only the largest region, so every passable tile can be reached from every other.
+    if not passable.any():
+        return passable
+    labels = regions(passable)
+    largest = np.argmax(np.bincount(labels[passable]))
+    return labels == largest
+
+
+def starttile(passable: np.ndarray) -> Tuple[int, int]:
+    """Get the passable tile nearest the center of a map, as (x, y). This is where the player arrives."""
+    height, width = passable.shape
+    ys, xs = np.nonzero(passable)
+    if not len(xs):
+        return width // 2, height // 2
+    nearest = np.argmin((xs - width // 2) ** 2 + (ys - height // 2) ** 2)
+    return int(xs[nearest]), int(ys[nearest])
+
+
+def generate(seed: int, width: int = MAP_WIDTH, height: int = MAP_HEIGHT, kind: str = 'overworld',
+             palette: Palette = SNOW_PALETTE) -> MapData:
+    """Generate a map. The same arguments always give the same map. It has a single spawn point, START, on the
+    passable tile nearest its center."""
+    passable = terrain(seed, width, height, kind)
+    data = MapData(width, height)
+    data.zone = 'Generated'
+    data.name = '%s %d' % (kind.capitalize(), seed)
+    data.weather = WEATHER[kind]
+    data.tileids = [data.tileids[0], palette.open, palette.blocked]
+    data.backtiles = array('H', np.where(passable, 1, 2).astype(np.uint16).tobytes())
+    data.spawns[START] = starttile(passable)
+    return data
+
+
+def parsesize(text: str) -> Tuple[int, int]:
+    """Parse a map size like '64x48'."""
+    width, _, height = text.partition('x')
+    return int(width), int(height or width)
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description='Generate a map and write it out as an .ini map file.')
+    parser.add_argument('--seed', type=int, default=0, help='the seed to generate from')
+    parser.add_argument('--size', type=parsesize, default=(MAP_WIDTH, MAP_HEIGHT), help="the map's size, e.g. 64x48")
+    parser.add_argument('--kind', choices=KINDS, default='overworld', help='the kind of map to generate')
+    parser.add_argument('--output', help='the file in data/maps to write (default: <kind><seed>.ini)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    data = generate(args.seed, args.size[0], args.size[1], args.kind)
+    elapsed = time.perf_counter() - start
+    output = args.output or '%s%d.ini' % (args.kind, args.seed)
+    with open(os.path.join(MAPS_DIR, output), 'w') as out:
+        out.write(formatini(data))
+    print('Generated %s, %d by %d tiles, in %.1f ms' % (output, data.width, data.height, 1000 * elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,8 +1,19 @@
+import argparse
+import atexit
+import copy
+import mapcompiler
+import numpy as np
 import os
 import pygame
+import queue
 import sys
+import threading
+import time
 
+from array import array
+from collections import OrderedDict
 from random import Random
+from profiler import ALWAYS_ON, PROFILER, ProfilerOverlay
 from pygame.locals import *
 from typing import *
 
@@ -10,23 +21,67 @@ from typing import *
 SCREENRECT = Rect(0, 0, 1024, 768)  # Screen position and resolution
 TILESIZE = 64  # The size of each tile.
 combat = False  # When this is True, use the combat loop.
-MAIN_DISPLAY = pygame.Surface(SCREENRECT.size)
+MAIN_DISPLAY: Optional[pygame.Surface] = None  # The game window, once opendisplay() has opened it.
+START_MAP = 'northsalkstonmap.ini'  # The map the game starts on. This is the map to use for testing.
+STARTUP_BUDGET = 1.0  # The most time, in seconds, that startup() and the first frame should take.
 SNOW_TILES = os.path.join('tilesets', 'snow_tiles.png')
 ANNA_OVERWORLD = os.path.join('sprites', 'anna_basic_overworld.png')
-FRAMEDELAY = 3
+FRAMEDELAY = 3  # The number of simulation ticks each walk animation frame is held for.
+TICKRATE = 60  # Simulation ticks per second. Movement and animation rates are per tick, not per rendered frame.
+MAX_TICKS = 5  # The most simulation ticks to run before rendering a frame. Time beyond this is dropped.
+MAX_FPS = 144  # The most frames to render per second. Frames between ticks are interpolated.
+CHUNKSIZE = 8  # The width and height of a map chunk, in tiles.
+AUTOSAVE_TICKS = 60 * TICKRATE  # How often to autosave, in simulation ticks.
+MAX_DIRTY_RECTS = 48  # The most regions to repaint separately in a frame. Beyond this, the whole screen is repainted.
+SNOW_BUDGET = 1200  # The most snowflakes in the air at once, at full particle quality.
+BREATH_TICKS = 2 * TICKRATE  # How often the player's breath shows in the cold, in simulation ticks.
+BREATH_MOUTHS = ((32, 30), (32, 18), (16, 26), (48, 26))  # Where breath appears on the player sprite for each facing.
+BREATH_VELOCITIES = ((0.0, 0.4), (0.0, -0.4), (-0.5, 0.0), (0.5, 0.0))  # Which way breath drifts for each facing.
+WATCH_TICKS = TICKRATE // 4  # How often watch mode checks for edited files, in simulation ticks.
+WATCHED_FILES = (os.path.join(mapcompiler.MAPS_DIR, '*.ini'), os.path.join('data', 'tilesets', '*.png'),
+                 'playercharacters.py', 'spells.py')  # The files watch mode applies edits from.
 ENTITIES = pygame.sprite.RenderUpdates()  # Sprite group for Entities (Player, Statics, Mobs, etc.).
-COLLISIONS: List[Rect] = list()
+_OFFSCREEN: Optional[pygame.Surface] = None  # Stands in for the game window in tools that draw without one.
+
+
+def opendisplay() -> pygame.Surface:
+    """Start the pygame modules the game uses and open the game window. Only the display is started here; fonts are
+    started by the first thing that renders text, and audio, joysticks and the rest are never started until the game
+    has a use for them."""
+    global MAIN_DISPLAY
+    pygame.display.init()
+    MAIN_DISPLAY = pygame.display.set_mode(SCREENRECT.size)
+    pygame.display.set_caption('Song of Celestine')
+    return MAIN_DISPLAY
+
+
+def formatsurface() -> pygame.Surface:
+    """Get a surface with the pixel format that loaded images are converted to: the window, once one is open, or else
+    an off-screen surface the same size, created the first time it's needed."""
+    global _OFFSCREEN
+    display = pygame.display.get_surface() if pygame.display.get_init() else None
+    if display is not None:
+        return display
+    if _OFFSCREEN is None:
+        _OFFSCREEN = pygame.Surface(SCREENRECT.size)
+    return _OFFSCREEN
 
 
 # Collects data from a sprite sheet.
 class SpriteSheet:
-    def __init__(self, filename: str, surface: pygame.Surface):
-        self.sheet = pygame.image.load(os.path.join('data', filename)).convert()
+    def __init__(self, filename: str, surface: pygame.Surface, image: pygame.Surface = None):
+        # image: The sheet, if it has already been read from disk (e.g. by a MapLoader thread). It only needs converting.
+        with PROFILER.timeload('SpriteSheet', filename):
+            if image is None:
+                image = pygame.image.load(os.path.join('data', filename))
+            # Converting needs an open window. Without one, e.g. in tools, the sheet is kept as it was loaded.
+            self.sheet = image.convert() if pygame.display.get_surface() is not None else image
         self.screen = surface
 
     def imgat(self, rect, colorkey=None):
         rect = Rect(rect)
-        image = pygame.Surface(rect.size).convert(self.screen)
+        image = pygame.Surface(rect.size, 0, self.screen)
+        PROFILER.count('surfaces')
         image.blit(self.sheet, (0, 0), rect)
         if colorkey is not None:
             if colorkey is -1:
@@ -41,16 +96,206 @@ class SpriteSheet:
         return imgs
 
 
+# Tileset image files, keyed by the tileset suffix that follows the '@' in a tile ID.
+TILESET_FILES: Dict[str, str] = {
+    'snow': SNOW_TILES,
+}
+
+
+class TilesetAtlas:
+    """A single tileset image, loaded and converted once. Tiles are cut from the sheet and scaled to TILESIZE the
+    first time they are requested; every later request for the same tile gets the cached surface."""
+    sheet: SpriteSheet  # The tileset's sprite sheet.
+    tiles: Dict[Tuple[int, int], pygame.Surface]  # Cut and scaled tile surfaces, keyed by (column, row).
+    hits: int  # The number of tile requests served from the cache.
+    misses: int  # The number of tile requests that had to cut a new surface from the sheet.
+
+    def __init__(self, filename: str, image: pygame.Surface = None):
+        self.sheet = SpriteSheet(filename, formatsurface(), image)
+        self.tiles = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def tileat(self, column: int, row: int) -> pygame.Surface:
+        """Get the TILESIZE surface for the tile at the given column and row of the sheet."""
+        image = self.tiles.get((column, row))
+        if image is not None:
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        image = self.sheet.imgat(Rect(column * 32, row * 32, 32, 32), (0, 255, 255))
+        image = pygame.transform.scale2x(image)
+        PROFILER.count('surfaces')
+        self.tiles[(column, row)] = image
+        return image
+
+    def changedtiles(self, other: 'TilesetAtlas') -> List[Tuple[int, int]]:
+        """Get the (column, row) of each cut tile whose pixels differ in another atlas of the same tileset, such as one
+        just read again from disk. Tiles that haven't been cut yet aren't compared."""
+        changed = list()
+        for column, row in self.tiles:
+            rect = Rect(column * 32, row * 32, 32, 32)
+            if not other.sheet.sheet.get_rect().contains(rect) or (
+                    pygame.image.tostring(self.sheet.sheet.subsurface(rect), 'RGB') !=
+                    pygame.image.tostring(other.sheet.sheet.subsurface(rect), 'RGB')):
+                changed.append((column, row))
+        return changed
+
+
+class TilesetRegistry:
+    """Process-wide cache of tileset atlases, keyed by tileset suffix ('snow' for '@snow'). Each tileset image is
+    read from disk at most once; the hit and miss counters can be used to confirm that map loads do no repeat reads."""
+    atlases: Dict[str, TilesetAtlas]  # Loaded atlases, keyed by tileset suffix.
+    hits: int  # The number of atlas requests served from the cache.
+    misses: int  # The number of atlas requests that had to load a tileset from disk.
+
+    def __init__(self):
+        self.atlases = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def atlas(self, tileset: str) -> TilesetAtlas:
+        """Get the atlas for a tileset suffix, loading it on first use. Raises KeyError for unknown tilesets."""
+        atlas = self.atlases.get(tileset)
+        if atlas is not None:
+            self.hits += 1
+            return atlas
+
+        self.misses += 1
+        atlas = TilesetAtlas(TILESET_FILES[tileset])
+        self.atlases[tileset] = atlas
+        return atlas
+
+    def install(self, tileset: str, image: pygame.Surface):
+        """Create the atlas for a tileset from an image that was already read from disk, unless it is loaded."""
+        if tileset not in self.atlases:
+            self.misses += 1
+            self.atlases[tileset] = TilesetAtlas(TILESET_FILES[tileset], image)
+
+    def reload(self, tileset: str) -> List[Tuple[int, int]]:
+        """Read a loaded tileset's image from disk again, after it has been edited. Cut tiles whose pixels are the same
+        are carried over to the new atlas; the others are dropped along with the old sheet, and cut again from the new
+        one when next requested. Returns the (column, row) of each tile that changed."""
+        old = self.atlases.get(tileset)
+        if old is None:
+            return list()  # Nothing has used the tileset yet, so its first use will read the new image.
+
+        self.misses += 1
+        atlas = TilesetAtlas(TILESET_FILES[tileset])
+        changed = old.changedtiles(atlas)
+        atlas.tiles = {key: image for key, image in old.tiles.items() if key not in changed}
+        self.atlases[tileset] = atlas
+        return changed
+
+    def tileat(self, tileset: str, column: int, row: int) -> pygame.Surface:
+        """Get the TILESIZE surface for a tile in the given tileset."""
+        return self.atlas(tileset).tileat(column, row)
+
+    def stats(self) -> Dict[str, int]:
+        """Get the registry's cache counters. 'loads' is the number of tileset images read from disk."""
+        return {
+            'loads': self.misses,
+            'atlas_hits': self.hits,
+            'tile_hits': sum(atlas.hits for atlas in self.atlases.values()),
+            'tile_misses': sum(atlas.misses for atlas in self.atlases.values()),
+        }
+
+    def clear(self):
+        """Drop every cached atlas and reset the counters."""
+        self.atlases.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+TILESETS = TilesetRegistry()  # The shared tileset cache used by all Tile objects.
+
+
+class AnimationSet:
+    """The overworld animation frames for one character sprite sheet. Every frame is cut, color-keyed, and scaled to
+    TILESIZE once, when the set is created; sprites that use the same sheet share the set through getanimations()."""
+    idles: List[pygame.Surface]  # Idle frames, indexed by facing.
+    walk_south: List[pygame.Surface]  # The animation cycle to use when walking South.
+    walk_north: List[pygame.Surface]  # The animation cycle to use when walking North.
+    walk_east: List[pygame.Surface]  # The animation cycle to use when walking East.
+    walk_west: List[pygame.Surface]  # The animation cycle to use when walking West.
+    walks: List[List[pygame.Surface]]  # The walk cycles, indexed by facing.
+
+    def __init__(self, filename: str):
+        sheet = SpriteSheet(filename, formatsurface())
+
+        # Get the idle frames.
+        self.idles = self.scaled(sheet.imgsat([Rect(0, 0, 32, 32),
+                                               Rect(0, 32, 32, 32),
+                                               Rect(0, 64, 32, 32),
+                                               Rect(0, 96, 32, 32)], (0, 255, 255)))
+
+        # Get the frames for walking south.
+        self.walk_south = self.scaled(sheet.imgsat([Rect(32, 0, 32, 32),
+                                                    Rect(64, 0, 32, 32),
+                                                    Rect(96, 0, 32, 32),
+                                                    Rect(128, 0, 32, 32),
+                                                    Rect(160, 0, 32, 32),
+                                                    Rect(192, 0, 32, 32)], (0, 255, 255)))
+
+        # Get the frames for walking north.
+        self.walk_north = self.scaled(sheet.imgsat([Rect(32, 32, 32, 32),
+                                                    Rect(64, 32, 32, 32),
+                                                    Rect(96, 32, 32, 32),
+                                                    Rect(128, 32, 32, 32),
+                                                    Rect(160, 32, 32, 32),
+                                                    Rect(192, 32, 32, 32)], (0, 255, 255)))
+
+        # Get the frames for walking west.
+        self.walk_west = self.scaled(sheet.imgsat([Rect(32, 64, 32, 32),
+                                                   Rect(64, 64, 32, 32),
+                                                   Rect(96, 64, 32, 32),
+                                                   Rect(128, 64, 32, 32),
+                                                   Rect(160, 64, 32, 32),
+                                                   Rect(192, 64, 32, 32)], (0, 255, 255)))
+
+        # Get the frames for walking east.
+        self.walk_east = self.scaled(sheet.imgsat([Rect(32, 96, 32, 32),
+                                                   Rect(64, 96, 32, 32),
+                                                   Rect(96, 96, 32, 32),
+                                                   Rect(128, 96, 32, 32),
+                                                   Rect(160, 96, 32, 32),
+                                                   Rect(192, 96, 32, 32)], (0, 255, 255)))
+
+        # Order the walk cycles to match facing: 0 = South, 1 = North, 2 = West, 3 = East
+        self.walks = [self.walk_south, self.walk_north, self.walk_west, self.walk_east]
+
+    @staticmethod
+    def scaled(frames: List[pygame.Surface]) -> List[pygame.Surface]:
+        """Scale a list of 32px frames up to TILESIZE."""
+        PROFILER.count('surfaces', len(frames))
+        return [pygame.transform.scale2x(frame) for frame in frames]
+
+
+ANIMATIONS: Dict[str, AnimationSet] = dict()  # Shared animation sets, keyed by sprite sheet filename.
+
+
+def getanimations(filename: str) -> AnimationSet:
+    """Get the shared AnimationSet for a sprite sheet, loading it the first time the sheet is used."""
+    animations = ANIMATIONS.get(filename)
+    if animations is None:
+        animations = AnimationSet(filename)
+        ANIMATIONS[filename] = animations
+    return animations
+
+
 class PlayerSprite(pygame.sprite.Sprite):
     """This sprite represents the player party in the overworld and exploration modes."""
     collisionrect: Rect  # The rectangle to be used for collisions. This should be slightly smaller than the sprite.
     image: pygame.Surface  # The sprite's currently active image.
+    animations: AnimationSet  # The shared, pre-scaled animation frames for this sprite's sheet.
     idles: List[pygame.Surface]  # Images to use as this sprite's idles.
     walk_south: List[pygame.Surface]  # The animation cycle to use when walking South.
     walk_north: List[pygame.Surface]  # The animation cycle to use when walking North.
     walk_east: List[pygame.Surface]  # The animation cycle to use when walking East.
     walk_west: List[pygame.Surface]  # The animation cycle to use when walking West.
-    MOVERATE: int  # The number of pixels to move each frame when walking.
+    MOVERATE: int  # The number of pixels to move each simulation tick when walking.
+    previous: Tuple[int, int]  # The sprite's position before the latest tick, used to interpolate drawing.
     del_x: int  # The number of pixels to move the sprite left or right.
     del_y: int  # The number of pixels to move the sprite up or down.
     facing: int  # The direction the sprite is facing. 0 = South, 1 = North, 2 = West, 3 = East
@@ -64,53 +309,21 @@ class PlayerSprite(pygame.sprite.Sprite):
         #   location of the PlayerSprite object.
         pygame.sprite.Sprite.__init__(self, ENTITIES)  # Call the superclass constructor, passing it the ENTITIES group.
         self.rect = Rect(location[0], location[1], 64, 64)
+        self.previous = self.rect.topleft
         self.collisionrect = Rect(location[0] + 4, location[1] + 4, 60, 60)
         self.MOVERATE = 2
 
         # For now, default the spritesheet to Anna's sheet.
         # TODO: code to support Clara, Carter, and Wilhelm as active characters.
-        sheet = SpriteSheet(os.path.join('sprites', 'anna_basic.png'), MAIN_DISPLAY)
-
-        # Get the idle frames.
-        self.idles = sheet.imgsat([Rect(0, 0, 32, 32),
-                                   Rect(0, 32, 32, 32),
-                                   Rect(0, 64, 32, 32),
-                                   Rect(0, 96, 32, 32)], (0, 255, 255))
-
-        # Get the frames for walking south.
-        self.walk_south = sheet.imgsat([Rect(32, 0, 32, 32),
-                                        Rect(64, 0, 32, 32),
-                                        Rect(96, 0, 32, 32),
-                                        Rect(128, 0, 32, 32),
-                                        Rect(160, 0, 32, 32),
-                                        Rect(192, 0, 32, 32)], (0, 255, 255))
-
-        # Get the frames for walking north.
-        self.walk_north = sheet.imgsat([Rect(32, 32, 32, 32),
-                                        Rect(64, 32, 32, 32),
-                                        Rect(96, 32, 32, 32),
-                                        Rect(128, 32, 32, 32),
-                                        Rect(160, 32, 32, 32),
-                                        Rect(192, 32, 32, 32)], (0, 255, 255))
-
-        # Get the frames for walking west.
-        self.walk_west = sheet.imgsat([Rect(32, 64, 32, 32),
-                                       Rect(64, 64, 32, 32),
-                                       Rect(96, 64, 32, 32),
-                                       Rect(128, 64, 32, 32),
-                                       Rect(160, 64, 32, 32),
-                                       Rect(192, 64, 32, 32)], (0, 255, 255))
-
-        # Get the frames for walking east.
-        self.walk_east = sheet.imgsat([Rect(32, 96, 32, 32),
-                                       Rect(64, 96, 32, 32),
-                                       Rect(96, 96, 32, 32),
-                                       Rect(128, 96, 32, 32),
-                                       Rect(160, 96, 32, 32),
-                                       Rect(192, 96, 32, 32)], (0, 255, 255))
+        self.animations = getanimations(os.path.join('sprites', 'anna_basic.png'))
+        self.idles = self.animations.idles
+        self.walk_south = self.animations.walk_south
+        self.walk_north = self.animations.walk_north
+        self.walk_west = self.animations.walk_west
+        self.walk_east = self.animations.walk_east
 
         self.facing = facing
-        self.image = pygame.transform.scale2x(self.idles[self.facing])
+        self.image = self.idles[self.facing]
         self.anim_count = 0
         self.anim_delay = 0
         self.del_x = 0
@@ -129,355 +342,1530 @@ class PlayerSprite(pygame.sprite.Sprite):
         else:
             rect = self.collisionrect
 
-        for x in COLLISIONS:
-            if rect.colliderect(x):
-                return True
-
-        return False
+        return COLLISIONS.collides(rect, self)
 
     def update(self):
+        self.previous = self.rect.topleft
         if not self.check_collision():
             self.rect.x += self.del_x
             self.rect.y += self.del_y
             self.collisionrect = Rect(self.rect.x + 4, self.rect.y + 4, 60, 60)
         if self.del_x == 0 and self.del_y == 0:
-            self.image = pygame.transform.scale2x(self.idles[self.facing])
-        elif self.del_y < 0:
-            self.facing = 1
-            if self.anim_delay < FRAMEDELAY:
-                self.anim_delay += 1
-            else:
-                self.anim_delay = 0
-                if self.anim_count < 5:
-                    self.anim_count += 1
-                else:
-                    self.anim_count = 0
+            self.image = self.idles[self.facing]
+            return
 
-            self.image = pygame.transform.scale2x(self.walk_north[self.anim_count])
+        # Face the direction of movement.
+        if self.del_y < 0:
+            self.facing = 1
         elif self.del_y > 0:
             self.facing = 0
-            if self.anim_delay < FRAMEDELAY:
-                self.anim_delay += 1
-            else:
-                self.anim_delay = 0
-                if self.anim_count < 5:
-                    self.anim_count += 1
-                else:
-                    self.anim_count = 0
-
-            self.image = pygame.transform.scale2x(self.walk_south[self.anim_count])
         elif self.del_x < 0:
             self.facing = 2
-            if self.anim_delay < FRAMEDELAY:
-                self.anim_delay += 1
-            else:
-                self.anim_delay = 0
-                if self.anim_count < 5:
-                    self.anim_count += 1
-                else:
-                    self.anim_count = 0
-
-            self.image = pygame.transform.scale2x(self.walk_west[self.anim_count])
-        elif self.del_x > 0:
+        else:
             self.facing = 3
-            if self.anim_delay < FRAMEDELAY:
-                self.anim_delay += 1
-            else:
-                self.anim_delay = 0
-                if self.anim_count < 5:
-                    self.anim_count += 1
-                else:
-                    self.anim_count = 0
-
-            self.image = pygame.transform.scale2x(self.walk_east[self.anim_count])
 
+        # Advance the walk cycle every FRAMEDELAY frames, then pick the cached frame for it.
+        cycle = self.animations.walks[self.facing]
+        if self.anim_delay < FRAMEDELAY:
+            self.anim_delay += 1
+        else:
+            self.anim_delay = 0
+            if self.anim_count < len(cycle) - 1:
+                self.anim_count += 1
+            else:
+                self.anim_count = 0
+
+        self.image = cycle[self.anim_count]
+
+
+class EntityStore:
+    """Stores every non-player Entity (townsfolk, overworld mobs, and the like) as a struct of arrays: one NumPy array
+    per field, indexed by slot. Movement, tile collision, facing and animation are updated for all Entities at once with
+    array operations, following the same rules as PlayerSprite.update(), so the cost of a tick hardly grows with the
+    number of Entities. EntitySprite objects are thin views over a slot, used only to draw it.
+
+    Entities collide with impassable map tiles, read from the COLLISIONS grid, but not with each other or the player."""
+    capacity: int  # The number of slots allocated.
+    count: int  # One past the highest slot ever used. Slots beyond this are unused.
+    free: List[int]  # Slots below count that have been released, for reuse.
+    alive: np.ndarray  # Whether each slot holds an Entity.
+    x: np.ndarray  # The x position of each Entity's rect, in world pixels.
+    y: np.ndarray  # The y position of each Entity's rect, in world pixels.
+    prevx: np.ndarray  # The x position of each Entity before the latest tick, used to interpolate drawing.
+    prevy: np.ndarray  # The y position of each Entity before the latest tick.
+    dx: np.ndarray  # The number of pixels to move each Entity left or right each tick.
+    dy: np.ndarray  # The number of pixels to move each Entity up or down each tick.
+    facing: np.ndarray  # The direction each Entity is facing. 0 = South, 1 = North, 2 = West, 3 = East
+    anim_count: np.ndarray  # The current walk animation frame of each Entity.
+    anim_delay: np.ndarray  # How many ticks have passed since each Entity's last animation frame change.
+    cyclelength: np.ndarray  # The length of each Entity's walk cycles, indexed by slot and facing.
+    frame: np.ndarray  # The walk frame each Entity is showing, or -1 if it is showing its idle frame.
+    animations: List[Optional[AnimationSet]]  # The animation frames used by each slot.
+    sprites: List[Optional['EntitySprite']]  # The view of each slot.
+
+    # The collision probe tested before moving, as (x offset, y offset, width, height) from the Entity's rect, for
+    # each direction of movement: none, north, south, west, east. These match PlayerSprite.check_collision().
+    PROBES = np.array([(4, 4, 60, 60), (4, 0, 60, 64), (4, 8, 60, 64), (0, 4, 64, 60), (8, 4, 64, 60)], dtype=np.int32)
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = 0
+        self.count = 0
+        self.free = list()
+        self.animations = list()
+        self.sprites = list()
+        fields = (('alive', np.bool_), ('x', np.int32), ('y', np.int32), ('prevx', np.int32), ('prevy', np.int32),
+                  ('dx', np.int32), ('dy', np.int32), ('facing', np.int8), ('anim_count', np.int16),
+                  ('anim_delay', np.int16), ('frame', np.int16))
+        for name, dtype in fields:
+            setattr(self, name, np.zeros(0, dtype))
+        self.cyclelength = np.ones((0, 4), np.int16)
+        self.grow(capacity)
+
+    def grow(self, capacity: int):
+        """Reallocate every array to hold at least capacity Entities."""
+        if capacity <= self.capacity:
+            return
+        for name in ('alive', 'x', 'y', 'prevx', 'prevy', 'dx', 'dy', 'facing', 'anim_count', 'anim_delay', 'frame'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:self.capacity] = old
+            setattr(self, name, new)
+        cyclelength = np.ones((capacity, 4), np.int16)
+        cyclelength[:self.capacity] = self.cyclelength
+        self.cyclelength = cyclelength
+        self.animations.extend([None] * (capacity - self.capacity))
+        self.sprites.extend([None] * (capacity - self.capacity))
+        self.capacity = capacity
+
+    def spawn(self, location: Tuple[int, int], facing: int = 0,
+              sheet: str = os.path.join('sprites', 'anna_basic.png')) -> int:
+        """Add an Entity at a location in world pixels, drawn from a character sprite sheet. Returns its slot."""
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.count == self.capacity:
+                self.grow(2 * self.capacity)
+            slot = self.count
+            self.count += 1
+
+        animations = getanimations(sheet)
+        self.alive[slot] = True
+        self.x[slot] = self.prevx[slot] = location[0]
+        self.y[slot] = self.prevy[slot] = location[1]
+        self.dx[slot] = self.dy[slot] = 0
+        self.facing[slot] = facing
+        self.anim_count[slot] = self.anim_delay[slot] = 0
+        self.frame[slot] = -1
+        self.cyclelength[slot] = [len(cycle) for cycle in animations.walks]
+        self.animations[slot] = animations
+        self.sprites[slot] = EntitySprite(self, slot)
+        return slot
+
+    def despawn(self, slot: int):
+        """Remove the Entity in a slot."""
+        if self.alive[slot]:
+            self.alive[slot] = False
+            self.dx[slot] = self.dy[slot] = 0
+            self.animations[slot] = None
+            self.sprites[slot] = None
+            self.free.append(slot)
+
+    def setvelocity(self, slots: Union[int, Sequence[int], np.ndarray], dx, dy):
+        """Set how far some Entities move each tick. slots, dx and dy can be single values or arrays."""
+        self.dx[slots] = dx
+        self.dy[slots] = dy
+
+    def steer(self, slots: Union[Sequence[int], np.ndarray], field: 'pathfinding.FlowField', speed: int = 2):
+        """Set the velocity of some Entities to follow a flow field towards its goal, one tile at a time, from the tile
+        under each Entity's centre. An Entity heads straight for the next tile if its collision probe is clear;
+        otherwise it is snagged on a corner, and lines up with its tile across its direction of travel first. Entities
+        at the goal, or that can't reach it, stop."""
+        slots = np.asarray(slots)
+        x = self.x[slots]
+        y = self.y[slots]
+        column = (x + TILESIZE // 2) // TILESIZE
+        row = (y + TILESIZE // 2) // TILESIZE
+        stepx, stepy = field.steps(column, row)
+        vertical = stepy != 0
+        moving = vertical | (stepx != 0)
+
+        # Test the probe for heading straight on: north, south, west or east, as in update().
+        direction = np.where(vertical, np.where(stepy < 0, 1, 2), np.where(stepx < 0, 3, 4))
+        probes = self.PROBES[direction]
+        snagged = self.blockedunder(x + probes[:, 0], y + probes[:, 1], probes[:, 2], probes[:, 3])
+
+        # The probes are 4 pixels narrower than a tile, so an Entity lines up with its tile's column or row anywhere
+        # from 4 pixels before the tile's edge up to it.
+        alignx = np.clip(x, column * TILESIZE - 4, column * TILESIZE) - x
+        aligny = np.clip(y, row * TILESIZE - 4, row * TILESIZE) - y
+        across = np.where(snagged, np.clip(np.where(vertical, alignx, aligny), -speed, speed), 0)
+        along = np.where(snagged, 0, speed)
+        self.dx[slots] = np.where(moving, np.where(vertical, across, stepx * along), 0)
+        self.dy[slots] = np.where(moving, np.where(vertical, stepy * along, across), 0)
+
+    def within(self, area: Rect) -> np.ndarray:
+        """Get the slots of the Entities whose rects overlap an area of the world."""
+        n = self.count
+        x = self.x[:n]
+        y = self.y[:n]
+        inside = (self.alive[:n] & (x < area.right) & (x + TILESIZE > area.left) & (y < area.bottom)
+                  & (y + TILESIZE > area.top))
+        return np.flatnonzero(inside)
+
+    def blockedunder(self, left: np.ndarray, top: np.ndarray, width: np.ndarray, height: np.ndarray) -> np.ndarray:
+        """Check whether each of a batch of rectangles overlaps an impassable tile in COLLISIONS. No rectangle may be
+        larger than a tile, so each overlaps at most four tiles: the ones under its corners. Tiles outside the map are
+        not treated as impassable."""
+        blocked = np.zeros(len(left), np.bool_)
+        if not COLLISIONS.width or not COLLISIONS.height:
+            return blocked
+        grid = np.frombuffer(COLLISIONS.blocked, np.uint8).reshape(COLLISIONS.height, COLLISIONS.width)
+        columns = (left // TILESIZE, (left + width - 1) // TILESIZE)
+        rows = (top // TILESIZE, (top + height - 1) // TILESIZE)
+        for column in columns:
+            for row in rows:
+                inside = (column >= 0) & (column < COLLISIONS.width) & (row >= 0) & (row < COLLISIONS.height)
+                cells = grid[np.clip(row, 0, COLLISIONS.height - 1), np.clip(column, 0, COLLISIONS.width - 1)]
+                blocked |= inside & (cells != 0)
+        return blocked
 
-# Contains data for background tiles
+    def update(self):
+        """Advance every Entity by one simulation tick: move it unless the tile ahead is impassable, face the direction
+        of movement, and advance its walk cycle."""
+        n = self.count
+        alive = self.alive[:n]
+        x, y, dx, dy = self.x[:n], self.y[:n], self.dx[:n], self.dy[:n]
+        self.prevx[:n] = x
+        self.prevy[:n] = y
+
+        # Pick each Entity's direction of movement, vertical movement first, then test its collision probe.
+        direction = np.select([dy < 0, dy > 0, dx < 0, dx > 0], [1, 2, 3, 4], 0)
+        probes = self.PROBES[direction]
+        free = alive & ~self.blockedunder(x + probes[:, 0], y + probes[:, 1], probes[:, 2], probes[:, 3])
+        x += np.where(free, dx, 0)
+        y += np.where(free, dy, 0)
+
+        # Face the direction of movement, then advance the walk cycle every FRAMEDELAY ticks.
+        moving = alive & (direction != 0)
+        facing = self.facing[:n]
+        facing[moving] = np.array([0, 1, 0, 2, 3], np.int8)[direction[moving]]
+        count = self.anim_count[:n]
+        delay = self.anim_delay[:n]
+        advance = moving & (delay >= FRAMEDELAY)
+        delay[moving] += 1
+        delay[advance] = 0
+        length = self.cyclelength[np.arange(n), facing]
+        count[advance] = np.where(count[advance] < length[advance] - 1, count[advance] + 1, 0)
+        self.frame[:n] = np.where(moving, count, -1)
+
+    def image(self, slot: int) -> pygame.Surface:
+        """Get the frame an Entity is showing."""
+        frame = self.frame[slot]
+        if frame < 0:
+            return self.animations[slot].idles[self.facing[slot]]
+        return self.animations[slot].walks[self.facing[slot]][frame]
+
+    def clear(self):
+        """Remove every Entity."""
+        self.__init__()
+
+
+ENTITY_STORE = EntityStore()  # The non-player Entities on the active map.
+
+
+class EntitySprite(pygame.sprite.Sprite):
+    """A view of one slot of an EntityStore, giving the Renderer the rect, previous position and image it draws a
+    sprite with. It holds no state of its own."""
+    store: EntityStore  # The store holding the Entity.
+    slot: int  # The Entity's slot in the store.
+
+    def __init__(self, store: EntityStore, slot: int):
+        pygame.sprite.Sprite.__init__(self)
+        self.store = store
+        self.slot = slot
+
+    @property
+    def rect(self) -> Rect:
+        return Rect(int(self.store.x[self.slot]), int(self.store.y[self.slot]), TILESIZE, TILESIZE)
+
+    @property
+    def previous(self) -> Tuple[int, int]:
+        return int(self.store.prevx[self.slot]), int(self.store.prevy[self.slot])
+
+    @property
+    def image(self) -> pygame.Surface:
+        return self.store.image(self.slot)
+
+
+class EntityLayer:
+    """Presents an EntityStore to the Renderer as a sprite layer. Only the Entities near the camera's view are listed,
+    found with one array query, so Entities elsewhere on the map cost nothing to draw."""
+    store: EntityStore  # The store to draw.
+    camera: 'Camera'  # The camera whose view is drawn.
+
+    def __init__(self, store: EntityStore, camera: 'Camera'):
+        self.store = store
+        self.camera = camera
+
+    def visible(self) -> np.ndarray:
+        """Get the slots of the Entities near the view. The margin covers Entities drawn between ticks."""
+        return self.store.within(self.camera.rect.inflate(2 * TILESIZE, 2 * TILESIZE))
+
+    def sprites(self) -> List[EntitySprite]:
+        return [self.store.sprites[slot] for slot in self.visible()]
+
+    def place(self, alpha: float) -> List['Placement']:
+        """Get each visible Entity's sprite, screen rect and image, interpolated alpha of the way from its previous
+        position as Renderer.worldrect() does, with the positions worked out for all of them at once."""
+        store = self.store
+        slots = self.visible()
+        x = store.x[slots]
+        y = store.y[slots]
+        if alpha < 1.0:
+            prevx = store.prevx[slots]
+            prevy = store.prevy[slots]
+            x = prevx + np.round((x - prevx) * alpha).astype(np.int32)
+            y = prevy + np.round((y - prevy) * alpha).astype(np.int32)
+        x = (x - self.camera.rect.x).tolist()
+        y = (y - self.camera.rect.y).tolist()
+        return [(store.sprites[slot], Rect(x[i], y[i], TILESIZE, TILESIZE), store.image(slot))
+                for i, slot in enumerate(slots.tolist())]
+
+
+# Contains data for background tiles. Tile objects are immutable flyweights: every map cell that uses the same ID
+# shares one Tile, obtained through gettile().
 class Tile:
-    idcode: str  # A string ID representing the tile's tileset position, passability, type, and tileset.
+    __slots__ = ('id', 'image', 'passable', 'valid')
+    id: str  # A string ID representing the tile's tileset position, passability, type, and tileset.
     image: pygame.Surface  # A Surface object representing the tile's sprite.
     passable: bool  # Whether the tile can be traversed.
+    valid: bool  # False if the tile's image couldn't be loaded and it was replaced by invalidate().
 
     def __init__(self, id: str):
-        self.id = id
-        tilerect = Rect(int(id[0:2]) * 32, int(id[2:4]) * 32, 32, 32)
+        object.__setattr__(self, 'id', id)
 
-        # Attempt to get an image for the tile. If it fails for any reason, call the invalidate() function.
+        # Attempt to get an image for the tile from the shared tileset cache. The tileset is named by the suffix
+        # following the '@' in the ID. If the ID is malformed, names an unknown tileset, or the tileset can't be
+        # loaded, call the invalidate() function.
         try:
-            # TODO: Support for additional tilesets.
-            tileset = SpriteSheet(SNOW_TILES, MAIN_DISPLAY)  # Get the sprite sheet for the Tile's tileset.
-            self.image = tileset.imgat(tilerect, (0, 255, 255))
-        except:
+            tileset = id.split('@')[1]
+            object.__setattr__(self, 'image', TILESETS.tileat(tileset, int(id[0:2]), int(id[2:4])))
+        except (pygame.error, OSError, LookupError, ValueError):
             self.invalidate()
-
-        # Scale the tile image
-        self.image = pygame.transform.scale2x(self.image)
+            return
 
         # Get whether the tile is passable
-        if id[4] is 'f':
-            self.passable = False
-        else:
-            self.passable = True
+        object.__setattr__(self, 'passable', id[4] != 'f')
+        object.__setattr__(self, 'valid', True)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Tile objects are shared between map cells and cannot be modified.')
 
-    # invalidate() re-initializes the tile as an impassable black square.
+    def __repr__(self):
+        return 'Tile(%r)' % self.id
+
+    # invalidate() initializes the tile as an impassable white square.
     def invalidate(self):
-        self.image = pygame.Surface((TILESIZE, TILESIZE))
-        self.image.fill((255, 255, 255))
-        self.passable = False
+        image = pygame.Surface((TILESIZE, TILESIZE))
+        PROFILER.count('surfaces')
+        image.fill((255, 255, 255))
+        object.__setattr__(self, 'image', image)
+        object.__setattr__(self, 'passable', False)
+        object.__setattr__(self, 'valid', False)
+
+
+TILE_TYPES: Dict[str, Tile] = dict()  # Interned Tile objects, keyed by tile ID.
+
+
+def gettile(id: str) -> Tile:
+    """Get the shared Tile object for a tile ID, creating it the first time the ID is seen. Tiles that fail to load
+    aren't kept, so that a later request can try again, e.g. once the tileset is fixed."""
+    tile = TILE_TYPES.get(id)
+    if tile is None:
+        with PROFILER.timeload('Tile', id):
+            tile = Tile(id)
+        if tile.valid:
+            TILE_TYPES[id] = tile
+    return tile
+
+
+class MapChunk:
+    """A CHUNKSIZE by CHUNKSIZE block of a map's tiles, with its background and foreground composited onto surfaces.
+    Chunks are baked when they first come into view, so the cost of compositing depends on the screen size rather
+    than the size of the map."""
+    rect: Rect  # The area the chunk covers, in world pixels.
+    background: pygame.Surface  # The chunk's background layer.
+    foreground: pygame.Surface  # The chunk's foreground layer.
+
+    def __init__(self, map: 'Map', column: int, row: int):
+        size = CHUNKSIZE * TILESIZE
+        self.rect = Rect(column * size, row * size, size, size)
+        self.background = pygame.Surface(self.rect.size)
+        self.background.fill((0, 0, 0))
+        self.foreground = pygame.Surface(self.rect.size)
+        self.foreground.set_colorkey((0, 255, 255))
+        self.foreground.fill((0, 255, 255))
+        PROFILER.count('surfaces', 2)
+
+        # Composite every tile of the map that falls inside this chunk.
+        for y in range(row * CHUNKSIZE, min((row + 1) * CHUNKSIZE, map.height)):
+            for x in range(column * CHUNKSIZE, min((column + 1) * CHUNKSIZE, map.width)):
+                self.drawtile(map, x, y)
+
+    def drawtile(self, map: 'Map', x: int, y: int):
+        """Composite the background and foreground of a single map tile onto the chunk."""
+        position = (x * TILESIZE - self.rect.x, y * TILESIZE - self.rect.y)
+        backtile = map.backtile(x, y)
+        if backtile is not None:
+            self.background.blit(backtile.image, position)
+            PROFILER.count('blits')
+        foretile = map.foretile(x, y)
+        if foretile is not None:
+            self.foreground.blit(foretile.image, position)
+            PROFILER.count('blits')
+
+    def repaint(self, map: 'Map', x: int, y: int):
+        """Clear and re-composite a single map tile, so a null tile leaves nothing behind."""
+        area = Rect(x * TILESIZE - self.rect.x, y * TILESIZE - self.rect.y, TILESIZE, TILESIZE)
+        self.background.fill((0, 0, 0), area)
+        self.foreground.fill((0, 255, 255), area)
+        self.drawtile(map, x, y)
 
 
 class Map:
-    """Data and methods for drawing the background and foreground layers. Map contains two 2D lists of Tile objects,
-    as well as background and foreground surfaces to draw them to.
-
-    TODO: Foreground Layer
-    TODO: Map Scrolling"""
-    background: pygame.Surface  # The background layer to be drawn to the game display.
-    foreground: pygame.Surface  # The foreground layer to be drawn to the game display.
-    backtiles: List[List]  # A two-dimensional list of Tile objects representing the background.
-    foretiles: List[List]  # A two-dimensional list of Tile objects representing the foreground.
+    """Data and methods for drawing the background and foreground layers. Each layer is stored as a flat array of
+    indexes into the map's tile table, where index 0 is the null tile and every other entry is a shared Tile object.
+    Maps can be any size. For drawing, a map is divided into MapChunks, which are composited the first time they are
+    needed and can be released once they are well out of view. After that, only tiles marked with invalidate() or
+    changed with setbacktile()/setforetile() are repainted, the next time redraw() is called.
+
+    TODO: Foreground Layer"""
+    width: int  # The width of the map in tiles.
+    height: int  # The height of the map in tiles.
+    tiletable: List[Optional[Tile]]  # The Tile types used by this map. Entry 0 is always None, the null tile.
+    tileindexes: Dict[str, int]  # The position of each tile ID in tiletable.
+    backtiles: array  # Row-major tile table indexes representing the background.
+    foretiles: array  # Row-major tile table indexes representing the foreground.
+    chunks: Dict[Tuple[int, int], MapChunk]  # The chunks that have been composited, keyed by (column, row).
     encounter_rate: int  # The number of enemy encounters to spawn when entering this map.
     encounter_set: Set  # The set of encounters to draw from for this map.
     zone: str  # The zone that this map belongs to. Zones are collections of maps that represent towns, dungeons, etc.
+    weather: str  # The weather on this map, e.g. 'snow', or mapcompiler.NO_WEATHER.
     name: str  # The name of this map, if any.
+    filename: Optional[str]  # The map file in data/maps that this map was loaded from, if any.
+    seed: Optional[int]  # The seed this map was generated from, if it was generated.
     spawns: Dict  # The available spawn points for the player.
+    links: Dict[str, str]  # The neighbouring map filenames named by spawn points, keyed by spawn name.
+    dirty: Set[Tuple[int, int]]  # Tile positions whose layers need to be repainted by the next redraw().
+    edits: Dict[Tuple[int, int, int], str]  # Tile IDs changed since the map was loaded, keyed by (layer, x, y), where
+    #   layer 0 is the background and layer 1 the foreground. Saved games store these instead of the whole map.
+
+    def __init__(self, filename: str = None, data: mapcompiler.MapData = None, seed: int = None):
+        # filename: The map file in data/maps to load. If neither this nor data is given, a random map is generated.
+        # data: Map data that has already been loaded, e.g. by a MapLoader.
+        # seed: The seed for generating a random map. The same seed always generates the same map.
+        self.filename = filename
+        self.seed = seed
+        self.width = mapcompiler.MAP_WIDTH
+        self.height = mapcompiler.MAP_HEIGHT
+        self.tiletable = [None]
+        self.tileindexes = {'00000000000': 0}
+        self.backtiles = array('H', bytes(2 * self.width * self.height))
+        self.foretiles = array('H', bytes(2 * self.width * self.height))
+        self.chunks = dict()
+        self.spawns = dict()
+        self.links = dict()
+        self.dirty = set()
+        self.edits = dict()
+
+        if data is not None:
+            with PROFILER.timeload('Map', filename or 'data'):
+                self.load(data)
+        elif filename is None:
+            # Generate a snowfield with frozen lakes. The seed is kept, so that a saved game can generate it again.
+            if seed is None:
+                self.seed = Random().randrange(2 ** 32)
+            import mapgen
+            with PROFILER.timeload('Map', 'generated %d' % self.seed):
+                self.load(mapgen.generate(self.seed, self.width, self.height))
+        else:  # Initialize a map from its compiled copy, recompiling the .ini file first if it has changed.
+            with PROFILER.timeload('Map', filename):
+                self.load(mapcompiler.loadmap(filename))
 
-    def __init__(self, filename: str = None):
-        self.background = pygame.Surface(SCREENRECT.size)
-        self.background.fill((0, 0, 0))
-        self.foreground = pygame.Surface(SCREENRECT.size)
-        self.foreground.set_colorkey((0, 255, 255))
-        self.foreground.fill((0, 255, 255))
-        self.backtiles = list()
-        self.foretiles = list()
+            # TODO: When enemy encounters are implemented, get encounter sets from the header line.
+            #  Encounter sets are generally universal for all maps within a zone.
 
-        if filename is None:
-            # generate a random assortment of snow and ice tiles, with each tile having a 50% chance of being
-            # snow and a 50% chance of being ice.
-            SNOW = '0000ts@snow'
-            ICE = '0101fs@snow'
-            roller = Random()
-
-            for y in range(12):
-                row = list()
-                for x in range(16):
-                    z = roller.randint(1, 100)
-                    if z <= 70:
-                        row.append(Tile(SNOW))
-                    else:
-                        row.append(Tile(ICE))
-                self.backtiles.append(row)
-        else:  # Initialize a map from .ini file
-            # Open the map file.
-            path = os.path.join('data', 'maps', filename)
-            mapdata = open(path)
-
-            # Header
-            mapdata.readline()  # Section titles are included in map files for readability. Skip them.
-            line = mapdata.readline()  # Get the header.
-            splitline = line.split('|')  # Split the header line using pipes.
-            self.zone = splitline[0]  # Get the zone name from the header line.
-
-            # If a map name is specified, set self.name. Otherwise, declare that object as None.
-            if splitline[1] is not 'none':
-                self.name = splitline[1]
-            else:
-                self.name = None
+    def load(self, data: mapcompiler.MapData):
+        """Take the header, layers, and spawn points from loaded map data. Each distinct tile ID is looked up once;
+        the layers are used as they are, since the map's tile table is built in the same order as the data's."""
+        self.zone = data.zone
+        self.name = data.name
+        self.encounter_rate = data.encounter_rate
+        self.weather = data.weather
+        self.width = data.width
+        self.height = data.height
+        self.tiletable = [None]
+        self.tileindexes = {mapcompiler.NULL_TILE: 0}
+        for id in data.tileids[1:]:
+            self.tileindex(id)
+        self.backtiles = array('H', data.backtiles)
+        self.foretiles = array('H', data.foretiles)
+        self.spawns = dict(data.spawns)
+        self.links = dict(data.links)
+        self.chunks.clear()
+        self.edits.clear()
+
+    def reload(self, data: mapcompiler.MapData) -> Optional[List[Tuple[int, int]]]:
+        """Take new contents for the map, such as an edited copy of its file, changing only the tiles whose IDs differ.
+        Those tiles are marked for repainting and their collision flags refreshed, and every chunk and the rest of the
+        collision index are kept. Tiles changed with setbacktile()/setforetile() keep their changes. Returns the
+        positions of the tiles that changed, or None if the map's size changed, in which case it is loaded afresh and
+        its collision index has to be rebuilt."""
+        self.zone = data.zone
+        self.name = data.name
+        self.encounter_rate = data.encounter_rate
+        self.weather = data.weather
+        self.spawns = dict(data.spawns)
+        self.links = dict(data.links)
+        edits = dict(self.edits)
+        if (data.width, data.height) != (self.width, self.height):
+            self.load(data)
+            for (layer, x, y), id in edits.items():
+                if x < self.width and y < self.height:
+                    (self.foretiles if layer else self.backtiles)[y * self.width + x] = self.tileindex(id)
+                    self.edits[(layer, x, y)] = id
+            return None
+
+        # Translate the new layers into this map's tile table, so that comparing indexes compares tile IDs.
+        indexes = np.array([self.tileindex(id) for id in data.tileids], np.uint16)
+        changed = np.zeros(self.width * self.height, bool)
+        for layer, (tiles, newtiles) in enumerate(((self.backtiles, data.backtiles),
+                                                    (self.foretiles, data.foretiles))):
+            tiles = np.frombuffer(tiles, np.uint16)  # A writable view of the layer.
+            newtiles = indexes[np.frombuffer(newtiles, np.uint16)]
+            differs = tiles != newtiles
+            for edited, x, y in edits:
+                if edited == layer:
+                    differs[y * self.width + x] = False
+            tiles[differs] = newtiles[differs]
+            changed |= differs
+
+        positions = [(i % self.width, i // self.width) for i in np.flatnonzero(changed).tolist()]
+        for x, y in positions:
+            self.invalidate(x, y)
+            COLLISIONS.updatetile(self, x, y)
+        return positions
+
+    def retile(self, ids: Iterable[str]) -> List[Tuple[int, int]]:
+        """Swap in the current shared Tile for each of the given IDs, after gettile() has been made to build them
+        again, e.g. because their tileset was edited. Every tile position using one of them is marked for repainting
+        and its collision flag refreshed. Returns those positions."""
+        indexes = list()
+        for id in ids:
+            index = self.tileindexes.get(id)
+            if index is not None:
+                self.tiletable[index] = gettile(id)
+                indexes.append(index)
+        if not indexes:
+            return list()
+
+        used = np.isin(np.frombuffer(self.backtiles, np.uint16), indexes)
+        used |= np.isin(np.frombuffer(self.foretiles, np.uint16), indexes)
+        positions = [(i % self.width, i // self.width) for i in np.flatnonzero(used).tolist()]
+        for x, y in positions:
+            self.invalidate(x, y)
+            COLLISIONS.updatetile(self, x, y)
+        return positions
+
+    def tileindex(self, id: str) -> int:
+        """Get the tile table index for a tile ID, adding the shared Tile to the table if this map hasn't used it."""
+        index = self.tileindexes.get(id)
+        if index is None:
+            index = len(self.tiletable)
+            self.tiletable.append(gettile(id))
+            self.tileindexes[id] = index
+        return index
+
+    def backtile(self, x: int, y: int) -> Optional[Tile]:
+        """Get the background Tile at a tile position, or None for a null tile."""
+        return self.tiletable[self.backtiles[y * self.width + x]]
+
+    def foretile(self, x: int, y: int) -> Optional[Tile]:
+        """Get the foreground Tile at a tile position, or None for a null tile."""
+        return self.tiletable[self.foretiles[y * self.width + x]]
+
+    def setbacktile(self, x: int, y: int, id: str):
+        """Replace the background tile at a tile position and mark it for repainting."""
+        self.backtiles[y * self.width + x] = self.tileindex(id)
+        self.edits[(0, x, y)] = id
+        self.invalidate(x, y)
+        COLLISIONS.updatetile(self, x, y)
+
+    def setforetile(self, x: int, y: int, id: str):
+        """Replace the foreground tile at a tile position and mark it for repainting."""
+        self.foretiles[y * self.width + x] = self.tileindex(id)
+        self.edits[(1, x, y)] = id
+        self.invalidate(x, y)
+        COLLISIONS.updatetile(self, x, y)
+
+    def invalidate(self, x: int, y: int):
+        """Mark a tile position to be repainted on both layers by the next redraw(). Use this for animated tiles, doors,
+        and anything else that changes a tile's appearance after the map is loaded."""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.dirty.add((x, y))
+
+    def redraw(self) -> List[Rect]:
+        """Repaint every invalidated tile in the chunks that have been composited. Tiles in other chunks will be drawn
+        when their chunk is. Returns the world rectangles that were repainted."""
+        rects = list()
+        for x, y in self.dirty:
+            chunk = self.chunks.get((x // CHUNKSIZE, y // CHUNKSIZE))
+            if chunk is not None:
+                chunk.repaint(self, x, y)
+                rects.append(Rect(x * TILESIZE, y * TILESIZE, TILESIZE, TILESIZE))
+
+        self.dirty.clear()
+        return rects
+
+    def pixelrect(self) -> Rect:
+        """Get the area the map covers, in world pixels."""
+        return Rect(0, 0, self.width * TILESIZE, self.height * TILESIZE)
+
+    def chunksin(self, area: Rect) -> List[MapChunk]:
+        """Get the chunks overlapping an area in world pixels, compositing any that haven't been drawn yet."""
+        area = area.clip(self.pixelrect())
+        if area.width == 0 or area.height == 0:
+            return list()
+
+        size = CHUNKSIZE * TILESIZE
+        chunks = list()
+        for row in range(area.top // size, (area.bottom - 1) // size + 1):
+            for column in range(area.left // size, (area.right - 1) // size + 1):
+                chunk = self.chunks.get((column, row))
+                if chunk is None:
+                    chunk = MapChunk(self, column, row)
+                    self.chunks[(column, row)] = chunk
+                chunks.append(chunk)
+        return chunks
+
+    def releasechunks(self, keep: Rect):
+        """Drop the composited chunks that don't overlap an area in world pixels. They are re-composited if they are
+        needed again."""
+        for key in [key for key, chunk in self.chunks.items() if not chunk.rect.colliderect(keep)]:
+            del self.chunks[key]
+
+
+class Camera:
+    """The viewport onto the world. The camera follows a target, such as the PlayerSprite, and is clamped to the
+    edges of the map. A map smaller than the viewport is centered."""
+    rect: Rect  # The area shown on screen, in world pixels.
+
+    def __init__(self, size: Tuple[int, int]):
+        self.rect = Rect((0, 0), size)
+
+    def follow(self, target: Rect, map: Map) -> bool:
+        """Center the viewport on a target, keeping it within the map. Returns whether the viewport moved."""
+        bounds = map.pixelrect()
+        previous = Rect(self.rect)
+        self.rect.center = target.center
+        if bounds.width <= self.rect.width:
+            self.rect.centerx = bounds.centerx
+        else:
+            self.rect.left = max(bounds.left, min(self.rect.left, bounds.right - self.rect.width))
+        if bounds.height <= self.rect.height:
+            self.rect.centery = bounds.centery
+        else:
+            self.rect.top = max(bounds.top, min(self.rect.top, bounds.bottom - self.rect.height))
+        return self.rect != previous
+
+    def toscreen(self, rect: Rect) -> Rect:
+        """Convert a rectangle in world pixels to screen pixels."""
+        return rect.move(-self.rect.x, -self.rect.y)
+
+    def toworld(self, rect: Rect) -> Rect:
+        """Convert a rectangle in screen pixels to world pixels."""
+        return rect.move(self.rect.x, self.rect.y)
+
+
+class CollisionGrid:
+    """A grid-based index of collision zones. Impassable map tiles are stored as one flag per tile, and blocking
+    Entities are bucketed by the tiles their collision rectangles overlap. Queries only examine the few tiles under the
+    rectangle being tested, so their cost doesn't grow with the size of the map or the number of Entities."""
+    map: Optional[Map]  # The map the grid was built from.
+    width: int  # The width of the grid in tiles.
+    height: int  # The height of the grid in tiles.
+    blocked: bytearray  # Row-major flags, 1 for each impassable tile.
+    buckets: Dict[Tuple[int, int], Set[pygame.sprite.Sprite]]  # Blocking Entities overlapping each tile.
+    entitycells: Dict[pygame.sprite.Sprite, List[Tuple[int, int]]]  # The tiles each blocking Entity is bucketed in.
+    watchers: List[Callable[[Optional[int], Optional[int]], None]]  # Told (x, y) when a tile's flag changes, or
+    #   (None, None) when the whole grid is rebuilt.
+
+    def __init__(self):
+        self.map = None
+        self.width = 0
+        self.height = 0
+        self.blocked = bytearray()
+        self.buckets = dict()
+        self.entitycells = dict()
+        self.watchers = list()
+
+    def build(self, map: Map):
+        """Rebuild the tile flags from a map's passability. Blocking Entities are kept."""
+        self.map = map
+        self.width = map.width
+        self.height = map.height
+        # Work out whether each entry in the tile table blocks, then look every tile up at once; see isblocked().
+        backblocks = np.array([tile is None or not tile.passable for tile in map.tiletable], bool)
+        foreblocks = np.array([tile is not None and not tile.passable for tile in map.tiletable], bool)
+        blocked = backblocks[np.frombuffer(map.backtiles, np.uint16)]
+        blocked |= foreblocks[np.frombuffer(map.foretiles, np.uint16)]
+        self.blocked = bytearray(blocked.tobytes())
+        for watcher in self.watchers:
+            watcher(None, None)
+
+    def updatetile(self, map: Map, x: int, y: int):
+        """Refresh the flag for a single tile after it changes. Changes to maps other than the indexed one are ignored.
+        A tile is impassable if its background is null or impassable, or if its foreground is impassable."""
+        if map is not self.map:
+            return
+
+        blocked = self.isblocked(map, x, y)
+        if self.blocked[y * self.width + x] != blocked:
+            self.blocked[y * self.width + x] = blocked
+            for watcher in self.watchers:
+                watcher(x, y)
+
+    @staticmethod
+    def isblocked(map: Map, x: int, y: int) -> bool:
+        backtile = map.backtile(x, y)
+        foretile = map.foretile(x, y)
+        return backtile is None or not backtile.passable or (foretile is not None and not foretile.passable)
+
+    def cellsunder(self, rect: Rect) -> List[Tuple[int, int]]:
+        """Get the positions of the tiles overlapped by a rectangle."""
+        left = rect.left // TILESIZE
+        right = (rect.right - 1) // TILESIZE
+        top = rect.top // TILESIZE
+        bottom = (rect.bottom - 1) // TILESIZE
+        return [(x, y) for y in range(top, bottom + 1) for x in range(left, right + 1)]
+
+    def addentity(self, entity: pygame.sprite.Sprite):
+        """Start treating an Entity's collisionrect as a collision zone."""
+        cells = self.cellsunder(entity.collisionrect)
+        for cell in cells:
+            self.buckets.setdefault(cell, set()).add(entity)
+        self.entitycells[entity] = cells
+
+    def removeentity(self, entity: pygame.sprite.Sprite):
+        """Stop treating an Entity as a collision zone."""
+        for cell in self.entitycells.pop(entity, ()):
+            bucket = self.buckets[cell]
+            bucket.discard(entity)
+            if not bucket:
+                del self.buckets[cell]
+
+    def moveentity(self, entity: pygame.sprite.Sprite):
+        """Re-bucket a blocking Entity after its collisionrect moves."""
+        if entity in self.entitycells:
+            self.removeentity(entity)
+            self.addentity(entity)
+
+    def collides(self, rect: Rect, ignore: pygame.sprite.Sprite = None) -> bool:
+        """Check whether a rectangle overlaps an impassable tile or a blocking Entity other than ignore. Tiles outside
+        the map are not treated as impassable."""
+        for x, y in self.cellsunder(rect):
+            if 0 <= x < self.width and 0 <= y < self.height and self.blocked[y * self.width + x]:
+                return True
+            for entity in self.buckets.get((x, y), ()):
+                if entity is not ignore and rect.colliderect(entity.collisionrect):
+                    return True
 
-            self.encounter_rate = int(splitline[2])  # Get the encounter rate from the header line.
+        return False
+
+    def clear(self):
+        """Drop the indexed map and every blocking Entity. Watchers are kept, and told the grid was rebuilt."""
+        watchers = self.watchers
+        self.__init__()
+        self.watchers = watchers
+        for watcher in watchers:
+            watcher(None, None)
 
-            # TODO: When enemy encounters are implemented, get encounter sets from the header line.
-            #  Encounter sets are generally universal for all maps within a zone.
 
-            # Background
-            mapdata.readline()  # Section titles are included in map files for readability. Skip them.
-
-            # Each map in the game is at most 16 tiles by 12 tiles - the size of the game window.
-            for y in range(12):
-                line = mapdata.readline()  # Get a row of tile IDs.
-                splitline = line.split('|')  # Break up the row using pipes.
-
-                # Create a list representing the row of tiles. Check each line entry; a value of '00000000000' indicates
-                # a null tile, while any other value should be passed to the Tile class's constructor.
-                row = list()
-                for x in range(16):
-                    if splitline[x] == '00000000000':
-                        row.append(None)
-                    else:
-                        row.append(Tile(splitline[x]))
-
-                self.backtiles.append(row)
-
-            # Foreground
-            mapdata.readline()  # Section titles are included in map files for readability. Skip them.
-
-            # Each map in the game is at most 16 tiles by 12 tiles - the size of the game window.
-            for y in range(12):
-                line = mapdata.readline()  # Get a row of tile IDs.
-                splitline = line.split('|')  # Break up the row using pipes.
-
-                # Create a list representing the row of tiles. Check each line entry; a value of '00000000000' indicates
-                # a null tile, while any other value should be passed to the Tile class's constructor.
-                row = list()
-                for x in range(16):
-                    if splitline[x] == '00000000000':
-                        row.append(None)
-                    else:
-                        row.append(Tile(splitline[x]))
-
-                self.foretiles.append(row)
-
-            # Player Spawn Locations
-            mapdata.readline()  # Section titles are included in map files for readability. Skip them.
-            spawns = dict()
-            reading = True
-            while reading:
-                line = mapdata.readline()
-                if line == 'END OF FILE':
-                    reading = False
-                else:
-                    splitline = line.split('|')
-                    spawnpoint = (int(splitline[1]), int(splitline[2]))  # Get a tuple representing the spawn point.
-                    spawns[splitline[0]] = spawnpoint  # Create a dictionary entry for the spawn point.
-
-    def drawbgtile(self, tile: Tile, x: int, y: int):
-        x_pos = x * 64
-        y_pos = y * 64
-        self.background.blit(tile.image, (x_pos, y_pos))
-
-    def drawfgtile(self, tile: Tile, x: int, y: int):
-        x_pos = x * 64
-        y_pos = y * 64
-        self.foreground.blit(tile.image, (x_pos, y_pos))
-
-    def drawbg(self):
-        for y in range(len(self.backtiles)):
-            for x in range(len(self.backtiles[y])):
-                if self.backtiles[y][x] is not None:
-                    self.drawbgtile(self.backtiles[y][x], x, y)
-
-    def drawfg(self):
-        for y in range(len(self.foretiles)):
-            for x in range(len(self.foretiles[y])):
-                if self.foretiles[y][x] is not None:
-                    self.drawfgtile(self.foretiles[y][x], x, y)
+COLLISIONS = CollisionGrid()  # The collision index for the active map.
 
 
 def compilecollision(map: Map):
-    """Compile a set of rectangles representing collision zones."""
-
-    # Clear the COLLISIONS set.
-    COLLISIONS.clear()
-
-    # Get rectangles for impassable map tiles.
-    for y in range(12):
-        for x in range(16):
-            bounds = Rect(x * 64, y * 64, 64, 64)
-            if map.backtiles[y][x] is None:
-                if bounds not in COLLISIONS:
-                    COLLISIONS.append(bounds)
-            elif map.backtiles[y][x].passable is False:
-                if bounds not in COLLISIONS:
-                    COLLISIONS.append(bounds)
-            if map.foretiles[y][x] is not None:
-                if map.foretiles[y][x].passable is False:
-                    if bounds not in COLLISIONS:
-                        COLLISIONS.append(bounds)
-
-    # TODO: Get collision rectangles for non-player Entities.
+    """Build the collision index for a map. This only needs to be done when a map is loaded; tile changes made through
+    Map.setbacktile() and Map.setforetile() update the index incrementally."""
+    COLLISIONS.build(map)
+
+    # TODO: Add collision zones for non-player Entities with COLLISIONS.addentity().
+
+
+class MapLoader:
+    """Prepares maps on a background thread, so that moving between maps doesn't stall the game loop. The worker thread
+    reads (and, if needed, recompiles) map files and decodes the tileset images they use; the main thread only
+    converts those images and builds the Map. Prepared maps are kept in a bounded least-recently-used cache.
+    Call poll() once a frame to collect the worker's results."""
+    capacity: int  # The number of prepared maps to keep.
+    ready: 'OrderedDict[str, mapcompiler.MapData]'  # Prepared maps, keyed by filename, least recently used first.
+    pending: Set[str]  # Filenames that have been requested from the worker but not collected yet.
+    requests: queue.Queue  # Filenames for the worker to prepare. None stops the worker.
+    results: queue.Queue  # (filename, map data or None, decoded tileset images) tuples from the worker.
+    worker: threading.Thread  # The background thread.
+
+    def __init__(self, capacity: int = 8):
+        self.capacity = capacity
+        self.ready = OrderedDict()
+        self.pending = set()
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target=self.work, name='MapLoader', daemon=True)
+        self.worker.start()
+
+    def work(self):
+        """The worker thread's loop. Nothing here may convert surfaces or touch the display."""
+        while True:
+            filename = self.requests.get()
+            if filename is None:
+                return
+
+            try:
+                data = mapcompiler.loadmap(filename)
+                images = dict()
+                for id in data.tileids[1:]:
+                    tileset = id.partition('@')[2]
+                    if tileset in TILESET_FILES and tileset not in TILESETS.atlases and tileset not in images:
+                        images[tileset] = pygame.image.load(os.path.join('data', TILESET_FILES[tileset]))
+                self.results.put((filename, data, images))
+            except Exception:
+                # A map that fails to prepare is simply not cached. get() loads it directly and reports the error.
+                self.results.put((filename, None, dict()))
+
+    def collect(self, result: Tuple[str, Optional[mapcompiler.MapData], Dict[str, pygame.Surface]]):
+        """Finish a result from the worker on the main thread."""
+        filename, data, images = result
+        self.pending.discard(filename)
+        for tileset, image in images.items():
+            TILESETS.install(tileset, image)
+        if data is not None:
+            self.store(filename, data)
+
+    def poll(self):
+        """Collect every result the worker has finished, without waiting."""
+        while True:
+            try:
+                self.collect(self.results.get_nowait())
+            except queue.Empty:
+                return
+
+    def store(self, filename: str, data: mapcompiler.MapData):
+        """Add a prepared map to the cache, dropping the least recently used maps beyond capacity."""
+        self.ready[filename] = data
+        self.ready.move_to_end(filename)
+        while len(self.ready) > self.capacity:
+            self.ready.popitem(last=False)
+
+    def prefetch(self, filename: str):
+        """Ask the worker to prepare a map, unless it is already prepared or on its way."""
+        if filename not in self.ready and filename not in self.pending:
+            self.pending.add(filename)
+            self.requests.put(filename)
+
+    def prefetchneighbours(self, filename: str):
+        """Prepare the maps that neighbour a prepared map through its spawn points."""
+        data = self.ready.get(filename)
+        if data is not None:
+            for neighbour in mapcompiler.neighbours(filename, data):
+                self.prefetch(neighbour)
+
+    def discard(self, filename: str):
+        """Forget a prepared map, e.g. because its file has changed. It is prepared again when next requested."""
+        self.ready.pop(filename, None)
+
+    def get(self, filename: str) -> Map:
+        """Build a map, using its prepared data if it is ready. A map the worker is still preparing is waited for, and
+        a map that was never requested is loaded on the spot."""
+        self.poll()
+        while filename in self.pending:
+            self.collect(self.results.get())
+
+        data = self.ready.get(filename)
+        if data is None:
+            data = mapcompiler.loadmap(filename)
+        self.store(filename, data)
+        return Map(filename, data)
+
+    def stop(self):
+        """Stop the worker thread once it finishes its current request."""
+        self.requests.put(None)
+        self.worker.join()
+
+
+# Sprite groups for the layers drawn on top of the map and Entities. These are empty until effects and UI are added.
+ENTITY_EFFECTS = pygame.sprite.Group()  # Layer 2 - Entity Effects
+FOREGROUND_EFFECTS = pygame.sprite.Group()  # Layer 3 - Foreground Effects
+MASKS = pygame.sprite.Group()  # Layer 4 - Masks
+UI_FRAME = pygame.sprite.Group()  # Layer 5 - UI Frame
+UI_CONTROLS = pygame.sprite.Group()  # Layer 6 - UI Controls
+# The particle systems, created by starteffects() when the first Renderer is made.
+PARTICLE_QUALITY: Optional['particles.QualityScaler'] = None  # Thins out every particle effect while frames run over
+#   budget.
+EFFECT_PARTICLES: Optional['particles.ParticleSystem'] = None  # Layer 2 - Entity Effects: breath, spells
+FOREGROUND_PARTICLES: Optional['particles.ParticleSystem'] = None  # Layer 3 - Foreground Effects: weather
+
+
+def starteffects():
+    """Import the particle module and create the shared particle systems, unless that has been done already."""
+    global PARTICLE_QUALITY, EFFECT_PARTICLES, FOREGROUND_PARTICLES
+    if PARTICLE_QUALITY is None:
+        import particles
+        PARTICLE_QUALITY = particles.QualityScaler()
+        EFFECT_PARTICLES = particles.ParticleSystem(PARTICLE_QUALITY)
+        FOREGROUND_PARTICLES = particles.ParticleSystem(PARTICLE_QUALITY)
+
+
+# A sprite, with the screen rect and image to draw it with. A ParticleLayer places one entry per emitter instead, with
+# the screen area its particles cover and a token in place of the image.
+Placement = Tuple[pygame.sprite.Sprite, Rect, pygame.Surface]
+
+
+class Renderer:
+    """Draws the game's layers to the display using dirty rectangles. Layers are drawn in this order:
+        Layer 0 - Background (the map's background chunks)
+        Layer 1 - Entities
+        Layer 2 - Entity Effects
+        Layer 3 - Foreground (the map's foreground chunks), then Foreground Effects
+        Layer 4 - Masks
+        Layer 5 - UI Frame
+        Layer 6 - UI Controls
+    Layers 0 to 3 are positioned in the world and drawn through the camera; layers 4 to 6 are positioned on screen.
+    Each frame, only the regions that changed are repainted and presented: map tiles repainted by Map.redraw(), and the
+    old and new positions of any sprite that moved, changed image, or was added or removed. Changing the map, scrolling
+    the camera, or calling invalidate(), repaints and presents the whole screen on the next frame."""
+    display: pygame.Surface  # The surface to draw to.
+    camera: Camera  # The viewport onto the world.
+    map: Optional[Map]  # The map supplying the background and foreground layers.
+    belowforeground: List[pygame.sprite.AbstractGroup]  # World sprite layers drawn between background and foreground.
+    aboveforeground: List[pygame.sprite.AbstractGroup]  # World sprite layers drawn on top of the foreground.
+    overlays: List[pygame.sprite.AbstractGroup]  # Screen sprite layers drawn on top of everything else.
+    drawn: Dict[pygame.sprite.Sprite, Tuple[Rect, pygame.Surface]]  # Each sprite's screen rect and image when drawn.
+    fullredraw: bool  # Whether the next frame should repaint the whole screen.
+    target: Optional[pygame.sprite.Sprite]  # The sprite the camera follows.
+    alpha: float  # How far the frame being drawn is between the previous simulation tick and the latest, from 0 to 1.
+    placed: List[List[Placement]]  # Where each layer's sprites are drawn this frame.
+
+    def __init__(self, display: pygame.Surface):
+        import particles
+        starteffects()
+        self.display = display
+        self.camera = Camera(display.get_size())
+        self.map = None
+        self.belowforeground = [ENTITIES, EntityLayer(ENTITY_STORE, self.camera), ENTITY_EFFECTS,
+                                particles.ParticleLayer(EFFECT_PARTICLES, self.camera)]
+        self.aboveforeground = [FOREGROUND_EFFECTS, particles.ParticleLayer(FOREGROUND_PARTICLES, self.camera)]
+        self.overlays = [MASKS, UI_FRAME, UI_CONTROLS]
+        self.drawn = dict()
+        self.fullredraw = True
+        self.target = None
+        self.alpha = 1.0
+        self.placed = list()
+
+    def setmap(self, map: Map):
+        """Switch to drawing a new map. The next frame is a full redraw."""
+        self.map = map
+        self.invalidate()
 
-# Main game function.
-def main():
-    pygame.init()  # Initialize pygame
-    MAIN_DISPLAY = pygame.display.set_mode(SCREENRECT.size)  # Initialize the game window.
-    testmap = Map("northsalkstonmap.ini")  # The map to use for testing.
-    player = PlayerSprite((512, 384), 0)
-    compilecollision(testmap)  # Compile the initial collision set.
-    gameclock = pygame.time.Clock()
+    def invalidate(self):
+        """Repaint and present the whole screen on the next frame."""
+        self.fullredraw = True
 
-    # Game loop
-    while True:
-        # Event Handling
-        for event in pygame.event.get():
-            # Quit the game if a QUIT event is read.
-            if event.type == QUIT:
+    def follow(self, target: Rect):
+        """Scroll the camera to follow a target in world pixels. Scrolling repaints the whole screen, and chunks that
+        have moved well out of view are released."""
+        if self.map is not None and self.camera.follow(target, self.map):
+            self.invalidate()
+            size = CHUNKSIZE * TILESIZE
+            self.map.releasechunks(self.camera.rect.inflate(2 * size, 2 * size))
+
+    def worldrect(self, sprite: pygame.sprite.Sprite) -> Rect:
+        """Get the rectangle to draw a world sprite at. Sprites that record their previous position are interpolated
+        between it and their current position, so movement stays smooth when frames are drawn between ticks."""
+        previous = getattr(sprite, 'previous', None)
+        if previous is None or self.alpha >= 1.0:
+            return sprite.rect
+        x = previous[0] + round((sprite.rect.x - previous[0]) * self.alpha)
+        y = previous[1] + round((sprite.rect.y - previous[1]) * self.alpha)
+        return Rect(x, y, sprite.rect.width, sprite.rect.height)
+
+    def place(self, group: pygame.sprite.AbstractGroup, world: bool) -> List[Placement]:
+        """Get the sprites of a layer with their screen rects and images. World sprites are positioned through the
+        camera; the others are positioned on screen. Layers that can place all their sprites at once, like an
+        EntityLayer, do so through their own place()."""
+        place = getattr(group, 'place', None)
+        if place is not None:
+            return place(self.alpha)
+        if world:
+            return [(sprite, self.camera.toscreen(self.worldrect(sprite)), sprite.image) for sprite in group.sprites()]
+        return [(sprite, sprite.rect, sprite.image) for sprite in group.sprites()]
+
+    def screensprites(self) -> Iterator[Placement]:
+        """Iterate over the sprites on every layer, with their positions on screen and images."""
+        for placed in self.placed:
+            yield from placed
+
+    def changedrects(self) -> List[Rect]:
+        """Collect the screen rectangles that changed since the last frame and record what each sprite looks like."""
+        rects = list()
+        if self.map is not None:
+            rects = [self.camera.toscreen(rect) for rect in self.map.redraw()]
+
+        current = dict()
+        for sprite, rect, image in self.screensprites():
+            state = (rect, image)
+            current[sprite] = state
+            last = self.drawn.get(sprite)
+            if last is None:
+                rects.append(rect)
+            elif last[0] != rect or last[1] is not state[1]:
+                rects.append(last[0].union(rect))  # Cover both the old and the new position.
+
+        # Sprites that were removed leave their old position behind.
+        for sprite, last in self.drawn.items():
+            if sprite not in current:
+                rects.append(last[0])
+
+        self.drawn = current
+        screen = self.display.get_rect()
+        return [rect.clip(screen) for rect in rects if rect.colliderect(screen)]
+
+    def blitsprites(self, groups: List[pygame.sprite.AbstractGroup], layers: List[List[Placement]], area: Rect) -> int:
+        """Draw the placed sprites of some layers that overlap an area of the display. Layers that draw themselves in
+        batches, like a ParticleLayer, supply their own blits through blitsin(). Returns the number of blits issued."""
+        blits = 0
+        for group, placed in zip(groups, layers):
+            blitsin = getattr(group, 'blitsin', None)
+            if blitsin is not None:
+                sequence = blitsin(area) if placed else list()
+            else:
+                sequence = [(placed[index][2], placed[index][1]) for index in area.collidelistall([rect for _, rect, _
+                                                                                                   in placed])]
+            self.display.blits(sequence, False)
+            blits += len(sequence)
+        return blits
+
+    def paint(self, area: Rect):
+        """Repaint every layer inside an area of the display."""
+        self.display.set_clip(area)
+        self.display.fill((0, 0, 0), area)
+        chunks = self.map.chunksin(self.camera.toworld(area)) if self.map is not None else list()
+        for chunk in chunks:  # Layer 0 - Background
+            self.display.blit(chunk.background, self.camera.toscreen(chunk.rect))
+        blits = 2 * len(chunks)
+        below = len(self.belowforeground)
+        above = below + len(self.aboveforeground)
+        # Layers 1 and 2 - Entities and Entity Effects
+        blits += self.blitsprites(self.belowforeground, self.placed[:below], area)
+        for chunk in chunks:  # Layer 3 - Foreground
+            self.display.blit(chunk.foreground, self.camera.toscreen(chunk.rect))
+        blits += self.blitsprites(self.aboveforeground, self.placed[below:above], area)  # Layer 3 - Foreground Effects
+        # Layers 4 to 6 - Masks, UI Frame and UI Controls
+        blits += self.blitsprites(self.overlays, self.placed[above:], area)
+        self.display.set_clip(None)
+        PROFILER.count('blits', blits)
+
+    def render(self, alpha: float = 1.0) -> List[Rect]:
+        """Repaint the regions of the display that changed, with the camera following its target. alpha is how far
+        the frame is between the previous simulation tick and the latest. Returns the rectangles that need to be
+        presented."""
+        self.alpha = alpha
+        if self.target is not None:
+            self.follow(self.worldrect(self.target))
+        self.placed = [self.place(group, True) for group in self.belowforeground + self.aboveforeground]
+        self.placed += [self.place(group, False) for group in self.overlays]
+        rects = self.changedrects()
+        if len(rects) > MAX_DIRTY_RECTS or self.display.get_rect() in rects:
+            # Repainting many overlapping regions costs more than repainting everything once, and a region covering
+            # the whole screen, such as weather, makes the others redundant.
+            self.fullredraw = True
+        if self.fullredraw:
+            self.fullredraw = False
+            rects = [self.display.get_rect()]
+
+        for rect in rects:
+            self.paint(rect)
+        return rects
+
+    @staticmethod
+    def present(rects: List[Rect]):
+        """Push the given regions of the display to the screen."""
+        if rects:
+            pygame.display.update(rects)
+
+
+class FixedTimestep:
+    """Turns elapsed real time into a whole number of fixed-length simulation ticks. Leftover time carries over to the
+    next frame, and its fraction of a tick (alpha) is used to interpolate drawing. If the game falls more than
+    MAX_TICKS behind, the excess time is dropped: rendered frames are skipped to catch up, but the simulation never
+    runs in slow motion for more than an instant."""
+    tick: float  # The length of a simulation tick in seconds.
+    maxticks: int  # The most ticks to run for a single frame.
+    accumulator: float  # Elapsed time not yet consumed by ticks.
+    ticks: int  # The number of ticks run so far.
+    dropped: float  # Total time dropped because the game fell too far behind.
+
+    def __init__(self, rate: int = TICKRATE, maxticks: int = MAX_TICKS):
+        self.tick = 1 / rate
+        self.maxticks = maxticks
+        self.accumulator = 0.0
+        self.ticks = 0
+        self.dropped = 0.0
+
+    def advance(self, elapsed: float) -> int:
+        """Add elapsed real time, in seconds. Returns the number of ticks to run before the next frame."""
+        self.accumulator += elapsed
+        count = int(self.accumulator / self.tick)
+        if count > self.maxticks:
+            self.dropped += (count - self.maxticks) * self.tick
+            count = self.maxticks
+            self.accumulator = self.tick * count + self.accumulator % self.tick
+        self.accumulator -= count * self.tick
+        self.ticks += count
+        return count
+
+    def alpha(self) -> float:
+        """Get how far the current moment is between the latest tick and the next, from 0 to 1."""
+        return min(1.0, self.accumulator / self.tick)
+
+
+class Overworld:
+    """The overworld and exploration mode: the current map, the player sprite, and the systems that update and draw
+    them. Each frame of the game loop is handleevent() for every pending event, then update() once per simulation tick
+    that is due, then draw() and present()."""
+    display: pygame.Surface  # The surface to draw to.
+    loader: MapLoader  # Prepares neighbouring maps in the background.
+    map: Map  # The current map.
+    player: PlayerSprite  # The player party's sprite.
+    renderer: Renderer  # Draws the map and sprites to the display.
+    overlay: Optional[ProfilerOverlay]  # The profiler readout, created the first time it is shown.
+    seed: int  # The seed for the overworld's random number generator.
+    rng: Random  # The source of all randomness in the overworld, so that a seed makes a session reproducible.
+    party: List['savegame.PartyMember']  # The player's party, in order.
+    ticks: int  # The number of simulation ticks played.
+    saver: Optional['savegame.SaveWriter']  # Writes saves in the background, started by the first save.
+    snowfall: 'particles.Emitter'  # The snow falling across the view.
+    breath: 'particles.Emitter'  # The player's breath in the cold.
+    reloader: Optional['HotReloader']  # Applies edited files while the game runs, in watch mode.
+
+    def __init__(self, display: pygame.Surface, filename: str = None, seed: int = None):
+        # filename: The map file in data/maps to start on. If None, a random map is generated.
+        # seed: The seed for the overworld's random number generator. If None, one is chosen at random.
+        self.display = display
+        self.seed = seed if seed is not None else Random().randrange(2 ** 32)
+        self.rng = Random(self.seed)
+        self.loader = MapLoader()
+        location = (512, 384)
+        if filename is None:
+            import mapgen
+            self.map = Map(seed=self.rng.randrange(2 ** 32))
+            start = self.map.spawns[mapgen.START]  # Generated maps say where the player can safely arrive.
+            location = (start[0] * TILESIZE, start[1] * TILESIZE)
+        else:
+            self.map = self.loader.get(filename)
+            self.loader.prefetchneighbours(self.map.filename)
+        self.player = PlayerSprite(location, 0)
+        compilecollision(self.map)  # Compile the collision index for the map.
+        self.renderer = Renderer(display)
+        self.renderer.setmap(self.map)
+        self.renderer.target = self.player  # Keep the player in view.
+        self.overlay = None
+        self.party = list()
+        self.ticks = 0
+        self.saver = None
+        self.reloader = None
+
+        # Weather and breath. Particles draw from their own generator, so they never disturb the simulation's.
+        import particles
+        EFFECT_PARTICLES.clear()
+        FOREGROUND_PARTICLES.clear()
+        EFFECT_PARTICLES.reseed(self.seed)
+        FOREGROUND_PARTICLES.reseed(self.seed + 1)
+        self.snowfall = FOREGROUND_PARTICLES.add(particles.snowfall(self.renderer.camera.rect, SNOW_BUDGET))
+        self.breath = EFFECT_PARTICLES.add(particles.breath(Rect(0, 0, 4, 4)))
+        self.setweather()
+
+    def state(self) -> Dict[str, Any]:
+        """Get a summary of the simulation state, for checking that a replay ended where its recording did."""
+        probe = Random()  # Peek at the next random number without using it up.
+        probe.setstate(self.rng.getstate())
+        return {
+            'map': self.map.filename,
+            'player': list(self.player.rect),
+            'facing': self.player.facing,
+            'anim': [self.player.anim_count, self.player.anim_delay],
+            'movement': [self.player.del_x, self.player.del_y, self.player.MOVERATE],
+            'rng': probe.getrandbits(32),
+        }
+
+    def snapshot(self) -> 'savegame.Snapshot':
+        """Capture the logical state of the game, for saving."""
+        import savegame
+        return savegame.Snapshot(self.map.filename or '', self.map.seed or 0, self.ticks, self.player.rect.topleft,
+                                 self.player.facing, copy.deepcopy(self.party), self.map.edits)
+
+    def restore(self, snapshot: 'savegame.Snapshot'):
+        """Return the game to a saved state. The map is rebuilt from its file, or its seed, with the snapshot's tile
+        changes applied on top."""
+        if snapshot.map:
+            self.map = self.loader.get(snapshot.map)
+            self.loader.prefetchneighbours(self.map.filename)
+        else:
+            self.map = Map(seed=snapshot.seed)
+        compilecollision(self.map)
+        for (layer, x, y), id in snapshot.edits.items():
+            (self.map.setforetile if layer else self.map.setbacktile)(x, y, id)
+        self.player.rect.topleft = self.player.previous = snapshot.position
+        self.player.collisionrect = Rect(self.player.rect.x + 4, self.player.rect.y + 4, 60, 60)
+        self.player.facing = snapshot.facing
+        self.player.image = self.player.idles[self.player.facing]
+        self.party = copy.deepcopy(snapshot.party)
+        self.ticks = snapshot.ticks
+        self.renderer.setmap(self.map)
+        self.setweather()
+
+    def save(self, path: str = None):
+        """Save the game in the background, to the autosave file unless another path is given. The snapshot is taken
+        now; the file is written on another thread."""
+        import savegame
+        if path is None:
+            path = savegame.AUTOSAVE
+        if self.saver is None:
+            self.saver = savegame.SaveWriter()
+        for error in self.saver.errors:
+            print('Saving failed: %s' % error)
+        self.saver.errors.clear()
+        self.saver.submit(path, self.snapshot())
+
+    def toggleoverlay(self):
+        """Show or hide the profiler readout. Showing it also starts the profiler recording, and hiding it stops it again,
+        unless SOC_PROFILE has it recording for the whole session."""
+        if self.overlay is not None and self.overlay.alive():
+            self.overlay.kill()
+            if not ALWAYS_ON:
+                PROFILER.enable(False)
+            return
+        PROFILER.enable()
+        if self.overlay is None:
+            self.overlay = ProfilerOverlay(PROFILER)
+        UI_CONTROLS.add(self.overlay)
+
+    def handleevent(self, event: pygame.event.Event):
+        # Quit the game if a QUIT event is read.
+        if event.type == QUIT:
+            pygame.quit()
+            sys.exit()
+        # Events fired when a pressed key is released.
+        elif event.type == KEYUP:
+            # If the escape key is pressed and released, quit the game.
+            if event.key == pygame.K_ESCAPE:
                 pygame.quit()
                 sys.exit()
-            # Events fired when a pressed key is released.
-            elif event.type == KEYUP:
-                # If the escape key is pressed and released, quit the game.
-                if event.key == pygame.K_ESCAPE:
-                    pygame.quit()
-                    sys.exit()
-                # If W, UP, S, or DOWN are released, stop the player sprite's vertical movement.
-                if event.key in (pygame.K_w, pygame.K_s, pygame.K_UP, pygame.K_DOWN):
-                    player.del_y = 0
-                # If A, D, LEFT, or RIGHT are released, stop the player sprite's horizontal movement.
-                if event.key in (pygame.K_a, pygame.K_d, pygame.K_LEFT, pygame.K_RIGHT):
-                    player.del_x = 0
-                # If the SPACE key is released, set player's move speed back to normal.
-                if event.key == pygame.K_SPACE:
-                    player.MOVERATE = 2
-                    if player.del_x < 0:
-                        player.del_x = player.MOVERATE * -1
-                    if player.del_x > 0:
-                        player.del_x = player.MOVERATE
-                    if player.del_y < 0:
-                        player.del_y = player.MOVERATE * -1
-                    if player.del_y > 0:
-                        player.del_y = player.MOVERATE
-            # Events fired when a key is pressed.
-            elif event.type == KEYDOWN:
-                # If W or UP are pressed, move the player sprite up and stop horizontal movement.
-                if event.key == pygame.K_w or event.key == pygame.K_UP:
-                    player.del_y = player.MOVERATE * -1
-                    player.del_x = 0
-                # If S or DOWN are pressed, move the player sprite down and stop horizontal movement.
-                if event.key == pygame.K_s or event.key == pygame.K_DOWN:
-                    player.del_y = player.MOVERATE
-                    player.del_x = 0
-                # If A or LEFT are pressed, move the player sprite left and stop vertical movement.
-                if event.key == pygame.K_a or event.key == pygame.K_LEFT:
-                    player.del_y = 0
-                    player.del_x = player.MOVERATE * -1
-                # If S or RIGHT are pressed, move the player sprite right and stop vertical movement.
-                if event.key == pygame.K_d or event.key == pygame.K_RIGHT:
-                    player.del_y = 0
-                    player.del_x = player.MOVERATE
-                # If SPACE is pressed, double the player sprite's move speed.
-                if event.key == pygame.K_SPACE:
-                    player.MOVERATE = 4
-                    if player.del_x < 0:
-                        player.del_x = player.MOVERATE * -1
-                    if player.del_x > 0:
-                        player.del_x = player.MOVERATE
-                    if player.del_y < 0:
-                        player.del_y = player.MOVERATE * -1
-                    if player.del_y > 0:
-                        player.del_y = player.MOVERATE
-
-        # Update phase.
-        testmap.drawbg()  # Update background.
-        testmap.drawfg()  # Update foreground.
-        compilecollision(testmap)  # Refresh collision rectangles.
+            # F3 shows or hides the profiler overlay, and F12 dumps a profile capture to disk while the profiler is
+            # recording: while the overlay is shown, or throughout if SOC_PROFILE is set.
+            if event.key == pygame.K_F3:
+                self.toggleoverlay()
+            if event.key == pygame.K_F12 and PROFILER.enabled:
+                print('Profile capture written to %s' % PROFILER.dump())
+            # If W, UP, S, or DOWN are released, stop the player sprite's vertical movement.
+            if event.key in (pygame.K_w, pygame.K_s, pygame.K_UP, pygame.K_DOWN):
+                self.player.del_y = 0
+            # If A, D, LEFT, or RIGHT are released, stop the player sprite's horizontal movement.
+            if event.key in (pygame.K_a, pygame.K_d, pygame.K_LEFT, pygame.K_RIGHT):
+                self.player.del_x = 0
+            # If the SPACE key is released, set player's move speed back to normal.
+            if event.key == pygame.K_SPACE:
+                self.player.MOVERATE = 2
+                if self.player.del_x < 0:
+                    self.player.del_x = self.player.MOVERATE * -1
+                if self.player.del_x > 0:
+                    self.player.del_x = self.player.MOVERATE
+                if self.player.del_y < 0:
+                    self.player.del_y = self.player.MOVERATE * -1
+                if self.player.del_y > 0:
+                    self.player.del_y = self.player.MOVERATE
+        # Events fired when a key is pressed.
+        elif event.type == KEYDOWN:
+            # If W or UP are pressed, move the player sprite up and stop horizontal movement.
+            if event.key == pygame.K_w or event.key == pygame.K_UP:
+                self.player.del_y = self.player.MOVERATE * -1
+                self.player.del_x = 0
+            # If S or DOWN are pressed, move the player sprite down and stop horizontal movement.
+            if event.key == pygame.K_s or event.key == pygame.K_DOWN:
+                self.player.del_y = self.player.MOVERATE
+                self.player.del_x = 0
+            # If A or LEFT are pressed, move the player sprite left and stop vertical movement.
+            if event.key == pygame.K_a or event.key == pygame.K_LEFT:
+                self.player.del_y = 0
+                self.player.del_x = self.player.MOVERATE * -1
+            # If S or RIGHT are pressed, move the player sprite right and stop vertical movement.
+            if event.key == pygame.K_d or event.key == pygame.K_RIGHT:
+                self.player.del_y = 0
+                self.player.del_x = self.player.MOVERATE
+            # If SPACE is pressed, double the player sprite's move speed.
+            if event.key == pygame.K_SPACE:
+                self.player.MOVERATE = 4
+                if self.player.del_x < 0:
+                    self.player.del_x = self.player.MOVERATE * -1
+                if self.player.del_x > 0:
+                    self.player.del_x = self.player.MOVERATE
+                if self.player.del_y < 0:
+                    self.player.del_y = self.player.MOVERATE * -1
+                if self.player.del_y > 0:
+                    self.player.del_y = self.player.MOVERATE
+
+    def update(self):
+        """Advance the simulation by one tick."""
+        self.ticks += 1
+        self.loader.poll()  # Collect any maps finished in the background.
+        if self.reloader is not None and self.ticks % WATCH_TICKS == 0:
+            self.reloader.poll()  # Apply any files edited since the last check.
         ENTITIES.update()  # Update entities.
+        ENTITY_STORE.update()  # Update non-player entities, all at once.
+        self.updateeffects()
+        UI_CONTROLS.update()  # Update UI controls.
+
+    def setweather(self):
+        """Start or stop the snow to suit the current map. Maps without weather keep it off, so that their frames only
+        repaint what changed. Flakes already falling are left to settle."""
+        self.snowfall.budget = SNOW_BUDGET if self.map.weather == 'snow' else 0
+
+    def updateeffects(self):
+        """Move the weather with the view and the breath with the player, then advance every particle."""
+        self.snowfall.area = self.renderer.camera.rect.inflate(TILESIZE, TILESIZE)
+        mouth = BREATH_MOUTHS[self.player.facing]
+        self.breath.area.center = (self.player.rect.x + mouth[0], self.player.rect.y + mouth[1])
+        if self.ticks % BREATH_TICKS == 0 and self.map.weather == 'snow':  # Breath only shows in the cold.
+            vx, vy = BREATH_VELOCITIES[self.player.facing]
+            self.breath.velocity = (vx - 0.15, vx + 0.15, vy - 0.15, vy + 0.15)
+            self.breath.burst(6)
+        EFFECT_PARTICLES.update()
+        FOREGROUND_PARTICLES.update()
+
+    def draw(self, alpha: float = 1.0) -> List[Rect]:
+        """Repaint the regions of the display that changed: tiles repainted by the map, and sprites that moved or
+        changed image. Sprites are interpolated alpha of the way from their previous tick's position, and the camera
+        follows the player. Returns the rectangles that need to be presented."""
+        if self.overlay is not None and self.overlay.alive():
+            self.overlay.endframe()  # The readout counts rendered frames, not ticks.
+        return self.renderer.render(alpha)
+
+    def present(self, rects: List[Rect]):
+        """Update the changed regions of the display."""
+        self.renderer.present(rects)
+
+
+class HotReloader:
+    """Watch mode: applies edits to map files, tilesets and game data while the game runs, so that changes show up
+    within a fraction of a second without restarting. Every WATCH_TICKS, the files in WATCHED_FILES are checked for
+    changes. Each changed file is read again and compared with what is loaded, and only what differs is rebuilt:
+        map files       the tiles whose IDs changed, and their collision flags, on the current map
+        tilesets        the Tiles cut from tiles whose pixels changed, and the map tiles that use them
+        game data       the JOB_TABLES entries of changed jobs, and the records of changed spells
+    The player, the party and the rest of the game's state are left as they are. A file that fails to load, e.g.
+    because it was caught half saved, is reported and skipped; the next save is picked up as usual."""
+    overworld: Overworld  # The game to apply edits to.
+    watcher: 'hotreload.FileWatcher'  # Notices which watched files have changed.
+
+    def __init__(self, overworld: Overworld):
+        import hotreload
+        # Load the game data now, before the watcher takes its first look, so that a later edit is compared with the
+        # data as it was rather than imported straight from the edited file, unchecked.
+        import playercharacters
+        import spells
+        self.overworld = overworld
+        self.watcher = hotreload.FileWatcher(WATCHED_FILES)
+
+    def poll(self):
+        """Apply every watched file changed since the last poll."""
+        for path in self.watcher.poll():
+            start = time.perf_counter()
+            try:
+                with PROFILER.timeload('Reload', path):
+                    changes = self.reload(path)
+            except Exception as error:
+                print('Reloading %s failed: %s' % (path, error))
+                continue
+            if changes is not None:
+                print('Reloaded %s: %s in %.1f ms' % (path, changes, 1000 * (time.perf_counter() - start)))
+
+    def reload(self, path: str) -> Optional[str]:
+        """Apply a changed file. Returns a description of what changed, or None if the file isn't in use."""
+        directory, filename = os.path.split(path)
+        if directory == os.path.normpath(mapcompiler.MAPS_DIR):
+            return self.reloadmap(filename)
+        for tileset, tilesetfile in TILESET_FILES.items():
+            if path == os.path.normpath(os.path.join('data', tilesetfile)):
+                return self.reloadtileset(tileset)
+        return self.reloaddata(path)
+
+    def reloadmap(self, filename: str) -> Optional[str]:
+        """Apply an edited map file. Maps other than the current one are only dropped from the loader's cache."""
+        loader = self.overworld.loader
+        map = self.overworld.map
+        if filename != map.filename:
+            loader.discard(filename)
+            return None
+
+        data = mapcompiler.loadmap(filename)  # Recompiles the map, since its source has changed.
+        loader.store(filename, data)
+        positions = map.reload(data)
+        loader.prefetchneighbours(filename)  # Its spawn points may link to new maps.
+        self.overworld.setweather()
+        if positions is None:
+            compilecollision(map)
+            self.overworld.renderer.setmap(map)
+            return 'resized to %d by %d tiles' % (map.width, map.height)
+        return '%d tiles changed' % len(positions)
+
+    def reloadtileset(self, tileset: str) -> Optional[str]:
+        """Apply an edited tileset image, rebuilding the Tiles cut from tiles whose pixels changed."""
+        cells = set(TILESETS.reload(tileset))
+        ids = [id for id in TILE_TYPES if id.partition('@')[2] == tileset and (int(id[0:2]), int(id[2:4])) in cells]
+        for id in ids:
+            del TILE_TYPES[id]  # gettile() builds it again from the new atlas.
+        positions = self.overworld.map.retile(ids)
+        return '%d tile types and %d map tiles changed' % (len(ids), len(positions))
+
+    @staticmethod
+    def reloaddata(path: str) -> Optional[str]:
+        """Apply an edited game data module. Only its data dictionary is read again; the module isn't re-imported."""
+        import hotreload
+        if path == 'playercharacters.py':
+            import playercharacters
+            changed = playercharacters.reloadjobs(hotreload.readliteral(path, 'jobs_dict'))
+            return 'jobs changed: %s' % (', '.join(changed) or 'none')
+        if path == 'spells.py':
+            import spells
+            changed = spells.reloadspells(hotreload.readliteral(path, 'spells_dict'))
+            return 'spells changed: %s' % (', '.join(changed) or 'none')
+        return None
+
+
+# Startup. Nothing touches the display or loads an asset until this runs.
+def startup(argv: List[str] = None) -> Tuple[Overworld, argparse.Namespace]:
+    """Read the command line, check the game data, open the game window, and build the overworld, ready for its first
+    frame."""
+    import savegame
+    parser = argparse.ArgumentParser(description='Song of Celestine')
+    parser.add_argument('--seed', type=int, help='seed the game\'s random number generator')
+    parser.add_argument('--record', metavar='PATH', help='record input to a file that replay.py can play back')
+    parser.add_argument('--load', metavar='PATH', help='continue from a save file, such as %s' % savegame.AUTOSAVE)
+    parser.add_argument('--no-autosave', dest='autosave', action='store_false', help='turn off autosaving')
+    parser.add_argument('--watch', action='store_true',
+                        help='apply edits to maps, tilesets, jobs_dict and spells_dict while the game runs')
+    args = parser.parse_args(argv)
+
+    # Check jobs_dict now, so that a malformed job stops the game here rather than mid-play. Its tables are still only
+    # compiled when first used.
+    import playercharacters
+    with PROFILER.timeload('Startup', 'jobs'):
+        playercharacters.checkjobs()
+
+    with PROFILER.timeload('Startup', 'display'):
+        display = opendisplay()
+    with PROFILER.timeload('Startup', 'overworld'):
+        overworld = Overworld(display, START_MAP, args.seed)
+    if args.load:
+        try:
+            snapshot = savegame.load(args.load)
+        except FileNotFoundError:
+            print('No save file at %s.' % args.load)
+        else:
+            if snapshot is None:
+                print('%s holds no saved game.' % args.load)
+            else:
+                overworld.restore(snapshot)
+    if args.watch:
+        overworld.reloader = HotReloader(overworld)
+    return overworld, args
 
-        # Draw phase
-        MAIN_DISPLAY.blit(testmap.background, (0, 0))  # Layer 0 - Background
-        ENTITIES.draw(MAIN_DISPLAY)  # Layer 1 - Entities
-        # TODO: Layer 2 - Entity Effects
-        MAIN_DISPLAY.blit(testmap.foreground, (0, 0))  # Layer 3 - Foreground
-        # TODO: Layer 3 - Foreground Effects
-        # TODO: Layer 4 - Masks
-        # TODO: Layer 5 - UI Frame
-        # TODO: Layer 6 - UI Controls
 
-        # Update the Display
-        pygame.display.update()
+# Main game function.
+def main(argv: List[str] = None):
+    started = time.perf_counter()
+    overworld, args = startup(argv)
+    atexit.register(lambda: overworld.saver is not None and overworld.saver.flush())  # Finish any save in progress.
+    gameclock = pygame.time.Clock()
+    timestep = FixedTimestep()
+    lastframe = time.perf_counter()
+    recorder = None
+    if args.record:
+        # The overworld is built on START_MAP even when a save then moves it elsewhere, so that's the map recorded. A
+        # session continued from a save also records the state it started from, for replay.py to restore.
+        snapshot = overworld.snapshot() if args.load else None
+        import recording
+        recorder = recording.InputRecorder(args.record, START_MAP, overworld.seed, TICKRATE, snapshot)
+        atexit.register(lambda: recorder.close(timestep.ticks, overworld.state()))
 
-        # Tick the clock. Standard speed is 60 FPS.
-        gameclock.tick(60)
+    # Game loop
+    while True:
+        # Event Handling. Events take effect before the next tick, which is what a recording notes them against.
+        PROFILER.begin('events')
+        for event in pygame.event.get():
+            if recorder is not None:
+                recorder.record(timestep.ticks, event)
+            overworld.handleevent(event)
+        PROFILER.end('events')
+
+        # Update phase. Run as many fixed-length ticks as real time calls for; under load, this skips rendered frames
+        # rather than slowing the game down.
+        PROFILER.begin('update')
+        now = time.perf_counter()
+        ticks = timestep.advance(now - lastframe)
+        PARTICLE_QUALITY.frame(now - lastframe)
+        lastframe = now
+        for _ in range(ticks):
+            overworld.update()
+            if args.autosave and overworld.ticks % AUTOSAVE_TICKS == 0:
+                overworld.save()
+        PROFILER.end('update')
+
+        # Draw phase, interpolated between the last two ticks.
+        PROFILER.begin('draw')
+        rects = overworld.draw(timestep.alpha())
+        PROFILER.end('draw')
+
+        # Update the changed regions of the Display
+        PROFILER.begin('present')
+        overworld.present(rects)
+        PROFILER.end('present')
+
+        # Check the cold start, from main() being called to the first frame being shown, against its budget.
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            PROFILER.recordload('Startup', 'first frame', elapsed)
+            if elapsed > STARTUP_BUDGET:
+                print('Startup took %.0f ms, over its %.0f ms budget.' % (1000 * elapsed, 1000 * STARTUP_BUDGET))
+            started = None
+
+        # Tick the clock. The simulation runs at TICKRATE regardless; rendering is capped at MAX_FPS.
+        PROFILER.begin('idle')
+        gameclock.tick(MAX_FPS)
+        PROFILER.end('idle')
+        PROFILER.endframe()
+
+
+
+def __getattr__(name: str) -> Any:
+    # PATHS, the paths and flow fields over the active map's collision index, is created the first time it is used, so
+    # that pathfinding is only imported by games that need it.
+    if name == 'PATHS':
+        import pathfinding
+        globals()['PATHS'] = pathfinding.Pathfinder(COLLISIONS)
+        return globals()['PATHS']
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
 # Run line
-main()
+if __name__ == '__main__':
+    main()
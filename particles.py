@@ -0,0 +1,371 @@
+"""Particle effects: falling snow, breath puffs in the cold, and bursts of light for spells. Particles are purely visual;
+nothing in the simulation reads them, so they draw from their own random number generator and can be thinned out
+freely when frames run long.
+
+A ParticleSystem keeps every particle's state in NumPy arrays, one element per particle, and advances them all at once
+each tick. Emitters added to the system say where particles appear, how they move, how long they last, and the most
+that may be alive at once. Particles are drawn with stamps: small surfaces rendered once, ahead of time, for each
+variant of a particle at each stage of its life, so that fading in and out is a change of stamp rather than a per-pixel
+alpha blit. A ParticleLayer presents a system to the Renderer, and draws the particles in an area with a single call
+to Surface.blits().
+
+A QualityScaler watches frame times. While frames run over budget, it lowers the quality scale, which cuts every
+emitter's spawn rate and budget, and the oldest particles beyond a reduced budget are removed straight away. When
+frames are comfortably within budget again, quality creeps back up."""
+
+import numpy as np
+import pygame
+
+from pygame import Rect
+from typing import *
+
+FRAME_BUDGET = 1 / 60  # The frame time, in seconds, beyond which particle quality is lowered.
+SLOW_FRAMES = 10  # The number of frames in a row over budget before quality is lowered.
+RECOVER_FRAMES = 120  # The number of frames in a row well within budget before quality is raised.
+MIN_QUALITY = 0.25  # The lowest quality scale; even under load, effects are thinned rather than switched off.
+SWAY_RATE = 0.05  # How fast swaying particles swing from side to side, in radians per tick.
+MARGIN = 8  # How far outside an area a particle's center can be and still have part of its stamp drawn in it.
+
+_STAMPS = dict()  # Rendered stamp frames, keyed by (radius, colour, frames).
+
+
+def stampframes(radius: int, colour: Tuple[int, int, int], frames: int = 6) -> List[pygame.Surface]:
+    """Get the stamps for a round particle over its life: it fades in over the first third, holds, then fades out.
+    Stamps are rendered the first time they're asked for and shared from then on."""
+    key = (radius, colour, frames)
+    stamps = _STAMPS.get(key)
+    if stamps is None:
+        stamps = list()
+        for frame in range(frames):
+            opacity = min(1.0, 3 * (frame + 0.5) / frames, 3 * (frames - frame - 0.5) / frames)
+            stamp = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+            pygame.draw.circle(stamp, colour + (int(255 * opacity),), (radius, radius), radius)
+            if radius > 1:  # A brighter core keeps larger particles from looking flat.
+                pygame.draw.circle(stamp, (255, 255, 255, int(255 * opacity)), (radius, radius), radius // 2)
+            if pygame.display.get_surface() is not None:
+                stamp = stamp.convert_alpha()  # Match the display's pixel format, for faster blits.
+            stamps.append(stamp)
+        _STAMPS[key] = stamps
+    return stamps
+
+
+class QualityScaler:
+    """Lowers the particle quality scale while frames run over budget, and raises it again once they recover."""
+    scale: float  # The fraction of each emitter's rate and budget in use, from MIN_QUALITY to 1.
+    budget: float  # The frame time budget in seconds.
+    over: int  # Frames in a row over budget.
+    under: int  # Frames in a row well within budget.
+
+    def __init__(self, budget: float = FRAME_BUDGET):
+        self.scale = 1.0
+        self.budget = budget
+        self.over = 0
+        self.under = 0
+
+    def frame(self, seconds: float):
+        """Note how long a frame took, from the start of one frame to the start of the next."""
+        if seconds > self.budget:
+            self.over += 1
+            self.under = 0
+            if self.over >= SLOW_FRAMES:
+                self.over = 0
+                self.scale = max(MIN_QUALITY, self.scale * 0.75)
+        else:
+            self.over = 0
+            self.under = self.under + 1 if seconds < 0.75 * self.budget else 0
+            if self.under >= RECOVER_FRAMES:
+                self.under = 0
+                self.scale = min(1.0, self.scale + 0.05)
+
+
+class Emitter:
+    """Where and how a kind of particle appears. An emitter's settings can be changed at any time, such as moving its
+    area to follow the camera or a character; the changes apply to particles spawned from then on, except for area and
+    reach, which also decide when existing particles leave."""
+    area: Rect  # Where particles appear, in world pixels.
+    reach: int  # How far beyond the area particles can travel before they're removed.
+    rate: float  # Particles spawned per tick, at full quality.
+    budget: int  # The most particles alive at once, at full quality.
+    life: Tuple[int, int]  # The shortest and longest particle lifetime, in ticks.
+    velocity: Tuple[float, float, float, float]  # The starting velocity range: least x, most x, least y, most y.
+    gravity: float  # Added to a particle's downward velocity each tick.
+    sway: float  # How far particles swing from side to side each tick, in pixels.
+    variants: List[List[pygame.Surface]]  # The stamps for each look a particle can have, over its life.
+    oneshot: bool  # Whether the emitter is removed once its burst has been spawned and has died out.
+    pending: int  # Particles waiting to be spawned by burst().
+    owed: float  # The fraction of a particle carried over to the next tick's spawning.
+
+    def __init__(self, area: Rect, variants: List[List[pygame.Surface]], rate: float = 0.0, budget: int = 100,
+                 life: Tuple[int, int] = (60, 120), velocity: Tuple[float, float, float, float] = (0, 0, 0, 0),
+                 gravity: float = 0.0, sway: float = 0.0, reach: int = 0, oneshot: bool = False):
+        self.area = Rect(area)
+        self.variants = variants
+        self.rate = rate
+        self.budget = budget
+        self.life = life
+        self.velocity = velocity
+        self.gravity = gravity
+        self.sway = sway
+        self.reach = reach
+        self.oneshot = oneshot
+        self.pending = 0
+        self.owed = 0.0
+
+    def burst(self, count: int):
+        """Spawn a number of particles at once, on the next tick, as far as the budget allows."""
+        self.pending += count
+
+    def bounds(self) -> Rect:
+        """Get the area particles are kept within."""
+        return self.area.inflate(2 * self.reach, 2 * self.reach)
+
+
+def snowfall(area: Rect, budget: int) -> Emitter:
+    """Make an emitter for snow falling across an area, usually the camera's view. The spawn rate keeps about budget
+    flakes in the air."""
+    variants = [stampframes(1, (236, 242, 255)), stampframes(2, (228, 236, 252)), stampframes(3, (220, 230, 250))]
+    life = (150, 270)
+    return Emitter(area, variants, rate=budget / sum(life) * 2, budget=budget, life=life,
+                   velocity=(-0.3, 0.1, 0.6, 1.4), sway=0.4, reach=64)
+
+
+def breath(area: Rect) -> Emitter:
+    """Make an emitter for puffs of breath in the cold. Call burst() on it for each breath, and point its velocity
+    in the direction the character faces."""
+    return Emitter(area, [stampframes(2, (210, 218, 230)), stampframes(3, (200, 210, 224))], budget=48,
+                   life=(24, 40), gravity=-0.01, reach=32)
+
+
+def sparkle(position: Tuple[int, int], colour: Tuple[int, int, int], count: int = 40) -> Emitter:
+    """Make a one-shot burst of light, such as a spell landing, centered on a position in world pixels."""
+    emitter = Emitter(Rect(position[0] - 4, position[1] - 4, 8, 8), [stampframes(1, colour), stampframes(2, colour)],
+                      budget=count, life=(20, 45), velocity=(-2.0, 2.0, -2.5, 1.5), gravity=0.08, reach=96,
+                      oneshot=True)
+    emitter.burst(count)
+    return emitter
+
+
+class ParticleSystem:
+    """The state of every particle from a set of emitters, stored as arrays indexed by slot. Dead slots are reused by
+    later spawns. Quality is shared with a QualityScaler, so that every system thins out together."""
+    quality: QualityScaler  # Scales emitter rates and budgets.
+    rng: np.random.RandomState  # The source of randomness for spawning.
+    emitters: List[Optional[Emitter]]  # The emitters, indexed by the ID stored in each particle; None once removed.
+    stamps: List[pygame.Surface]  # Every stamp used by the emitters, indexed by the stamp IDs stored in particles.
+    stampsurfaces: np.ndarray  # The stamps as an object array, so a frame's worth can be looked up at once.
+    stampoffsets: np.ndarray  # The distance from each stamp's corner to its center.
+    firststamps: Dict[Emitter, List[int]]  # The stamp ID of the first frame of each of an emitter's variants.
+    alive: np.ndarray  # Whether each slot holds a particle.
+    emitter: np.ndarray  # The ID of the emitter each particle came from.
+    x: np.ndarray  # Horizontal position of each particle's center in world pixels.
+    y: np.ndarray  # Vertical position of each particle's center in world pixels.
+    prevx: np.ndarray  # Horizontal position at the previous tick, for interpolation.
+    prevy: np.ndarray  # Vertical position at the previous tick.
+    vx: np.ndarray  # Horizontal velocity in pixels per tick.
+    vy: np.ndarray  # Vertical velocity in pixels per tick.
+    phase: np.ndarray  # Where each particle starts in its side-to-side sway, in radians.
+    age: np.ndarray  # Ticks each particle has been alive.
+    life: np.ndarray  # Ticks each particle lives for.
+    stamp: np.ndarray  # The stamp ID of the first frame of each particle's variant.
+    frames: np.ndarray  # The number of stamp frames in each particle's variant.
+
+    def __init__(self, quality: QualityScaler, seed: int = 0, capacity: int = 256):
+        self.quality = quality
+        self.rng = np.random.RandomState(seed)
+        self.emitters = list()
+        self.stamps = list()
+        self.stampsurfaces = np.empty(0, object)
+        self.stampoffsets = np.empty(0, np.int32)
+        self.firststamps = dict()
+        self.alive = np.zeros(0, bool)
+        self.emitter = np.zeros(0, np.int16)
+        self.x = np.zeros(0, np.float32)
+        self.y = np.zeros(0, np.float32)
+        self.prevx = np.zeros(0, np.float32)
+        self.prevy = np.zeros(0, np.float32)
+        self.vx = np.zeros(0, np.float32)
+        self.vy = np.zeros(0, np.float32)
+        self.phase = np.zeros(0, np.float32)
+        self.age = np.zeros(0, np.int32)
+        self.life = np.ones(0, np.int32)
+        self.stamp = np.zeros(0, np.int32)
+        self.frames = np.ones(0, np.int32)
+        self.grow(capacity)
+
+    def grow(self, capacity: int):
+        """Make room for at least capacity particles. Existing particles keep their slots."""
+        extra = capacity - len(self.alive)
+        if extra <= 0:
+            return
+        for name in ('alive', 'emitter', 'x', 'y', 'prevx', 'prevy', 'vx', 'vy', 'phase', 'age', 'stamp'):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros(extra, array.dtype)]))
+        for name in ('life', 'frames'):  # Kept at least 1, since ages are divided by them.
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.ones(extra, array.dtype)]))
+
+    def reseed(self, seed: int):
+        """Restart the random number generator, so that a seeded session's effects play out the same way."""
+        self.rng = np.random.RandomState(seed % 2 ** 32)
+
+    def add(self, emitter: Emitter) -> Emitter:
+        """Start spawning particles from an emitter. Returns the emitter."""
+        firsts = list()
+        for frames in emitter.variants:
+            firsts.append(len(self.stamps))
+            self.stamps.extend(frames)
+        self.firststamps[emitter] = firsts
+        self.stampsurfaces = np.empty(len(self.stamps), object)
+        self.stampsurfaces[:] = self.stamps
+        self.stampoffsets = np.array([stamp.get_width() // 2 for stamp in self.stamps], np.int32)
+        if None in self.emitters:
+            self.emitters[self.emitters.index(None)] = emitter
+        else:
+            self.emitters.append(emitter)
+        return emitter
+
+    def remove(self, emitter: Emitter):
+        """Stop an emitter and remove its particles. Its stamps stay in the stamp table, since IDs can't shift."""
+        if emitter not in self.firststamps:
+            return
+        index = self.emitters.index(emitter)
+        self.alive[self.emitter == index] = False
+        self.emitters[index] = None
+        del self.firststamps[emitter]
+
+    def spawn(self, index: int, count: int):
+        """Spawn particles from the emitter with an ID, at random within its area."""
+        emitter = self.emitters[index]
+        free = np.flatnonzero(~self.alive)
+        if len(free) < count:
+            self.grow(max(2 * len(self.alive), len(self.alive) + count - len(free)))
+            free = np.flatnonzero(~self.alive)
+        slots = free[:count]
+        rng = self.rng
+        area = emitter.area
+        self.alive[slots] = True
+        self.emitter[slots] = index
+        self.x[slots] = self.prevx[slots] = rng.uniform(area.left, area.right, count)
+        self.y[slots] = self.prevy[slots] = rng.uniform(area.top, area.bottom, count)
+        self.vx[slots] = rng.uniform(emitter.velocity[0], emitter.velocity[1], count)
+        self.vy[slots] = rng.uniform(emitter.velocity[2], emitter.velocity[3], count)
+        self.phase[slots] = rng.uniform(0, 2 * np.pi, count)
+        self.age[slots] = 0
+        self.life[slots] = rng.randint(emitter.life[0], emitter.life[1] + 1, count)
+        variants = rng.randint(0, len(emitter.variants), count)
+        self.stamp[slots] = np.array(self.firststamps[emitter], np.int32)[variants]
+        self.frames[slots] = np.array([len(frames) for frames in emitter.variants], np.int32)[variants]
+
+    def update(self):
+        """Advance every particle by one tick, remove those that have died or left their emitter's bounds, and spawn
+        new ones within each emitter's budget."""
+        alive = self.alive
+        self.prevx[:] = self.x
+        self.prevy[:] = self.y
+        self.age += alive
+        if not self.emitters:
+            return
+
+        # Look up each particle's emitter settings as arrays, so every particle moves in the same few operations.
+        emitters = [emitter if emitter is not None else Emitter(Rect(0, 0, 0, 0), []) for emitter in self.emitters]
+        gravity = np.array([emitter.gravity for emitter in emitters], np.float32)[self.emitter]
+        sway = np.array([emitter.sway for emitter in emitters], np.float32)[self.emitter]
+        self.vy += gravity
+        self.x += self.vx + sway * np.sin(self.phase + SWAY_RATE * self.age)
+        self.y += self.vy
+
+        bounds = np.array([tuple(emitter.bounds()) for emitter in emitters], np.float32)[self.emitter]
+        alive &= (self.age < self.life) & (self.x >= bounds[:, 0]) & (self.y >= bounds[:, 1])
+        alive &= (self.x < bounds[:, 0] + bounds[:, 2]) & (self.y < bounds[:, 1] + bounds[:, 3])
+
+        counts = np.bincount(self.emitter[alive], minlength=len(emitters))
+        scale = self.quality.scale
+        for index, emitter in enumerate(self.emitters):
+            if emitter is None:
+                continue
+            budget = int(emitter.budget * scale)
+            if counts[index] > budget:
+                # Quality has dropped: remove the particles nearest the end of their lives.
+                slots = np.flatnonzero(alive & (self.emitter == index))
+                oldest = np.argsort(self.life[slots] - self.age[slots], kind='stable')
+                alive[slots[oldest[:counts[index] - budget]]] = False
+                counts[index] = budget
+            emitter.owed += emitter.rate * scale
+            count = int(emitter.owed) + emitter.pending
+            emitter.owed -= int(emitter.owed)
+            emitter.pending = 0
+            count = min(count, budget - counts[index])
+            if count > 0:
+                self.spawn(index, count)
+            elif emitter.oneshot and counts[index] == 0:
+                self.remove(emitter)
+
+    def count(self) -> int:
+        """Get the number of live particles."""
+        return int(np.count_nonzero(self.alive))
+
+    def clear(self):
+        """Remove every emitter and particle."""
+        self.alive[:] = False
+        self.emitter[:] = 0
+        self.emitters = list()
+        self.stamps = list()
+        self.stampsurfaces = np.empty(0, object)
+        self.stampoffsets = np.empty(0, np.int32)
+        self.firststamps = dict()
+
+
+class ParticleLayer:
+    """Presents a ParticleSystem to the Renderer as a sprite layer. Rather than a sprite per particle, the layer places
+    one entry per emitter covering all its particles on screen, so that the Renderer repaints that area, and then draws
+    the particles inside each repainted area with one batched blit. The entry's image is a new token every frame,
+    since live particles move every frame."""
+    system: ParticleSystem  # The particles to draw.
+    camera: Any  # The camera whose view is drawn. Anything with a rect in world pixels will do.
+    surfaces: np.ndarray  # The stamp to draw for each visible particle this frame, as an object array.
+    left: np.ndarray  # The screen position of the left edge of each visible particle's stamp.
+    top: np.ndarray  # The screen position of the top edge of each visible particle's stamp.
+
+    def __init__(self, system: ParticleSystem, camera: Any):
+        self.system = system
+        self.camera = camera
+        self.surfaces = np.empty(0, object)
+        self.left = np.zeros(0, np.int32)
+        self.top = np.zeros(0, np.int32)
+
+    def place(self, alpha: float) -> List[Tuple[Emitter, Rect, object]]:
+        """Work out where every particle in view is drawn this frame, alpha of the way from its previous position, and
+        get the screen area covered by each emitter's particles."""
+        system = self.system
+        view = self.camera.rect
+        x = system.prevx + (system.x - system.prevx) * alpha - view.x
+        y = system.prevy + (system.y - system.prevy) * alpha - view.y
+        visible = system.alive & (x > -MARGIN) & (y > -MARGIN) & (x < view.width + MARGIN) & (y < view.height + MARGIN)
+        slots = np.flatnonzero(visible)
+        stamps = system.stamp[slots] + np.minimum(system.frames[slots] - 1,
+                                                  system.age[slots] * system.frames[slots] // system.life[slots])
+        offsets = system.stampoffsets[stamps]
+        self.left = x[slots].astype(np.int32) - offsets
+        self.top = y[slots].astype(np.int32) - offsets
+        self.surfaces = system.stampsurfaces[stamps]
+
+        placements = list()
+        emitters = system.emitter[slots]
+        for index in np.unique(emitters).tolist():
+            mine = emitters == index
+            left = self.left[mine]
+            top = self.top[mine]
+            size = 2 * int(offsets[mine].max()) + 1
+            rect = Rect(int(left.min()), int(top.min()), int(left.max() - left.min()) + size,
+                        int(top.max() - top.min()) + size)
+            placements.append((system.emitters[index], rect, object()))
+        return placements
+
+    def blitsin(self, area: Rect) -> List[Tuple[pygame.Surface, Tuple[int, int]]]:
+        """Get the blits that draw the particles overlapping an area of the screen, placed by the last place()."""
+        overlapping = ((self.left < area.right) & (self.top < area.bottom) &
+                       (self.left > area.left - 2 * MARGIN) & (self.top > area.top - 2 * MARGIN))
+        if overlapping.all():
+            return list(zip(self.surfaces.tolist(), zip(self.left.tolist(), self.top.tolist())))
+        return list(zip(self.surfaces[overlapping].tolist(),
+                        zip(self.left[overlapping].tolist(), self.top[overlapping].tolist())))
@@ -0,0 +1,180 @@
+"""Pathfinding over a map's passability grid: the CollisionGrid built by compilecollision(), one flag per tile. Agents
+move between edge-adjacent tiles, and every step costs the same.
+
+Two kinds of query are offered. findpath() runs A* for a single journey. flowfield() returns a FlowField for a goal: the
+distance to the goal from every tile, and the next tile to step to, found with one breadth-first search. Any number of
+agents heading for the same goal, such as the player or a shop's spawn point, then look up their next step instead of
+searching. Flow fields are cached per goal, and when a tile changes only the cached fields it could affect are dropped;
+they are rebuilt the next time they are asked for."""
+
+import heapq
+import numpy as np
+
+from array import array
+from collections import OrderedDict, deque
+from typing import *
+
+UNREACHABLE = -1  # The distance of a tile from which the goal can't be reached.
+NEIGHBOURS = ((0, -1), (0, 1), (-1, 0), (1, 0))  # The steps an agent can take: north, south, west, east.
+
+
+class FlowField:
+    """The distance to a goal tile from every tile in a grid, and the direction to step to get closer. Both are stored
+    row-major, and are also available as NumPy arrays for looking up many agents at once."""
+    goal: Tuple[int, int]  # The goal tile.
+    width: int  # The width of the grid in tiles.
+    height: int  # The height of the grid in tiles.
+    distances: array  # The number of steps from each tile to the goal, or UNREACHABLE.
+    stepx: np.ndarray  # The x direction (-1, 0 or 1) of the next step from each tile; 0 where there is none.
+    stepy: np.ndarray  # The y direction (-1, 0 or 1) of the next step from each tile.
+
+    def __init__(self, goal: Tuple[int, int], width: int, height: int, blocked: bytearray):
+        self.goal = goal
+        self.width = width
+        self.height = height
+        self.distances = array('i', [UNREACHABLE]) * (width * height)
+        self.stepx = np.zeros(width * height, np.int8)
+        self.stepy = np.zeros(width * height, np.int8)
+
+        gx, gy = goal
+        if not (0 <= gx < width and 0 <= gy < height) or blocked[gy * width + gx]:
+            return
+
+        # Search outward from the goal. Each tile reached steps back towards the tile it was reached from.
+        distances = self.distances
+        stepx = array('b', bytes(width * height))
+        stepy = array('b', bytes(width * height))
+        distances[gy * width + gx] = 0
+        frontier = deque([(gx, gy)])
+        while frontier:
+            x, y = frontier.popleft()
+            distance = distances[y * width + x] + 1
+            for dx, dy in NEIGHBOURS:
+                nx = x + dx
+                ny = y + dy
+                if 0 <= nx < width and 0 <= ny < height:
+                    index = ny * width + nx
+                    if distances[index] == UNREACHABLE and not blocked[index]:
+                        distances[index] = distance
+                        stepx[index] = -dx
+                        stepy[index] = -dy
+                        frontier.append((nx, ny))
+        self.stepx = np.frombuffer(stepx, np.int8)
+        self.stepy = np.frombuffer(stepy, np.int8)
+
+    def distance(self, x: int, y: int) -> int:
+        """Get the number of steps from a tile to the goal, or UNREACHABLE."""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.distances[y * self.width + x]
+        return UNREACHABLE
+
+    def step(self, x: int, y: int) -> Optional[Tuple[int, int]]:
+        """Get the next tile to step to from a tile, or None at the goal or where the goal can't be reached."""
+        if self.distance(x, y) <= 0:
+            return None
+        index = y * self.width + x
+        return x + int(self.stepx[index]), y + int(self.stepy[index])
+
+    def steps(self, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the direction of the next step for many tiles at once, as arrays of x and y directions. Tiles outside
+        the grid get no direction."""
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        indexes = np.where(inside, ys * self.width + xs, 0)
+        return np.where(inside, self.stepx[indexes], 0), np.where(inside, self.stepy[indexes], 0)
+
+    def affectedby(self, x: int, y: int) -> bool:
+        """Check whether a change to a tile's passability could change this field. A tile becoming impassable matters
+        if the field reaches it; a tile becoming passable matters if the field reaches a tile next to it."""
+        if (x, y) == self.goal or self.distance(x, y) != UNREACHABLE:
+            return True
+        return any(self.distance(x + dx, y + dy) != UNREACHABLE for dx, dy in NEIGHBOURS)
+
+
+class Pathfinder:
+    """Answers path queries against a CollisionGrid, keeping the flow fields for recently used goals. The grid tells the
+    pathfinder when tiles change, through its watchers list."""
+    grid: Any  # The CollisionGrid searched. Anything with a width, height, and row-major blocked bytearray will do.
+    capacity: int  # The most flow fields to keep.
+    fields: OrderedDict  # Cached FlowFields keyed by goal tile, least recently used first.
+    builds: int  # The number of flow fields built, for profiling.
+
+    def __init__(self, grid: Any, capacity: int = 16):
+        self.grid = grid
+        self.capacity = capacity
+        self.fields = OrderedDict()
+        self.builds = 0
+        watchers = getattr(grid, 'watchers', None)
+        if watchers is not None:
+            watchers.append(self.tilechanged)
+
+    def passable(self, x: int, y: int) -> bool:
+        return 0 <= x < self.grid.width and 0 <= y < self.grid.height and not self.grid.blocked[y * self.grid.width + x]
+
+    def flowfield(self, goal: Tuple[int, int]) -> FlowField:
+        """Get the flow field for a goal tile, building it if it isn't cached."""
+        field = self.fields.get(goal)
+        if field is not None:
+            self.fields.move_to_end(goal)
+            return field
+
+        field = FlowField(goal, self.grid.width, self.grid.height, self.grid.blocked)
+        self.builds += 1
+        self.fields[goal] = field
+        while len(self.fields) > self.capacity:
+            self.fields.popitem(last=False)
+        return field
+
+    def findpath(self, start: Tuple[int, int], goal: Tuple[int, int]) -> Optional[List[Tuple[int, int]]]:
+        """Find a shortest path between two tiles with A*. Returns the tiles along it, from start to goal inclusive, or
+        None if there's no way through. If a flow field for the goal is cached, the path is read from it instead."""
+        if not self.passable(*start) or not self.passable(*goal):
+            return None
+        field = self.fields.get(goal)
+        if field is not None:
+            if field.distance(*start) == UNREACHABLE:
+                return None
+            path = [start]
+            while path[-1] != goal:
+                path.append(field.step(*path[-1]))
+            return path
+
+        width = self.grid.width
+        gx, gy = goal
+        came = {start: None}
+        costs = {start: 0}
+        # Ties on estimated length are broken by the larger cost so far, which keeps the search heading for the goal.
+        frontier = [(abs(start[0] - gx) + abs(start[1] - gy), 0, start)]
+        while frontier:
+            _, negcost, tile = heapq.heappop(frontier)
+            if tile == goal:
+                path = list()
+                while tile is not None:
+                    path.append(tile)
+                    tile = came[tile]
+                path.reverse()
+                return path
+            cost = -negcost
+            if cost > costs[tile]:
+                continue  # A shorter way here was found after this entry was queued.
+            x, y = tile
+            for dx, dy in NEIGHBOURS:
+                neighbour = (x + dx, y + dy)
+                if not self.passable(*neighbour):
+                    continue
+                if cost + 1 < costs.get(neighbour, width * self.grid.height):
+                    costs[neighbour] = cost + 1
+                    came[neighbour] = tile
+                    estimate = cost + 1 + abs(neighbour[0] - gx) + abs(neighbour[1] - gy)
+                    heapq.heappush(frontier, (estimate, -(cost + 1), neighbour))
+        return None
+
+    def tilechanged(self, x: Optional[int] = None, y: Optional[int] = None):
+        """Drop the cached flow fields that a change to a tile's passability could affect. With no tile given, the
+        whole grid was rebuilt, and every field is dropped."""
+        if x is None or y is None:
+            self.fields.clear()
+            return
+        for goal in [goal for goal, field in self.fields.items() if field.affectedby(x, y)]:
+            del self.fields[goal]
@@ -1,8 +1,12 @@
-import os
-import pygame
-import mirrorgame
+from typing import *
 
-from pygame import *
+MAX_LEVEL = 99  # The highest level a character can reach.
+
+# The stats that grow with level, with the name of each one's growth coefficient in jobs_dict and the multiplier that
+# turns the coefficient into the stat's value at level 1.
+STATS = ('hp', 'mp', 'str', 'agi', 'con', 'int', 'will', 'luck')
+GROWTH_KEYS = tuple(stat + '_growth' for stat in STATS)
+GROWTH_MULTIPLIERS = (20, 20, 10, 10, 10, 10, 10, 10)
 
 
 """The following Dictionary contains data used to build characters based on their classes. The following
@@ -72,4 +76,130 @@ jobs_dict = {
             1: ['lessermend', 'freeze', 'crystalshard']
         }
     },
-}
\ No newline at end of file
+}
+
+
+class JobTable:
+    """A job from jobs_dict compiled into lookup tables, so that a character's stats and unlocks at any level are a
+    single index rather than a recalculation. Each stat at level L is its growth coefficient times its multiplier times
+    L, rounded to the nearest whole number. Tables are indexed by level, from 0 to MAX_LEVEL; level 0 is all zeroes."""
+    name: str  # The name of the job.
+    stats: 'numpy.ndarray'  # Stat values, indexed by level then by position in STATS. Read-only.
+    passives: List[Tuple[str, ...]]  # Every passive known at each level, in the order they are learned.
+    abilities: List[Tuple[str, ...]]  # Every ability known at each level, in the order they are learned.
+
+    def __init__(self, name: str, job: Dict[str, Any]):
+        import numpy as np
+        self.name = name
+        levels = np.arange(MAX_LEVEL + 1, dtype=np.float64)[:, np.newaxis]
+        coefficients = np.array([job[key] * multiplier for key, multiplier in zip(GROWTH_KEYS, GROWTH_MULTIPLIERS)])
+        self.stats = np.rint(levels * coefficients).astype(np.int32)
+        self.stats.setflags(write=False)
+        self.passives = self.cumulative(job['passive_learnset'])
+        self.abilities = self.cumulative(job['ability_learnset'])
+
+    @staticmethod
+    def cumulative(learnset: Dict[int, str]) -> List[Tuple[str, ...]]:
+        """Turn a learnset into the tuple of everything known at each level."""
+        known = list()
+        current = ()
+        for level in range(MAX_LEVEL + 1):
+            if level in learnset:
+                current += (learnset[level],)
+            known.append(current)
+        return known
+
+    def stat(self, stat: str, level: int) -> int:
+        """Get one stat at a level, e.g. table.stat('hp', 5)."""
+        return int(self.stats[level, STATS.index(stat)])
+
+    def statsat(self, level: int) -> Dict[str, int]:
+        """Get every stat at a level, keyed by the names in STATS."""
+        return dict(zip(STATS, self.stats[level].tolist()))
+
+    def learned(self, level: int) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """Get the passives and abilities learned on reaching a level, as opposed to before it."""
+        previous = max(level - 1, 0)
+        return (self.passives[level][len(self.passives[previous]):],
+                self.abilities[level][len(self.abilities[previous]):])
+
+
+def validatejob(name: str, job: Dict[str, Any]) -> List[str]:
+    """Check a jobs_dict entry for missing or malformed fields. Returns a description of each problem found."""
+    problems = list()
+
+    def check(key: str, valid: Callable[[Any], bool], expected: str):
+        if key not in job:
+            problems.append('%s: missing %s' % (name, key))
+        elif not valid(job[key]):
+            problems.append('%s: %s should be %s, not %r' % (name, key, expected, job[key]))
+
+    def islearnset(value: Any, entry: Callable[[Any], bool]) -> bool:
+        return isinstance(value, dict) and all(isinstance(level, int) and 1 <= level <= MAX_LEVEL and entry(learned)
+                                               for level, learned in value.items())
+
+    def isnames(value: Any) -> bool:
+        return isinstance(value, (list, tuple)) and all(isinstance(item, str) for item in value)
+
+    for key in GROWTH_KEYS:
+        check(key, lambda value: isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0,
+              'a positive number')
+    check('equipset', isnames, 'a sequence of equipment types')
+    check('passive_learnset', lambda value: islearnset(value, lambda learned: isinstance(learned, str)),
+          'a dict of levels from 1 to %d to passive names' % MAX_LEVEL)
+    check('ability_learnset', lambda value: islearnset(value, lambda learned: isinstance(learned, str)),
+          'a dict of levels from 1 to %d to ability names' % MAX_LEVEL)
+    check('heroics', isnames, 'a sequence of heroic ability names')
+    check('start_gear', lambda value: isinstance(value, (list, tuple)) and len(value) == 5
+          and all(item is None or isinstance(item, str) for item in value),
+          'five item names or None, for main-hand, off-hand, armor, accessory1, and accessory2')
+    check('start_spells', lambda value: islearnset(value, isnames),
+          'a dict of levels from 1 to %d to lists of spell names' % MAX_LEVEL)
+    return problems
+
+
+def checkjobs(jobs: Dict[str, Dict[str, Any]] = None):
+    """Validate every job in jobs_dict without compiling it. Raises ValueError listing every problem if any job is
+    malformed. This is cheap, so the game runs it at startup while leaving JOB_TABLES to be built on first use."""
+    if jobs is None:
+        jobs = jobs_dict
+    problems = [problem for name, job in jobs.items() for problem in validatejob(name, job)]
+    if problems:
+        raise ValueError('Malformed jobs_dict entries:\n    ' + '\n    '.join(problems))
+
+
+def buildjobtables(jobs: Dict[str, Dict[str, Any]] = None) -> Dict[str, JobTable]:
+    """Validate and compile every job in jobs_dict. Raises ValueError listing every problem if any job is malformed."""
+    if jobs is None:
+        jobs = jobs_dict
+    checkjobs(jobs)
+    return {name: JobTable(name, job) for name, job in jobs.items()}
+
+
+def __getattr__(name: str) -> Any:
+    # JOB_TABLES, the compiled table for every job keyed by job name, is built the first time it is used, so that
+    # importing this module stays cheap for tools that only need jobs_dict.
+    if name == 'JOB_TABLES':
+        globals()['JOB_TABLES'] = buildjobtables()
+        return globals()['JOB_TABLES']
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def reloadjobs(jobs: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Replace the contents of jobs_dict, e.g. with jobs read from an edited copy of this file, and rebuild the
+    JOB_TABLES entries of only the jobs that were added, changed or removed. jobs_dict is updated in place, so modules
+    holding it see the change. Raises ValueError, changing nothing, if any job is malformed. Returns the names of the
+    jobs that changed."""
+    from hotreload import changedkeys
+    checkjobs(jobs)
+    changed = changedkeys(jobs_dict, jobs)
+    jobs_dict.clear()
+    jobs_dict.update(jobs)
+    tables = globals().get('JOB_TABLES')  # Tables that haven't been built yet will be built from the new jobs.
+    if tables is not None:
+        for name in changed:
+            if name in jobs:
+                tables[name] = JobTable(name, jobs[name])
+            else:
+                del tables[name]
+    return changed
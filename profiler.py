@@ -0,0 +1,214 @@
+"""Low-overhead instrumentation for the game loop. The main loop brackets each of its phases with PROFILER.begin() and
+PROFILER.end(), asset loads are wrapped in PROFILER.timeload(), and hot paths report surfaces allocated and blits
+issued with PROFILER.count(). While the profiler is disabled, each of these returns immediately.
+
+When enabled, the profiler keeps a rolling history of frame times, per-phase times, and per-frame counters, which can
+be shown on screen with a ProfilerOverlay or dumped to a JSON capture file with dump()."""
+
+import json
+import os
+import pygame
+import time
+
+from collections import deque
+from typing import *
+
+HISTORY = 300  # The number of frames kept in the rolling history.
+BUDGET = 1 / 60  # The frame time budget in seconds, used to scale the overlay's graph.
+
+
+class NullTimer:
+    """A do-nothing context manager, returned by timeload() while the profiler is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class LoadTimer:
+    """Times a single asset load and records it with the profiler."""
+
+    def __init__(self, profiler: 'Profiler', kind: str, name: str):
+        self.profiler = profiler
+        self.kind = kind
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.recordload(self.kind, self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    """Collects frame timings, phase timings, and counters for the game loop."""
+    enabled: bool  # Whether anything is being recorded.
+    starts: Dict[str, float]  # The start time of each phase that is currently running.
+    phases: Dict[str, float]  # Time spent in each phase during the current frame.
+    counters: Dict[str, int]  # Counters for the current frame, e.g. 'blits' and 'surfaces'.
+    frames: deque  # Wall-clock time of each recent frame, in seconds.
+    phasehistory: Dict[str, deque]  # Time spent in each phase during each recent frame, in seconds.
+    counterhistory: Dict[str, deque]  # The value of each counter during each recent frame.
+    loads: deque  # (kind, name, seconds) for each recent asset load.
+    lastframe: float  # When the previous frame ended.
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """Forget everything that has been recorded."""
+        self.starts = dict()
+        self.phases = dict()
+        self.counters = dict()
+        self.frames = deque(maxlen=HISTORY)
+        self.phasehistory = dict()
+        self.counterhistory = dict()
+        self.loads = deque(maxlen=HISTORY)
+        self.lastframe = time.perf_counter()
+
+    def enable(self, enabled: bool = True):
+        """Start or stop recording. Starting clears the history."""
+        if enabled and not self.enabled:
+            self.reset()
+        self.enabled = enabled
+
+    def begin(self, phase: str):
+        """Mark the start of a phase of the current frame."""
+        if self.enabled:
+            self.starts[phase] = time.perf_counter()
+
+    def end(self, phase: str):
+        """Mark the end of a phase of the current frame. A phase can run several times in one frame."""
+        if self.enabled:
+            start = self.starts.pop(phase, None)
+            if start is not None:  # The profiler may have been enabled part way through the phase.
+                self.phases[phase] = self.phases.get(phase, 0.0) + time.perf_counter() - start
+
+    def count(self, counter: str, amount: int = 1):
+        """Add to one of the current frame's counters."""
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def timeload(self, kind: str, name: str):
+        """Get a context manager that times an asset load, e.g. 'with PROFILER.timeload('Map', filename):'."""
+        if self.enabled:
+            return LoadTimer(self, kind, name)
+        return NULL_TIMER
+
+    def recordload(self, kind: str, name: str, seconds: float):
+        """Record an asset load, or another one-off task, timed elsewhere."""
+        if self.enabled:
+            self.loads.append((kind, name, seconds))
+
+    def endframe(self):
+        """Finish the current frame, moving its timings and counters into the history."""
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        self.frames.append(now - self.lastframe)
+        self.lastframe = now
+        for history, values in ((self.phasehistory, self.phases), (self.counterhistory, self.counters)):
+            for key in values.keys() - history.keys():
+                # Pad new keys so every history lines up with the frame history.
+                history[key] = deque([0] * (len(self.frames) - 1), maxlen=HISTORY)
+            for key, samples in history.items():
+                samples.append(values.get(key, 0))
+        self.phases = dict()
+        self.counters = dict()
+
+    def summary(self) -> Dict[str, Any]:
+        """Summarize the rolling history: average and worst frame times, average phase times, average counters."""
+        frames = list(self.frames)
+        if not frames:
+            return {'frames': 0}
+        return {
+            'frames': len(frames),
+            'fps': len(frames) / sum(frames) if sum(frames) else 0.0,
+            'frame_ms': 1000 * sum(frames) / len(frames),
+            'worst_ms': 1000 * max(frames),
+            'phases_ms': {key: 1000 * sum(samples) / len(samples) for key, samples in self.phasehistory.items()},
+            'counters': {key: sum(samples) / len(samples) for key, samples in self.counterhistory.items()},
+        }
+
+    def dump(self, path: str = None) -> str:
+        """Write the rolling history to a JSON capture file. Returns the path written."""
+        if path is None:
+            path = time.strftime('profile_%Y%m%d_%H%M%S.json')
+        capture = {
+            'summary': self.summary(),
+            'frames': list(self.frames),
+            'phases': {key: list(samples) for key, samples in self.phasehistory.items()},
+            'counters': {key: list(samples) for key, samples in self.counterhistory.items()},
+            'loads': [{'kind': kind, 'name': name, 'seconds': seconds} for kind, name, seconds in self.loads],
+        }
+        with open(path, 'w') as out:
+            json.dump(capture, out, indent=1)
+        return path
+
+
+ALWAYS_ON = os.environ.get('SOC_PROFILE', '') not in ('', '0')  # Whether SOC_PROFILE turned profiling on for the session.
+PROFILER = Profiler(ALWAYS_ON)  # The profiler shared by the whole game.
+
+
+class ProfilerOverlay(pygame.sprite.Sprite):
+    """An on-screen readout of the profiler's rolling history: frame rate, frame and phase times, counters, and a graph
+    of recent frame times against the 60 FPS budget. Add it to a sprite group drawn in screen space to show it, and
+    call endframe() once for each frame rendered."""
+    profiler: Profiler  # The profiler to report on.
+    font: pygame.font.Font  # The font used for the readout.
+    interval: int  # How many rendered frames to wait between refreshes of the readout.
+    wait: int  # Rendered frames left until the next refresh.
+
+    def __init__(self, profiler: Profiler = PROFILER, interval: int = 15):
+        pygame.sprite.Sprite.__init__(self)
+        if not pygame.font.get_init():
+            pygame.font.init()
+        self.profiler = profiler
+        self.font = pygame.font.Font(None, 18)
+        self.interval = interval
+        self.wait = 0
+        self.image = pygame.Surface((260, 200))
+        self.rect = self.image.get_rect(topleft=(8, 8))
+        self.refresh()
+
+    def endframe(self):
+        """Count a rendered frame, refreshing the readout every interval frames so that the overlay doesn't repaint its
+        area every frame. This is called from the draw path rather than as the sprite's update(), which runs once per
+        simulation tick: several times in a frame that catches up, and not at all in frames drawn between ticks."""
+        self.wait -= 1
+        if self.wait <= 0:
+            self.wait = self.interval
+            self.refresh()
+
+    def refresh(self):
+        image = pygame.Surface(self.rect.size)
+        image.fill((16, 16, 32))
+        summary = self.profiler.summary()
+        lines = ['profiler: no frames yet']
+        if summary['frames']:
+            lines = ['%5.1f fps   %6.2f ms   worst %6.2f ms' % (summary['fps'], summary['frame_ms'],
+                                                                 summary['worst_ms'])]
+            lines += ['%-10s %7.3f ms' % item for item in sorted(summary['phases_ms'].items())]
+            lines += ['%-10s %7.1f / frame' % item for item in sorted(summary['counters'].items())]
+        for row, line in enumerate(lines[:10]):
+            image.blit(self.font.render(line, True, (224, 224, 224)), (6, 4 + 14 * row))
+
+        # Graph the recent frame times; the line marks the budget.
+        graph = pygame.Rect(6, 150, self.rect.width - 12, 44)
+        pygame.draw.line(image, (128, 48, 48), (graph.left, graph.centery), (graph.right, graph.centery))
+        frames = list(self.profiler.frames)[-graph.width:]
+        for x, seconds in enumerate(frames):
+            height = min(graph.height, int(graph.height / 2 * seconds / BUDGET))
+            colour = (96, 200, 96) if seconds <= BUDGET else (220, 96, 64)
+            pygame.draw.line(image, colour, (graph.left + x, graph.bottom), (graph.left + x, graph.bottom - height))
+        self.image = image
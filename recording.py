@@ -0,0 +1,100 @@
+"""Records the game's input so that a play session can be replayed exactly. A recording is a text file of JSON lines:
+        header      {"format": 1, "map": filename, "seed": seed, "tickrate": TICKRATE, "snapshot": record}
+        events      {"tick": n, "type": "down" or "up", "key": key}, one per key event, in the order they arrived
+        footer      {"end": ticks, "state": Overworld.state()} when the session ended
+Each event is stamped with the number of simulation ticks that had run when it arrived, so it takes effect before tick
+n + 1 however fast the session was rendered. Together with the seed, that's all the simulation needs to repeat itself.
+A session that continued from a saved game also needs the state it started from: the header's optional "snapshot" is
+the saved game as a savegame record, base64-encoded, and is restored before the first tick.
+
+Record a session with 'python mirrorgame.py --record walk.rec', and play it back with 'python replay.py walk.rec'."""
+
+import base64
+import json
+import pygame
+import savegame
+
+from typing import *
+
+FORMAT = 1  # Bump this whenever the recording format changes.
+EVENT_TYPES = {pygame.KEYDOWN: 'down', pygame.KEYUP: 'up'}  # The event types that are recorded, and their names in recordings.
+
+
+class Recording:
+    """A recording loaded from disk."""
+    map: str  # The map file the session started on.
+    seed: int  # The seed for the overworld's random number generator.
+    tickrate: int  # The simulation rate the session was recorded at.
+    snapshot: Optional[savegame.Snapshot]  # The saved game the session continued from, if any.
+    events: List[Tuple[int, int, int]]  # (tick, event type, key) for each recorded event.
+    ticks: Optional[int]  # The number of ticks the session ran for, or None if it didn't end cleanly.
+    state: Optional[Dict[str, Any]]  # The simulation state at the end of the session, if it ended cleanly.
+
+    def __init__(self, path: str):
+        names = {name: type for type, name in EVENT_TYPES.items()}
+        self.events = list()
+        self.ticks = None
+        self.state = None
+        with open(path) as file:
+            header = json.loads(file.readline())
+            if header.get('format') != FORMAT:
+                raise ValueError('%s is not a version %d recording.' % (path, FORMAT))
+            self.map = header['map']
+            self.seed = header['seed']
+            self.tickrate = header['tickrate']
+            self.snapshot = None
+            if header.get('snapshot') is not None:
+                record = base64.b64decode(header['snapshot'])
+                payload = next(savegame.records(record), None)
+                if payload is None:
+                    raise ValueError('%s holds a damaged snapshot.' % path)
+                self.snapshot = savegame.decode(record[payload[0]:payload[1]])
+            for line in file:
+                entry = json.loads(line)
+                if 'end' in entry:
+                    self.ticks = entry['end']
+                    self.state = entry['state']
+                    break
+                self.events.append((entry['tick'], names[entry['type']], entry['key']))
+
+        if self.ticks is None:
+            # The session crashed or was killed; replay up to the last recorded event.
+            self.ticks = self.events[-1][0] if self.events else 0
+
+    def bytick(self) -> Dict[int, List[Tuple[int, int]]]:
+        """Group the events by the tick they take effect before, as (event type, key) pairs."""
+        events = dict()
+        for tick, type, key in self.events:
+            events.setdefault(tick, list()).append((type, key))
+        return events
+
+
+class InputRecorder:
+    """Writes input events to a recording as they arrive. Lines are flushed as they're written, so a recording survives
+    the game crashing."""
+    file: Optional[TextIO]  # The recording being written, or None once it has been closed.
+
+    def __init__(self, path: str, map: str, seed: int, tickrate: int = 60, snapshot: savegame.Snapshot = None):
+        # snapshot: The saved game the session continues from, if it didn't start from a fresh overworld.
+        self.file = open(path, 'w')
+        header = {'format': FORMAT, 'map': map, 'seed': seed, 'tickrate': tickrate}
+        if snapshot is not None:
+            header['snapshot'] = base64.b64encode(savegame.encode(snapshot)).decode('ascii')
+        self.write(header)
+
+    def write(self, entry: Dict[str, Any]):
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def record(self, tick: int, event: pygame.event.Event):
+        """Record an event that arrived after the given number of ticks. Events other than key presses are ignored."""
+        name = EVENT_TYPES.get(event.type)
+        if name is not None and self.file is not None:
+            self.write({'tick': tick, 'type': name, 'key': event.key})
+
+    def close(self, ticks: int, state: Dict[str, Any]):
+        """Finish the recording with the number of ticks run and the final simulation state."""
+        if self.file is not None:
+            self.write({'end': ticks, 'state': state})
+            self.file.close()
+            self.file = None
@@ -0,0 +1,127 @@
+"""Plays back a recording made with 'python mirrorgame.py --record PATH', headless and as fast as possible. The
+recording's events are fed to the overworld on the ticks they originally arrived on, with the original seed, so the
+simulation ends in exactly the state it was recorded in however long each frame takes. One frame is drawn per tick.
+
+The final state is checked against the recording's, and each phase is timed as in benchmark.py, so two builds can be
+compared on the same walk-through:
+        python replay.py walk.rec --output before.json
+        python replay.py walk.rec --output after.json --baseline before.json
+The exit status is 1 if the final state doesn't match the recording or the baseline."""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+# The dummy drivers must be selected before pygame is imported.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import benchmark
+import pygame
+import mirrorgame
+import recording
+
+from pygame.locals import *
+from typing import *
+
+PHASES = ('events', 'update', 'draw', 'present', 'frame')
+
+
+def replay(path: str) -> Dict[str, Any]:
+    """Play back a recording and return the final state and timings."""
+    session = recording.Recording(path)
+    if session.tickrate != mirrorgame.TICKRATE:
+        print('Warning: %s was recorded at %d ticks per second, not %d.' % (path, session.tickrate,
+                                                                           mirrorgame.TICKRATE))
+    display = mirrorgame.opendisplay()
+    timings = {phase: list() for phase in PHASES}
+    clock = time.perf_counter
+
+    overworld = mirrorgame.Overworld(display, session.map, session.seed)
+    if session.snapshot is not None:
+        overworld.restore(session.snapshot)  # The session continued from a saved game.
+    overworld.present(overworld.draw())
+    events = session.bytick()
+    for tick in range(session.ticks):
+        framestart = start = clock()
+        for type, key in events.get(tick, ()):
+            if key == K_ESCAPE:
+                continue  # Escape quits the game; the recording ends here anyway.
+            overworld.handleevent(pygame.event.Event(type, key=key))
+        timings['events'].append(clock() - start)
+
+        start = clock()
+        overworld.update()
+        timings['update'].append(clock() - start)
+
+        start = clock()
+        rects = overworld.draw()
+        timings['draw'].append(clock() - start)
+
+        start = clock()
+        overworld.present(rects)
+        end = clock()
+        timings['present'].append(end - start)
+        timings['frame'].append(end - framestart)
+
+    overworld.loader.stop()
+    return {
+        'benchmark': 'replay',
+        'recording': path,
+        'map': session.map,
+        'seed': session.seed,
+        'ticks': session.ticks,
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'state': overworld.state(),
+        'expected_state': session.state,
+        'phases': {phase: benchmark.summarize(samples) for phase, samples in timings.items()},
+    }
+
+
+def diffstate(state: Dict[str, Any], expected: Dict[str, Any]) -> List[str]:
+    """Describe each difference between two simulation states."""
+    return ['%s: %r, expected %r' % (key, state.get(key), expected.get(key))
+            for key in sorted(state.keys() | expected.keys()) if state.get(key) != expected.get(key)]
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Replay a recorded session headless and time each phase.')
+    parser.add_argument('recording', help='the recording to play back')
+    parser.add_argument('--output', default='replay.json', help='where to write the results')
+    parser.add_argument('--baseline', help='earlier results to compare the final state and timings against')
+    args = parser.parse_args(argv)
+
+    results = replay(args.recording)
+    with open(args.output, 'w') as out:
+        json.dump(results, out, indent=2)
+
+    status = 0
+    if results['expected_state'] is not None:
+        differences = diffstate(results['state'], results['expected_state'])
+        for difference in differences:
+            print('State differs from the recording: %s' % difference)
+        status = 1 if differences else status
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        differences = diffstate(results['state'], baseline['state'])
+        for difference in differences:
+            print('State differs from the baseline: %s' % difference)
+        status = 1 if differences else status
+        benchmark.compare(results, baseline)
+    else:
+        for phase, stats in results['phases'].items():
+            print('%-16s p50 %8.3f ms   p99 %8.3f ms' % (phase, stats['p50'], stats['p99']))
+    print('%d ticks replayed; results written to %s' % (results['ticks'], args.output))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,246 @@
+"""Saves and loads snapshots of the game's logical state: which map the party is on and where, the party itself, and
+any tiles that have been changed since the map was loaded. Nothing derived from assets is stored; a snapshot names
+the map and tile IDs, and loading one rebuilds them from the same caches the game uses, so snapshots stay small.
+
+A save file is a log of snapshots, each appended as one record:
+        Record header:  magic (4s), format version (H), payload length (I), payload CRC-32 (I)
+        Payload:        map filename, map seed (q), ticks (Q), player x (i), y (i), facing (B),
+                        party member count (H), then for each member:
+                            name, job, level (H), HP (i), MP (i), spell count (H), then each spell ID
+                        changed tile count (I), then for each tile: layer (B), x (H), y (H), tile ID
+Strings are stored as in compiled maps: a length (H) followed by that many bytes of UTF-8.
+
+Loading takes the last complete record whose checksum matches, so a write cut short by a crash only loses that one
+snapshot. An autosave only appends a record to the end of the file; once the file holds MAX_RECORDS of them, it is
+rewritten with just the latest, through a temporary file and os.replace() so that no reader sees it half-written."""
+
+import os
+import queue
+import struct
+import threading
+import zlib
+
+from mapcompiler import LENGTH, packstring
+from typing import *
+
+MAGIC = b'SOCS'  # Identifies a snapshot record.
+VERSION = 1  # Bump this whenever the snapshot format changes.
+MAX_RECORDS = 32  # The number of snapshots a save file can hold before it is compacted.
+SAVES_DIR = 'saves'  # The directory holding save files.
+AUTOSAVE = os.path.join(SAVES_DIR, 'autosave.socsave')  # The save file used for autosaves.
+
+RECORD = struct.Struct('<4sHII')
+POSITION = struct.Struct('<qQiiB')
+MEMBER = struct.Struct('<Hii')
+COUNT = struct.Struct('<H')
+EDITS = struct.Struct('<I')
+EDIT = struct.Struct('<BHH')
+
+
+class PartyMember:
+    """A party member's lasting state. Maximum HP, MP and other stats aren't stored; they come from the member's job
+    and level, through playercharacters.JOB_TABLES."""
+    name: str  # The character's name.
+    job: str  # The character's current job, a key of jobs_dict.
+    level: int  # The character's level.
+    hp: int  # Current HP.
+    mp: int  # Current MP.
+    spellbook: List[str]  # The spell IDs slotted in the character's spellbook.
+
+    def __init__(self, name: str, job: str, level: int = 1, hp: int = None, mp: int = None,
+                 spellbook: List[str] = None):
+        # hp, mp: Current HP and MP. If not given, the member starts with full HP and MP for their job and level.
+        # spellbook: The member's spells. If not given, the member starts with their job's starting spells.
+        self.name = name
+        self.job = job
+        self.level = level
+        stats = self.maxstats() if hp is None or mp is None else None
+        self.hp = hp if hp is not None else stats['hp']
+        self.mp = mp if mp is not None else stats['mp']
+        if spellbook is None:
+            import playercharacters
+            start = playercharacters.jobs_dict[job]['start_spells']
+            spellbook = [spell for learned in sorted(start) if learned <= level for spell in start[learned]]
+        self.spellbook = list(spellbook)
+
+    def maxstats(self) -> Dict[str, int]:
+        """Get the member's full stats for their job and level."""
+        import playercharacters
+        return playercharacters.JOB_TABLES[self.job].statsat(self.level)
+
+    def __eq__(self, other):
+        return isinstance(other, PartyMember) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return 'PartyMember(%r, %r, level=%d)' % (self.name, self.job, self.level)
+
+
+class Snapshot:
+    """The logical state of a game in progress."""
+    map: str  # The map file the party is on, or '' for a generated map.
+    seed: int  # The seed the map was generated from, if it was generated.
+    ticks: int  # The number of simulation ticks played.
+    position: Tuple[int, int]  # The player sprite's position, in world pixels.
+    facing: int  # The direction the player sprite is facing. 0 = South, 1 = North, 2 = West, 3 = East
+    party: List[PartyMember]  # The party, in order.
+    edits: Dict[Tuple[int, int, int], str]  # Tile IDs changed since the map was loaded, keyed by (layer, x, y), where
+    #   layer 0 is the background and layer 1 the foreground.
+
+    def __init__(self, map: str = '', seed: int = 0, ticks: int = 0, position: Tuple[int, int] = (0, 0),
+                 facing: int = 0, party: List[PartyMember] = None, edits: Dict[Tuple[int, int, int], str] = None):
+        self.map = map
+        self.seed = seed
+        self.ticks = ticks
+        self.position = position
+        self.facing = facing
+        self.party = list(party) if party is not None else list()
+        self.edits = dict(edits) if edits is not None else dict()
+
+    def __eq__(self, other):
+        return isinstance(other, Snapshot) and vars(self) == vars(other)
+
+
+def encode(snapshot: Snapshot) -> bytes:
+    """Encode a snapshot as a complete record, header included."""
+    chunks = [packstring(snapshot.map),
+              POSITION.pack(snapshot.seed, snapshot.ticks, snapshot.position[0], snapshot.position[1],
+                            snapshot.facing),
+              COUNT.pack(len(snapshot.party))]
+    for member in snapshot.party:
+        chunks.append(packstring(member.name))
+        chunks.append(packstring(member.job))
+        chunks.append(MEMBER.pack(member.level, member.hp, member.mp))
+        chunks.append(COUNT.pack(len(member.spellbook)))
+        chunks.extend(packstring(spell) for spell in member.spellbook)
+    chunks.append(EDITS.pack(len(snapshot.edits)))
+    for (layer, x, y), id in snapshot.edits.items():
+        chunks.append(EDIT.pack(layer, x, y))
+        chunks.append(packstring(id))
+
+    payload = b''.join(chunks)
+    return RECORD.pack(MAGIC, VERSION, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(payload: bytes) -> Snapshot:
+    """Decode a record's payload."""
+    offset = 0
+
+    def read(format: struct.Struct) -> tuple:
+        nonlocal offset
+        values = format.unpack_from(payload, offset)
+        offset += format.size
+        return values
+
+    def readstring() -> str:
+        nonlocal offset
+        length, = read(LENGTH)
+        value = payload[offset:offset + length].decode('utf-8')
+        offset += length
+        return value
+
+    snapshot = Snapshot(readstring())
+    snapshot.seed, snapshot.ticks, x, y, snapshot.facing = read(POSITION)
+    snapshot.position = (x, y)
+    for _ in range(read(COUNT)[0]):
+        name = readstring()
+        job = readstring()
+        level, hp, mp = read(MEMBER)
+        spellbook = [readstring() for _ in range(read(COUNT)[0])]
+        snapshot.party.append(PartyMember(name, job, level, hp, mp, spellbook))
+    for _ in range(read(EDITS)[0]):
+        layer, x, y = read(EDIT)
+        snapshot.edits[(layer, x, y)] = readstring()
+    return snapshot
+
+
+def records(data: bytes) -> Iterator[Tuple[int, int]]:
+    """Find the complete, intact records in the contents of a save file. Yields the start and end of each payload.
+    Reading stops at the first record that is cut short, damaged, or of another version."""
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        magic, version, length, checksum = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        end = start + length
+        if magic != MAGIC or version != VERSION or end > len(data) or zlib.crc32(data[start:end]) != checksum:
+            return
+        yield start, end
+        offset = end
+
+
+def load(path: str) -> Optional[Snapshot]:
+    """Load the latest snapshot in a save file. Returns None if the file holds no intact snapshot."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    last = None
+    for last in records(data):
+        pass
+    return decode(data[last[0]:last[1]]) if last is not None else None
+
+
+def save(path: str, snapshot: Snapshot):
+    """Append a snapshot to a save file, creating it if needed. When the file is full, or ends in a damaged record,
+    it is replaced with a file holding only this snapshot instead."""
+    record = encode(snapshot)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        data = b''
+
+    count = 0
+    end = 0
+    for _, end in records(data):
+        count += 1
+    if count < MAX_RECORDS and end == len(data):
+        with open(path, 'ab') as out:
+            out.write(record)
+            out.flush()
+            os.fsync(out.fileno())
+        return
+
+    temp = path + '.tmp'
+    with open(temp, 'wb') as out:
+        out.write(record)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp, path)
+
+
+class SaveWriter:
+    """Writes snapshots on a background thread, so that saving never holds up a frame. Taking the snapshot is left to
+    the caller, on the main thread, so that it is consistent; only encoding and writing happen in the background."""
+    requests: queue.Queue  # (path, snapshot) pairs to write, or None to stop the worker.
+    worker: threading.Thread  # The thread doing the writing.
+    errors: List[BaseException]  # Errors raised by writes, kept for the main thread to report.
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.errors = list()
+        self.worker = threading.Thread(target=self.work, name='SaveWriter', daemon=True)
+        self.worker.start()
+
+    def work(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            try:
+                save(*request)
+            except Exception as error:
+                self.errors.append(error)
+            finally:
+                self.requests.task_done()
+
+    def submit(self, path: str, snapshot: Snapshot):
+        """Queue a snapshot to be written."""
+        self.requests.put((path, snapshot))
+
+    def flush(self):
+        """Wait for every queued snapshot to be written."""
+        self.requests.join()
+
+    def stop(self):
+        """Write any queued snapshots, then stop the worker thread."""
+        self.requests.put(None)
+        self.worker.join()
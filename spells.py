@@ -17,6 +17,13 @@
         6: Blizzard,
 """
 
+import sys
+
+from typing import *
+
+MAX_TABLE_LEVEL = 99  # The highest character level covered by the precomputed damage table.
+MAX_TABLE_POTENCY = 255  # The highest spell potency covered by the precomputed damage table.
+
 # The dictionary of all spells in the game
 spells_dict = {
     'lessermend': {
@@ -30,6 +37,123 @@ spells_dict = {
 }
 
 
+# A spell record, built from an entry in spells_dict. Spell objects are immutable and shared by every catalogue query
+# that returns them, like Tile objects in mirrorgame.
+class Spell:
+    __slots__ = ('id', 'name', 'category', 'flags', 'allowed_jobs', 'rank', 'potency')
+    id: str  # The spell's key in spells_dict.
+    name: str  # The name of the spell.
+    category: str  # Which school of magic the spell belongs to.
+    flags: FrozenSet[str]  # Flags describing how the spell behaves.
+    allowed_jobs: FrozenSet[str]  # Classes that can slot this spell.
+    rank: int  # The spell slot rank, from 1 to 7.
+    potency: int  # Potency coefficient for the spell.
+
+    def __init__(self, id: str, entry: Dict[str, Any]):
+        object.__setattr__(self, 'id', sys.intern(id))
+        object.__setattr__(self, 'name', entry['name'])
+        object.__setattr__(self, 'category', sys.intern(entry['category']))
+        object.__setattr__(self, 'flags', frozenset(sys.intern(flag) for flag in entry['flags']))
+        object.__setattr__(self, 'allowed_jobs', frozenset(sys.intern(job) for job in entry['allowed_jobs']))
+        object.__setattr__(self, 'rank', int(entry['rank']))
+        object.__setattr__(self, 'potency', int(entry['potency']))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Spell objects are shared between catalogue queries and cannot be modified.')
+
+    def __repr__(self):
+        return 'Spell(%r)' % self.id
+
+
+class SpellCatalogue:
+    """The spells in spells_dict, indexed for lookup by job, category, rank and flag. Each index maps a value to the
+    set of spell IDs having it, so a compound query only intersects a few sets instead of scanning every spell."""
+    spells: Dict[str, Spell]  # Every spell, keyed by ID, in order of rank and then name.
+    byjob: Dict[str, FrozenSet[str]]  # The spells each job can slot.
+    bycategory: Dict[str, FrozenSet[str]]  # The spells in each school of magic.
+    byrank: Dict[int, FrozenSet[str]]  # The spells of each rank.
+    byflag: Dict[str, FrozenSet[str]]  # The spells with each flag.
+
+    def __init__(self, spells: Dict[str, Dict[str, Any]] = None):
+        if spells is None:
+            spells = spells_dict
+        self.build(Spell(id, entry) for id, entry in spells.items())
+
+    def build(self, spells: Iterable[Spell]):
+        """Index a collection of Spell records, replacing whatever the catalogue held before."""
+        records = sorted(spells, key=lambda spell: (spell.rank, spell.name))
+        self.spells = {spell.id: spell for spell in records}
+
+        def index(keys: Callable[[Spell], Iterable]) -> Dict[Any, FrozenSet[str]]:
+            sets = dict()
+            for spell in records:
+                for key in keys(spell):
+                    sets.setdefault(key, set()).add(spell.id)
+            return {key: frozenset(ids) for key, ids in sets.items()}
+
+        self.byjob = index(lambda spell: spell.allowed_jobs)
+        self.bycategory = index(lambda spell: (spell.category,))
+        self.byrank = index(lambda spell: (spell.rank,))
+        self.byflag = index(lambda spell: spell.flags)
+
+    def __len__(self):
+        return len(self.spells)
+
+    def __getitem__(self, id: str) -> Spell:
+        return self.spells[id]
+
+    def ranksbetween(self, minrank: Optional[int], maxrank: Optional[int]) -> Optional[FrozenSet[str]]:
+        """Get the spells with ranks in a range, or None if the range is unbounded."""
+        if minrank is None and maxrank is None:
+            return None
+        low = minrank if minrank is not None else min(self.byrank, default=0)
+        high = maxrank if maxrank is not None else max(self.byrank, default=0)
+        return frozenset().union(*(ids for rank, ids in self.byrank.items() if low <= rank <= high))
+
+    def query(self, job: str = None, category: str = None, rank: int = None, minrank: int = None,
+              maxrank: int = None, flags: Iterable[str] = ()) -> List[Spell]:
+        """Find the spells matching every given condition, in order of rank and then name. For example, the Nature
+        spells a Mage can slot at rank 3 or lower are query(job='Mage', category='Nature', maxrank=3). A spell must
+        have all of the given flags."""
+        if rank is not None:
+            minrank = maxrank = rank
+        candidates = [self.ranksbetween(minrank, maxrank)]
+        if job is not None:
+            candidates.append(self.byjob.get(job, frozenset()))
+        if category is not None:
+            candidates.append(self.bycategory.get(category, frozenset()))
+        candidates.extend(self.byflag.get(flag, frozenset()) for flag in flags)
+        candidates = sorted((ids for ids in candidates if ids is not None), key=len)
+        if not candidates:
+            return list(self.spells.values())
+
+        # Intersect the smallest sets first, so the working set only shrinks.
+        ids = candidates[0]
+        for other in candidates[1:]:
+            if not ids:
+                break
+            ids = ids & other
+        return sorted((self.spells[id] for id in ids), key=lambda spell: (spell.rank, spell.name))
+
+
+SPELLS = SpellCatalogue()  # The catalogue of every spell in spells_dict.
+
+
+def reloadspells(spells: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Replace the contents of spells_dict, e.g. with spells read from an edited copy of this file, and re-index SPELLS.
+    Only the spells that were added or changed get new Spell records; the rest keep theirs. spells_dict and SPELLS are
+    updated in place, so modules holding them see the change. Raises an error, changing nothing, if a changed spell is
+    malformed. Returns the IDs of the spells that were added, changed or removed."""
+    from hotreload import changedkeys
+    changed = changedkeys(spells_dict, spells)
+    records = {id: Spell(id, spells[id]) for id in changed if id in spells}
+    records = [records[id] if id in records else SPELLS[id] for id in spells]
+    spells_dict.clear()
+    spells_dict.update(spells)
+    SPELLS.build(records)
+    return changed
+
+
 def spelldamage(primarystat: int, level: int, potency: int) -> int:
     """Calculate direct damage and direct healing for spells based on potency. Damage is calculated based on the
     following formula, where L is character level, S is the primary stat used by the relevant school of magic, and
@@ -44,3 +168,58 @@ def spelldamage(primarystat: int, level: int, potency: int) -> int:
     f2 = float(primarystat / 100.0)
     output = f1 + (f1 * f2)
     return int(output)
+
+
+_BASE_TABLE = None  # The precomputed base damage table, built the first time it is needed.
+
+
+def basedamagetable() -> 'numpy.ndarray':
+    """Get the table of base damage, X = P + P((L^2)/2) from spelldamage(), indexed by level then potency, for levels
+    0 to MAX_TABLE_LEVEL and potencies 0 to MAX_TABLE_POTENCY. The table is built the first time it is asked for."""
+    global _BASE_TABLE
+    if _BASE_TABLE is None:
+        import numpy as np
+        levels = np.arange(MAX_TABLE_LEVEL + 1, dtype=np.int64)
+        potencies = np.arange(MAX_TABLE_POTENCY + 1, dtype=np.int64)
+        table = ((levels ** 2) // 2)[:, np.newaxis] * potencies + potencies
+        table.setflags(write=False)
+        _BASE_TABLE = table
+    return _BASE_TABLE
+
+
+def spellpotencies(spells: Sequence[str]) -> 'numpy.ndarray':
+    """Look up the potency of each of a sequence of spell IDs in spells_dict."""
+    import numpy as np
+    return np.array([spells_dict[spell]['potency'] for spell in spells], dtype=np.int64)
+
+
+def spelldamages(primarystats, levels, potencies=None, spells: Sequence[str] = None) -> 'numpy.ndarray':
+    """Calculate direct damage and direct healing for many casts at once, with the same formula and integer
+    truncation as spelldamage(), so that every result matches it exactly. primarystats, levels and potencies can be
+    scalars or arrays, and are broadcast against each other. Instead of potencies, spells can give a spell ID from
+    spells_dict for each cast; give one or the other, not both. Returns an int64 array of results.
+
+    Base damage for levels and potencies within the precomputed table is looked up; the rest is calculated."""
+    import numpy as np
+    if potencies is None:
+        if spells is None:
+            raise ValueError('Either potencies or spells must be given.')
+        potencies = spellpotencies(spells)
+    elif spells is not None:
+        raise ValueError('Give either potencies or spells, not both.')
+    primarystats, levels, potencies = np.broadcast_arrays(np.asarray(primarystats, dtype=np.int64),
+                                                          np.asarray(levels, dtype=np.int64),
+                                                          np.asarray(potencies, dtype=np.int64))
+
+    # X = P + P((L^2)/2), where int() truncates the halved square toward zero. Squares are never negative, so this is
+    # floor division.
+    intable = (levels >= 0) & (levels <= MAX_TABLE_LEVEL) & (potencies >= 0) & (potencies <= MAX_TABLE_POTENCY)
+    if intable.all():
+        f1 = basedamagetable()[levels, potencies]
+    else:
+        f1 = (levels ** 2) // 2 * potencies + potencies
+
+    # output = X + X(S/100), worked in double precision in the same order as spelldamage(), then truncated toward zero.
+    f2 = primarystats / 100.0
+    output = f1 + f1 * f2
+    return np.trunc(output).astype(np.int64)
@@ -0,0 +1,83 @@
+"""Checks that compiled maps hold exactly what was compiled into them, and that .ini files round-trip too."""
+
+import mapcompiler
+import mapgen
+import pytest
+import threading
+
+from array import array
+from mapcompiler import MapData
+
+
+def sample() -> MapData:
+    data = MapData(5, 3)
+    data.zone = 'Salkston'
+    data.name = 'North Square'
+    data.encounter_rate = 4
+    data.encounter_set = 'wolves'
+    data.weather = 'snow'
+    data.tileids = [mapcompiler.NULL_TILE, '0000ts@snow', '0101fs@snow', '0404ts@snow']
+    data.backtiles = array('H', [1, 1, 2, 1, 3, 1, 2, 2, 1, 1, 3, 3, 1, 1, 2])
+    data.foretiles = array('H', [0, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0, 2, 0, 0, 0])
+    data.spawns = {'Start': (2, 1), 'WpnShop': (4, 0)}
+    data.links = {'WpnShop': 'wpnshopsalkstonmap.ini'}
+    return data
+
+
+def test_compiled_round_trip(tmp_path):
+    for data in (sample(), mapgen.generate(11, 40, 30, 'cave')):
+        target = str(tmp_path / 'map.socmap')
+        mapcompiler.writecompiled(data, target)
+        assert vars(mapcompiler.readcompiled(target)) == vars(data)
+
+
+def test_unnamed_map_round_trip(tmp_path):
+    data = sample()
+    data.name = None
+    target = str(tmp_path / 'map.socmap')
+    mapcompiler.writecompiled(data, target)
+    assert mapcompiler.readcompiled(target).name is None
+
+
+def test_ini_round_trip(tmp_path):
+    data = sample()
+    source = tmp_path / 'map.ini'
+    source.write_text(mapcompiler.formatini(data))
+    assert vars(mapcompiler.parseini(str(source))) == vars(data)
+
+
+def test_stale_compiled_copy_is_rebuilt(tmp_path, monkeypatch):
+    maps = tmp_path / 'maps'
+    maps.mkdir()
+    monkeypatch.setattr(mapcompiler, 'MAPS_DIR', str(maps))
+    monkeypatch.setattr(mapcompiler, 'COMPILED_DIR', str(maps / 'compiled'))
+    data = sample()
+    (maps / 'map.ini').write_text(mapcompiler.formatini(data))
+    assert vars(mapcompiler.loadmap('map.ini')) == vars(data)
+    assert mapcompiler.isfresh(str(maps / 'map.ini'), mapcompiler.compiledpath('map.ini'))
+
+    data.encounter_rate = 9
+    (maps / 'map.ini').write_text(mapcompiler.formatini(data) + '\n')  # A different size marks the source changed.
+    assert not mapcompiler.isfresh(str(maps / 'map.ini'), mapcompiler.compiledpath('map.ini'))
+    assert mapcompiler.loadmap('map.ini').encounter_rate == 9
+
+
+def test_damaged_compiled_copy_is_rejected(tmp_path):
+    target = str(tmp_path / 'map.socmap')
+    mapcompiler.writecompiled(sample(), target)
+    with open(target, 'r+b') as file:
+        file.write(b'XXXX')
+    with pytest.raises(ValueError):
+        mapcompiler.readcompiled(target)
+
+
+def test_concurrent_writes(tmp_path):
+    data = sample()
+    target = str(tmp_path / 'map.socmap')
+    threads = [threading.Thread(target=mapcompiler.writecompiled, args=(data, target)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert vars(mapcompiler.readcompiled(target)) == vars(data)
+    assert [path.name for path in tmp_path.iterdir()] == ['map.socmap']
@@ -0,0 +1,67 @@
+"""Checks map generation: region labelling against a plain breadth-first search, and what generated maps promise."""
+
+import mapgen
+import numpy as np
+
+from collections import deque
+
+
+def bfsregions(passable: np.ndarray) -> np.ndarray:
+    """Label connected regions by flooding from each unlabelled passable tile in turn."""
+    height, width = passable.shape
+    labels = np.full(passable.shape, -1)
+    count = 0
+    for y, x in zip(*np.nonzero(passable)):
+        if labels[y, x] != -1:
+            continue
+        labels[y, x] = count
+        frontier = deque([(y, x)])
+        while frontier:
+            cy, cx = frontier.popleft()
+            for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                if 0 <= ny < height and 0 <= nx < width and passable[ny, nx] and labels[ny, nx] == -1:
+                    labels[ny, nx] = count
+                    frontier.append((ny, nx))
+        count += 1
+    return labels
+
+
+def samepartition(labels: np.ndarray, expected: np.ndarray) -> bool:
+    """Check that two labellings group tiles identically, whatever the label values."""
+    if not ((labels == -1) == (expected == -1)).all():
+        return False
+    pairs = set(zip(labels[labels != -1].tolist(), expected[expected != -1].tolist()))
+    return len(pairs) == len({a for a, _ in pairs}) == len({b for _, b in pairs})
+
+
+def test_regions_match_bfs():
+    rng = np.random.RandomState(5)
+    for fill in (0.2, 0.4, 0.5, 0.6, 0.8):
+        for shape in ((1, 1), (1, 17), (17, 1), (24, 31), (64, 48)):
+            passable = rng.random_sample(shape) > fill
+            assert samepartition(mapgen.regions(passable), bfsregions(passable))
+
+
+def test_regions_of_caves_match_bfs():
+    for seed in range(4):
+        passable = ~mapgen.cellular(np.random.RandomState(seed), 80, 60)
+        assert samepartition(mapgen.regions(passable), bfsregions(passable))
+
+
+def test_regions_edge_cases():
+    assert (mapgen.regions(np.zeros((4, 5), bool)) == -1).all()
+    assert len(np.unique(mapgen.regions(np.ones((4, 5), bool)))) == 1
+
+
+def test_generated_maps_are_connected_and_repeatable():
+    for kind in mapgen.KINDS:
+        for seed in (0, 1, 99):
+            passable = mapgen.terrain(seed, 48, 36, kind)
+            assert passable.any()
+            assert len(np.unique(mapgen.regions(passable)[passable])) == 1
+            assert (mapgen.terrain(seed, 48, 36, kind) == passable).all()
+
+            data = mapgen.generate(seed, 48, 36, kind)
+            x, y = data.spawns[mapgen.START]
+            assert passable[y, x]
+            assert data.weather == mapgen.WEATHER[kind]
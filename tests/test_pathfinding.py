@@ -0,0 +1,83 @@
+"""Checks that cached flow fields stay correct as tiles change, and that A* finds paths as short as the fields do."""
+
+import numpy as np
+
+from pathfinding import UNREACHABLE, FlowField, Pathfinder
+
+
+class Grid:
+    """A stand-in for a CollisionGrid: a blocked flag per tile, and watchers told when one flips."""
+
+    def __init__(self, blocked: np.ndarray):
+        self.height, self.width = blocked.shape
+        self.blocked = bytearray(blocked.astype(np.uint8).tobytes())
+        self.watchers = list()
+
+    def set(self, x: int, y: int, blocked: bool):
+        if self.blocked[y * self.width + x] != blocked:
+            self.blocked[y * self.width + x] = blocked
+            for watcher in self.watchers:
+                watcher(x, y)
+
+
+def test_cached_fields_match_fresh_fields_after_edits():
+    rng = np.random.RandomState(3)
+    grid = Grid(rng.random_sample((20, 28)) < 0.3)
+    paths = Pathfinder(grid, capacity=64)
+    goals = [(int(x), int(y)) for x, y in zip(rng.randint(0, grid.width, 12), rng.randint(0, grid.height, 12))]
+    for edit in range(300):
+        for goal in goals:
+            cached = paths.flowfield(goal)
+            fresh = FlowField(goal, grid.width, grid.height, grid.blocked)
+            assert cached.distances == fresh.distances, (edit, goal)
+        x, y = int(rng.randint(grid.width)), int(rng.randint(grid.height))
+        grid.set(x, y, not grid.blocked[y * grid.width + x])
+
+
+def test_unaffected_fields_are_kept():
+    blocked = np.zeros((10, 21), bool)
+    blocked[:, 10] = True  # A wall splitting the grid in two.
+    grid = Grid(blocked)
+    paths = Pathfinder(grid)
+    left = paths.flowfield((2, 5))
+    grid.set(17, 3, True)  # Beyond the wall, where the left field can't reach.
+    assert paths.flowfield((2, 5)) is left
+    grid.set(9, 3, True)  # Inside the left field.
+    assert paths.flowfield((2, 5)) is not left
+
+
+def test_steps_follow_the_field_to_the_goal():
+    rng = np.random.RandomState(8)
+    grid = Grid(rng.random_sample((16, 16)) < 0.25)
+    paths = Pathfinder(grid)
+    goal = (8, 8)
+    grid.set(*goal, False)
+    field = paths.flowfield(goal)
+    for y in range(grid.height):
+        for x in range(grid.width):
+            distance = field.distance(x, y)
+            if distance == UNREACHABLE:
+                continue
+            tile = (x, y)
+            for _ in range(distance):
+                tile = field.step(*tile)
+                assert not grid.blocked[tile[1] * grid.width + tile[0]]
+            assert tile == goal
+
+
+def test_astar_paths_are_as_short_as_flow_fields():
+    rng = np.random.RandomState(12)
+    grid = Grid(rng.random_sample((24, 32)) < 0.3)
+    for trial in range(40):
+        start = (int(rng.randint(grid.width)), int(rng.randint(grid.height)))
+        goal = (int(rng.randint(grid.width)), int(rng.randint(grid.height)))
+        path = Pathfinder(grid).findpath(start, goal)  # A fresh pathfinder has no field to read the path from.
+        distance = FlowField(goal, grid.width, grid.height, grid.blocked).distance(*start)
+        if grid.blocked[start[1] * grid.width + start[0]] or distance == UNREACHABLE:
+            assert path is None
+            continue
+        assert len(path) - 1 == distance
+        assert path[0] == start and path[-1] == goal
+        for (ax, ay), (bx, by) in zip(path, path[1:]):
+            assert abs(ax - bx) + abs(ay - by) == 1
+            assert not grid.blocked[by * grid.width + bx]
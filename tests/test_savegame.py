@@ -0,0 +1,85 @@
+"""Checks that snapshots survive saving and loading, and that a damaged save file still loads its last good snapshot."""
+
+import os
+import savegame
+
+from savegame import PartyMember, Snapshot
+
+
+def sample(ticks: int = 1234) -> Snapshot:
+    party = [PartyMember('Anna', 'Mage', 7, 95, 210, ['lessermend', 'freeze']),
+             PartyMember('Clara', 'Bard', 3, 40, 0, [])]
+    return Snapshot('northsalkstonmap.ini', 0, ticks, (352, -64), 3, party,
+                    {(0, 2, 5): '0101ts@snow', (1, 15, 11): '0404ts@snow'})
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'game.socsave')
+    snapshot = sample()
+    savegame.save(path, snapshot)
+    assert savegame.load(path) == snapshot
+
+    generated = Snapshot('', 2 ** 32 - 1, 5, (0, 0), 0)
+    savegame.save(path, generated)
+    assert savegame.load(path) == generated
+
+
+def test_latest_snapshot_is_loaded(tmp_path):
+    path = str(tmp_path / 'game.socsave')
+    for ticks in range(5):
+        savegame.save(path, sample(ticks))
+    assert savegame.load(path).ticks == 4
+
+
+def test_damaged_record_falls_back_to_previous(tmp_path):
+    path = str(tmp_path / 'game.socsave')
+    savegame.save(path, sample(1))
+    size = os.path.getsize(path)
+    savegame.save(path, sample(2))
+    with open(path, 'r+b') as file:
+        file.seek(size + savegame.RECORD.size + 3)  # A byte inside the second record's payload.
+        byte = file.read(1)
+        file.seek(-1, os.SEEK_CUR)
+        file.write(bytes([byte[0] ^ 0xFF]))
+    assert savegame.load(path).ticks == 1
+
+    # The next save replaces the damaged file rather than appending after the bad record.
+    savegame.save(path, sample(3))
+    assert savegame.load(path).ticks == 3
+    with open(path, 'rb') as file:
+        assert len(list(savegame.records(file.read()))) == 1
+
+
+def test_cut_short_record_falls_back_to_previous(tmp_path):
+    path = str(tmp_path / 'game.socsave')
+    savegame.save(path, sample(1))
+    savegame.save(path, sample(2))
+    with open(path, 'r+b') as file:
+        file.truncate(os.path.getsize(path) - 5)
+    assert savegame.load(path).ticks == 1
+
+
+def test_file_without_snapshots(tmp_path):
+    path = tmp_path / 'game.socsave'
+    path.write_bytes(b'not a save file')
+    assert savegame.load(str(path)) is None
+
+
+def test_full_file_is_compacted(tmp_path):
+    path = str(tmp_path / 'game.socsave')
+    for ticks in range(savegame.MAX_RECORDS + 1):
+        savegame.save(path, sample(ticks))
+    with open(path, 'rb') as file:
+        assert len(list(savegame.records(file.read()))) == 1
+    assert savegame.load(path).ticks == savegame.MAX_RECORDS
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_writer_saves_in_background(tmp_path):
+    path = str(tmp_path / 'saves' / 'auto.socsave')
+    writer = savegame.SaveWriter()
+    writer.submit(path, sample(7))
+    writer.flush()
+    writer.stop()
+    assert not writer.errors
+    assert savegame.load(path).ticks == 7
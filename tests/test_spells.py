@@ -0,0 +1,33 @@
+"""Checks that the batched damage calculation agrees with the scalar formula it replaces."""
+
+import numpy as np
+import pytest
+import spells
+
+
+def test_spelldamages_matches_spelldamage():
+    stats, levels, potencies = np.meshgrid(np.arange(0, 301, 7), np.arange(0, spells.MAX_TABLE_LEVEL + 1),
+                                           np.arange(0, spells.MAX_TABLE_POTENCY + 1, 5), indexing='ij')
+    expected = [spells.spelldamage(s, l, p) for s, l, p in zip(stats.ravel().tolist(), levels.ravel().tolist(),
+                                                               potencies.ravel().tolist())]
+    assert spells.spelldamages(stats, levels, potencies).ravel().tolist() == expected
+
+
+def test_spelldamages_beyond_the_table():
+    # Levels and potencies outside the precomputed table are calculated rather than looked up.
+    cases = [(50, spells.MAX_TABLE_LEVEL + 1, 30), (120, 40, spells.MAX_TABLE_POTENCY + 100), (-20, 12, 9)]
+    for stat, level, potency in cases:
+        assert spells.spelldamages(stat, level, potency).item() == spells.spelldamage(stat, level, potency)
+
+
+def test_spelldamages_by_spell_id():
+    potency = spells.spells_dict['lessermend']['potency']
+    assert spells.spelldamages([10, 80], [5, 30], spells=['lessermend'] * 2).tolist() == [
+        spells.spelldamage(10, 5, potency), spells.spelldamage(80, 30, potency)]
+
+
+def test_spelldamages_needs_exactly_one_source_of_potency():
+    with pytest.raises(ValueError):
+        spells.spelldamages(10, 5)
+    with pytest.raises(ValueError):
+        spells.spelldamages(10, 5, 30, spells=['lessermend'])
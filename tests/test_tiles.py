@@ -0,0 +1,44 @@
+"""Checks that tiles and maps load the same without a game window as with one, as tools and tests use them."""
+
+import os
+import pytest
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import mirrorgame
+import pygame
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    monkeypatch.chdir(ROOT)  # Assets are found relative to the repository.
+    mirrorgame.TILE_TYPES.clear()
+    mirrorgame.TILESETS.clear()
+    yield
+    mirrorgame.TILE_TYPES.clear()
+    mirrorgame.TILESETS.clear()
+
+
+def test_tiles_load_without_a_display():
+    assert pygame.display.get_surface() is None
+    tile = mirrorgame.gettile('0000ts@snow')
+    assert tile.valid and tile.passable
+    assert tile.image.get_size() == (mirrorgame.TILESIZE, mirrorgame.TILESIZE)
+    assert not mirrorgame.gettile('0101fs@snow').passable
+
+
+def test_invalid_tiles_are_not_interned():
+    tile = mirrorgame.gettile('0000ts@nowhere')
+    assert not tile.valid and not tile.passable
+    assert '0000ts@nowhere' not in mirrorgame.TILE_TYPES
+
+
+def test_collision_grid_matches_tiles():
+    map = mirrorgame.Map(mirrorgame.START_MAP)
+    grid = mirrorgame.CollisionGrid()
+    grid.build(map)
+    expected = [mirrorgame.CollisionGrid.isblocked(map, x, y) for y in range(map.height) for x in range(map.width)]
+    assert list(grid.blocked) == expected
+    assert 0 < sum(expected) < len(expected)